@@ -1,20 +1,35 @@
 from __future__ import annotations
 
-from fastapi import APIRouter
+from typing import Annotated
 
-from app.schemas.email import EmailRequest, SendEmailResponseStatus
-from app.services.email import send_email
+from fastapi import APIRouter, Header
+
+from app.schemas.email import BatchEmailRequest, BatchSendResponseStatus, EmailRequest, SendEmailResponseStatus
+from app.services.email import SchedulingDisabledError, send_email, send_email_batch
 
 router = APIRouter()
 
 
 @router.post("/", response_model=SendEmailResponseStatus)
-async def send_email_endpoint(request: EmailRequest):
+async def send_email_endpoint(request: EmailRequest, idempotency_key: Annotated[str | None, Header()] = None):
     try:
-        return await send_email(request)
+        return await send_email(request, idempotency_key=idempotency_key)
+    except SchedulingDisabledError as e:
+        return SendEmailResponseStatus(
+            code=501,
+            message="Scheduled delivery not available",
+            detail=str(e)
+        )
     except Exception as e:
         return SendEmailResponseStatus(
             code=500,
             message="Failed to send email",
             detail=str(e)
         )
+
+
+@router.post("/batch", response_model=BatchSendResponseStatus)
+async def send_email_batch_endpoint(request: BatchEmailRequest,
+                                    idempotency_key: Annotated[str | None, Header()] = None):
+    # Gli errori dei singoli destinatari sono riportati nei risultati, non come eccezioni
+    return await send_email_batch(request, idempotency_key=idempotency_key)
@@ -1,11 +1,14 @@
-import json
 import logging
+import time
 
 from aio_pika import IncomingMessage
 
-from app.schemas.email import EmailRequest
-from app.services.email import send_email
+from app.schemas.email import BatchEmailRequest, EmailEnvelope, email_message_adapter
+from app.services.broker import RETRY_ATTEMPT_HEADER, published_at
+from app.services.email import DELIVERED_CODES, send_email, send_email_batch
+from app.core import metrics
 from app.core.logging import get_logger
+from app.core.sentry import queue_transaction
 
 logger = get_logger(__name__)
 
@@ -14,30 +17,70 @@ async def on_email_message(message: IncomingMessage):
     """
     Callback che gestisce i messaggi dalla coda 'email'.
     Agisce come un controller: valida l'input e chiama il service.
+    Ack e retry sono gestiti da AsyncBrokerSingleton.subscribe.
+    L'elaborazione è tracciata come transazione Sentry collegata alla trace del producer.
     """
-    async with message.process():
-        try:
-            body = message.body.decode()
-            data = json.loads(body)
-
-            payload = data.get("data", data)
-
-            logger.info(f"Ricevuto task email per: {payload.get('to', 'unknown')}")
-
-            # Validazione (Pydantic)
-            email_request = EmailRequest(**payload)
-
-            # Chiamata al Service
-            # Se send_email fallisce, solleva eccezione e message.process() farà il nack (requeue)
-            result = await send_email(email_request)
-            
-            logger.info(f"Email inviata con successo via RabbitMQ: {result.detail}")
-
-        except (ValueError, TypeError, json.JSONDecodeError) as e:
-            # Errori di validazione o input malformato: NON riprovare.
-            # Uscendo dal blocco try senza sollevare eccezione, il context manager farà ack.
-            logger.error(f"Errore validazione/input task email: {e}. Messaggio scartato.")
-        except Exception as e:
-            # Errori transitori (es. connessione SMTP): Riprova (Nack + Requeue)
-            logger.error(f"Errore critico invio email: {e}. Il messaggio verrà riaccodato.", exc_info=True)
-            raise e
+    headers = message.headers or {}
+    enqueued_at = published_at(message)
+    with queue_transaction(
+        message.type or message.routing_key or "email",
+        headers,
+        queue_wait=time.time() - enqueued_at if enqueued_at is not None else None,
+        retry_attempt=int(headers.get(RETRY_ATTEMPT_HEADER, 0)),
+    ):
+        await process_email_message(message)
+
+
+async def process_email_message(message: IncomingMessage):
+    try:
+        # Validazione (Pydantic) direttamente dai bytes del body, senza str e dict intermedi
+        parsed = email_message_adapter.validate_json(message.body)
+
+        # L'id dell'envelope rende idempotente la consegna in caso di redelivery
+        if isinstance(parsed, EmailEnvelope):
+            email_request, message_id = parsed.data, parsed.id or message.message_id
+        else:
+            email_request, message_id = parsed, message.message_id
+
+        if isinstance(email_request, BatchEmailRequest):
+            await handle_batch(email_request, message_id)
+            return
+
+        logger.info("Ricevuto task email per: %s", email_request.to)
+
+        # Chiamata al Service
+        # Se send_email fallisce, solleva eccezione e il broker ripubblica il messaggio con backoff (o nella DLQ)
+        result = await send_email(email_request, idempotency_key=message_id)
+
+        logger.info("Email inviata con successo via RabbitMQ: %s", result.detail)
+
+    except (ValueError, TypeError) as e:
+        # Errori di validazione o input malformato (anche JSON non valido): NON riprovare.
+        # Uscendo senza sollevare eccezione, il broker farà ack.
+        logger.error(f"Errore validazione/input task email: {e}. Messaggio scartato.")
+        metrics.record_failure("consume", e)
+    except Exception as e:
+        # Errori transitori (es. connessione SMTP): Riprova con backoff esponenziale
+        logger.error(f"Errore critico invio email: {e}. Il messaggio verrà riprovato.", exc_info=True)
+        metrics.record_failure("consume", e)
+        raise e
+
+
+async def handle_batch(batch_request: BatchEmailRequest, message_id: str | None = None):
+    """
+    Gestisce un messaggio batch (template e oggetto condivisi, lista di destinatari).
+    Con un id del messaggio i destinatari già raggiunti vengono deduplicati, quindi il batch viene riprovato
+    se anche un solo invio fallisce; senza id viene riprovato solo se nessun destinatario è stato raggiunto.
+    """
+    logger.info("Ricevuto batch email per %d destinatari", len(batch_request.recipients))
+
+    result = await send_email_batch(batch_request, idempotency_key=message_id)
+
+    if result.sent == 0 or (result.failed and message_id is not None):
+        failed = next(r for r in result.results if r.code not in DELIVERED_CODES)
+        raise RuntimeError(f"{result.failed} email del batch non inviate: {failed.detail}")
+    if result.failed:
+        failed = ", ".join(r.to for r in result.results if r.code not in DELIVERED_CODES)
+        logger.error(f"Batch inviato parzialmente ({result.sent}/{result.sent + result.failed}). Falliti: {failed}")
+    else:
+        logger.info("Batch inviato con successo via RabbitMQ a %d destinatari", result.sent)
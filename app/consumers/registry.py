@@ -0,0 +1,60 @@
+from app.consumers import email as email_consumer
+from app.core.config import settings
+from app.services.lanes import BULK, TRANSACTIONAL, LaneScheduler
+
+# Exchange a cui il servizio si sottoscrive e relative callback
+exchanges = {
+    "email": email_consumer.on_email_message,
+}
+
+# Routing key (e quindi coda) di ogni lane: le email transazionali restano sulla routing key storica
+lanes = {
+    TRANSACTIONAL: settings.RABBITMQ_SEND_EMAIL_ROUTING_KEY,
+    BULK: settings.RABBITMQ_BULK_EMAIL_ROUTING_KEY,
+}
+
+# Scheduler condiviso dalle lane, creato da subscribe_all
+lane_scheduler: LaneScheduler | None = None
+
+
+async def subscribe_all(broker_instance, *, prefetch_count=None, concurrency=None, bulk_rate=None):
+    """Sottoscrive il broker a tutti gli exchange del servizio, con una coda per lane.
+
+    Gli slot di elaborazione (``concurrency``) sono condivisi dalle lane tramite un ``LaneScheduler``,
+    che serve per prima la lane transazionale.
+
+    Args:
+        broker_instance (AsyncBrokerSingleton): Broker già connesso.
+        prefetch_count (int | None): Prefetch per sottoscrizione (default: settings.CONSUMER_PREFETCH).
+        concurrency (int | None): Concorrenza totale delle lane (default: settings.CONSUMER_CONCURRENCY).
+        bulk_rate (float | None): Messaggi bulk al secondo (default: settings.BULK_RATE_LIMIT_PER_SECOND).
+
+    Returns:
+        LaneScheduler | None: Scheduler delle lane (None con concorrenza illimitata).
+    """
+    global lane_scheduler
+    if prefetch_count is None:
+        prefetch_count = settings.CONSUMER_PREFETCH
+    if concurrency is None:
+        concurrency = settings.CONSUMER_CONCURRENCY
+    if bulk_rate is None:
+        bulk_rate = settings.BULK_RATE_LIMIT_PER_SECOND
+
+    lane_scheduler = LaneScheduler(
+        concurrency,
+        bulk_max_share=settings.BULK_MAX_SHARE,
+        bulk_min=settings.BULK_MIN_CONCURRENCY,
+        bulk_rate=bulk_rate,
+    ) if concurrency > 0 else None
+
+    for exchange, cb in exchanges.items():
+        for lane, routing_key in lanes.items():
+            await broker_instance.subscribe(
+                exchange,
+                cb,
+                routing_key=routing_key,
+                prefetch_count=prefetch_count,
+                concurrency=concurrency,
+                limiter=lane_scheduler.limiter(lane) if lane_scheduler is not None else None,
+            )
+    return lane_scheduler
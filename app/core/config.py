@@ -1,22 +1,66 @@
+from pydantic import BaseModel
 from pydantic_settings import SettingsConfigDict, BaseSettings
 
 
+class RelaySettings(BaseModel):
+    """Relay SMTP aggiuntivo; username e password vuoti usano quelli di MAIL_USERNAME / MAIL_PASSWORD."""
+    server: str
+    port: int = 587
+    username: str = ""
+    password: str = ""
+    starttls: bool = True
+    ssl_tls: bool = False
+    weight: float = 1
+
+
+class DKIMKeySettings(BaseModel):
+    """Chiave DKIM di un dominio mittente (pubblicata in DNS come ``<selector>._domainkey.<domain>``)."""
+    domain: str
+    selector: str
+    private_key_path: str
+
+
 class Settings(BaseSettings):
     SERVICE_NAME: str = "email_service"
     SERVICE_VERSION: str = "0.1.0"
+    LOG_LEVEL: str = "INFO"
+    LOG_FORMAT: str = "text"  # "text" o "json" (una riga JSON per record)
+    LOG_RATE_LIMIT_PER_SECOND: float = 20  # righe INFO/DEBUG uguali ammesse al secondo, 0 = nessun limite
     RABBITMQ_HOST: str = "localhost"
     RABBITMQ_PORT: int = 5672
     RABBITMQ_USER: str = "guest"
     RABBITMQ_PASS: str = "guest"
     RABBITMQ_SEND_EMAIL_ROUTING_KEY: str = "email_queue"
+    RABBITMQ_BULK_EMAIL_ROUTING_KEY: str = "email_bulk_queue"
     RABBITMQ_CONNECTION_RETRIES: int = 5
     RABBITMQ_CONNECTION_RETRY_DELAY: int = 5
+    PUBLISH_CONFIRM_WINDOW: int = 256
+    API_CONSUMERS_ENABLED: bool = True
+    CONSUMER_WORKERS: int = 0  # 0 = un worker per core
+    CONSUMER_SHUTDOWN_TIMEOUT: int = 30
+    WORKER_METRICS_PORT: int = 0  # porta delle metriche Prometheus dei worker, 0 = disabilitate
+    SHUTDOWN_DRAIN_TIMEOUT: float = 20  # deve restare sotto CONSUMER_SHUTDOWN_TIMEOUT
+    CONSUMER_PREFETCH: int = 20
+    CONSUMER_CONCURRENCY: int = 10
+    BULK_MAX_SHARE: float = 0.5  # frazione massima degli slot usabile dalla lane bulk
+    BULK_MIN_CONCURRENCY: int = 1  # slot riservati alla lane bulk quando ha messaggi in attesa
+    BULK_RATE_LIMIT_PER_SECOND: float = 0  # 0 = nessun limite
+    RETRY_MAX_ATTEMPTS: int = 5
+    RETRY_BASE_DELAY: float = 5
+    RETRY_MAX_DELAY: float = 300
+    RETRY_JITTER: float = 0.2
     SERVICE_PORT: int = 8000
     ENVIRONMENT: str = "development"
     SENTRY_DSN: str | None = None
     SENTRY_ENVIRONMENT: str = "local"
     SENTRY_DEBUG: bool = False
     SENTRY_RELEASE: str = "0.1.0"
+    TRACES_SAMPLE_RATE: float = 0.05  # rate delle transazioni senza rate specifico
+    # Rate per path HTTP o tipo di messaggio RabbitMQ
+    TRACES_SAMPLE_RATES: dict[str, float] = {"/health": 0, "/health/loop": 0, "/health/stats": 0, "/metrics": 0}
+    TRACES_BUDGET_PER_SECOND: float = 10  # transazioni campionate al secondo per processo, 0 = illimitate
+    TRACES_SLOW_THRESHOLD: float = 30  # messaggi in coda da più secondi sempre campionati, 0 = disabilitato
+    PROFILES_SAMPLE_RATE: float = 0.1  # frazione delle transazioni campionate da profilare
     API_PREFIX: str = "/api/v1"
     MAIL_USERNAME: str = ""
     MAIL_PASSWORD: str = ""
@@ -28,6 +72,48 @@ class Settings(BaseSettings):
     MAIL_SSL_TLS: bool = False
     USE_CREDENTIALS: bool = True
     VALIDATE_CERTS: bool = True
+    BATCH_MAX_RECIPIENTS: int = 1000
+    BATCH_SEND_CONCURRENCY: int = 10
+    SMTP_MAX_RECIPIENTS_PER_TRANSACTION: int = 100
+    BULK_RENDER_CACHE_SIZE: int = 128
+    ADDRESS_CACHE_SIZE: int = 10000  # indirizzi email già validati tenuti in memoria, 0 = nessuna cache
+    DEDUP_TTL: int = 86400
+    DEDUP_MAX_ENTRIES: int = 100000
+    DEDUP_BACKEND_URL: str | None = None  # es. sqlite:///./dedup.db
+    SPOOL_URL: str | None = None  # es. sqlite:///./spool.db, None = spool disabilitato
+    SPOOL_FLUSH_INTERVAL: float = 5
+    SPOOL_BATCH_SIZE: int = 100
+    SPOOL_MAX_ATTEMPTS: int = 20
+    SCHEDULE_URL: str | None = None  # es. sqlite:///./schedule.db, None = send_at non supportato
+    SCHEDULE_RELEASE_RATE: float = 50  # email programmate rilasciate al secondo, 0 = nessun limite
+    SCHEDULE_HORIZON: float = 60
+    SCHEDULE_MAX_IN_MEMORY: int = 10000
+    SCHEDULE_POLL_INTERVAL: float = 1
+    SCHEDULE_MAX_ATTEMPTS: int = 5  # rifiuti del relay prima di spostare l'email in failed_scheduled_emails
+    TEMPLATE_BYTECODE_CACHE_DIR: str | None = "/tmp/email_service_jinja_cache"
+    RENDER_POOL_KIND: str = "thread"  # thread | process | inline
+    RENDER_POOL_SIZE: int = 4
+    LOOP_LAG_INTERVAL: float = 0.5
+    LOOP_LAG_WARN_THRESHOLD: float = 0.1
+    SMTP_POOL_MIN_SIZE: int = 1
+    SMTP_POOL_MAX_SIZE: int = 10
+    SMTP_POOL_IDLE_TIMEOUT: int = 60
+    SMTP_RATE_LIMIT_PER_SECOND: float = 0  # 0 = nessun limite
+    SMTP_RATE_LIMIT_PER_HOUR: float = 0  # burst massimo: un minuto di quota
+    SMTP_SENDER_RATE_LIMIT_PER_SECOND: float = 0
+    SMTP_SENDER_RATE_LIMIT_PER_HOUR: float = 0
+    SMTP_MIN_CONCURRENCY: int = 1
+    # JSON, es. [{"server": "smtp1.example.com", "weight": 3}, {"server": "smtp2.example.com"}];
+    # se vuoto si usa il solo relay MAIL_SERVER
+    MAIL_RELAYS: list[RelaySettings] = []
+    SMTP_BREAKER_FAILURE_THRESHOLD: int = 5
+    SMTP_BREAKER_LATENCY_THRESHOLD: float = 0  # secondi, 0 = disabilitato
+    SMTP_BREAKER_RESET_TIMEOUT: float = 30
+    # JSON, es. [{"domain": "example.com", "selector": "mail", "private_key_path": "/run/secrets/dkim.pem"}];
+    # se vuoto i messaggi non vengono firmati
+    DKIM_KEYS: list[DKIMKeySettings] = []
+    DKIM_SIGNED_HEADERS: list[str] = ["From", "To", "Subject", "Date", "Message-ID", "MIME-Version", "Content-Type"]
+    DKIM_POOL_SIZE: int = 0  # processi di firma, 0 = uno per core (diviso tra i worker), -1 = nel processo principale
 
     model_config = SettingsConfigDict(
         env_file=".env",
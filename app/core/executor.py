@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+import asyncio
+import functools
+import math
+import multiprocessing
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable, TypeVar
+
+from app.core.config import settings
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+_executor: Executor | None = None
+_signing_executor: ProcessPoolExecutor | None = None
+
+
+def get_executor() -> Executor | None:
+    """Restituisce il pool per il lavoro CPU-bound (rendering e costruzione MIME), creandolo al primo uso.
+
+    Il tipo è scelto da ``settings.RENDER_POOL_KIND``: "thread", "process" oppure "inline" (nessun pool).
+    """
+    global _executor
+    if _executor is None and settings.RENDER_POOL_KIND != "inline":
+        if settings.RENDER_POOL_KIND == "process":
+            # "spawn" come per la firma: un fork erediterebbe lock e thread (listener dei log, event loop) del padre
+            _executor = ProcessPoolExecutor(
+                max_workers=settings.RENDER_POOL_SIZE, mp_context=multiprocessing.get_context("spawn")
+            )
+        elif settings.RENDER_POOL_KIND == "thread":
+            _executor = ThreadPoolExecutor(max_workers=settings.RENDER_POOL_SIZE, thread_name_prefix="render")
+        else:
+            raise ValueError(f"Unknown RENDER_POOL_KIND {settings.RENDER_POOL_KIND!r}")
+        logger.info(f"Started {settings.RENDER_POOL_KIND} render pool with {settings.RENDER_POOL_SIZE} workers")
+    return _executor
+
+
+async def run_blocking(fn: Callable[..., T], *args: Any) -> T:
+    """Esegue ``fn(*args)`` nel pool senza bloccare l'event loop.
+
+    Con un pool di processi ``fn`` e gli argomenti devono essere serializzabili con pickle
+    (funzioni a livello di modulo e tipi semplici).
+    """
+    executor = get_executor()
+    if executor is None:
+        return fn(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args))
+
+
+# Quota CPU del container: cgroup v2 ("<quota> <periodo>" o "max <periodo>") e cgroup v1
+CGROUP_CPU_MAX = "/sys/fs/cgroup/cpu.max"
+CGROUP_V1_QUOTA = ("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+
+
+def _read(path: str) -> str | None:
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def cgroup_cpu_limit() -> int | None:
+    """Core concessi dalla quota CPU del cgroup (arrotondati per eccesso), None se non c'è una quota."""
+    try:
+        if (cpu_max := _read(CGROUP_CPU_MAX)) is not None:
+            quota, period = cpu_max.split()
+            return None if quota == "max" else max(1, math.ceil(int(quota) / int(period)))
+        quota, period = (_read(path) for path in CGROUP_V1_QUOTA)
+        if quota is not None and period is not None and int(quota) > 0:
+            return max(1, math.ceil(int(quota) / int(period)))
+    except ValueError:
+        pass
+    return None
+
+
+def available_cpus() -> int:
+    """Core utilizzabili dal processo (rispetta l'affinità e la quota CPU impostate dal container)."""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = len(os.sched_getaffinity(0))
+    else:
+        cpus = os.cpu_count() or 1
+    limit = cgroup_cpu_limit()
+    return min(cpus, limit) if limit is not None else cpus
+
+
+def signing_share(workers: int) -> int:
+    """Processi di firma per ognuno di ``workers`` processi, così che in tutto siano circa uno per core."""
+    return max(1, available_cpus() // max(workers, 1))
+
+
+def get_signing_executor() -> ProcessPoolExecutor | None:
+    """Restituisce il pool di processi per la firma DKIM, creandolo al primo uso (None con ``DKIM_POOL_SIZE`` < 0).
+
+    I processi sono avviati con "spawn": non ereditano loop, thread e lock del processo principale.
+    Con ``DKIM_POOL_SIZE`` = 0 il pool ha un processo per core; ``app.worker`` divide i core tra i suoi worker.
+    """
+    global _signing_executor
+    if _signing_executor is None and settings.DKIM_POOL_SIZE >= 0:
+        workers = settings.DKIM_POOL_SIZE or available_cpus()
+        _signing_executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        logger.info(f"Started DKIM signing pool with {workers} processes")
+    return _signing_executor
+
+
+async def run_signing(fn: Callable[..., T], *args: Any) -> T:
+    """Esegue ``fn(*args)`` nel pool di firma (``fn`` e argomenti serializzabili con pickle)."""
+    executor = get_signing_executor()
+    if executor is None:
+        return fn(*args)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args))
+
+
+def shutdown_executor() -> None:
+    """Chiude i pool attendendo il completamento dei lavori in corso."""
+    global _executor, _signing_executor
+    if _executor is not None:
+        _executor.shutdown(wait=True)
+        _executor = None
+    if _signing_executor is not None:
+        _signing_executor.shutdown(wait=True)
+        _signing_executor = None
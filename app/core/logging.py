@@ -1,13 +1,145 @@
+"""Configurazione del logging del servizio.
+
+I record vengono messi in una coda in memoria dal ``QueueHandler`` e scritti su stdout da un thread
+``QueueListener``: l'event loop non si blocca quando la pipe dei log del container è piena.
+La formattazione (interpolazione degli argomenti, traceback, JSON) avviene nel thread del listener, quindi sul
+percorso caldo conviene passare gli argomenti al logger (``logger.info("... %s", value)``) invece delle f-string.
+"""
+import atexit
 import logging
+import queue
 import sys
+import threading
+import time
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
+
+from app.core.config import settings
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s %(name)s - %(message)s"
+# Attributi standard di LogRecord: gli altri arrivano da ``extra`` e finiscono nell'output JSON
+_RECORD_ATTRIBUTES = frozenset(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_listener: QueueListener | None = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Un oggetto JSON per riga (orjson), con i campi passati in ``extra``."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update((key, value) for key, value in vars(record).items() if key not in _RECORD_ATTRIBUTES)
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return orjson.dumps(entry, default=str).decode()
+
+
+class RateLimitFilter(logging.Filter):
+    """Limita le righe ripetitive: al massimo ``per_second`` record al secondo per logger e messaggio.
+
+    Il messaggio è il template non formattato, quindi le righe per-email con argomenti lazy condividono lo stesso
+    limite. Warning ed errori passano sempre; il primo record dopo una soppressione riporta quanti ne sono stati scartati.
+    Restano in memoria solo i ``max_keys`` messaggi usati più di recente: i messaggi già formattati (f-string) hanno
+    ognuno il proprio limite e non devono far crescere il filtro senza fine.
+    """
+
+    def __init__(self, per_second: float, burst: float | None = None, clock=time.monotonic, max_keys: int = 1024):
+        """Inizializza il filtro.
+
+        Args:
+            per_second (float): Record al secondo ammessi per ogni messaggio.
+            burst (float | None): Record ammessi di seguito prima del limite (default: ``per_second``, minimo 1).
+            clock (callable): Orologio monotono (sostituibile nei test).
+            max_keys (int): Messaggi distinti tenuti in memoria al massimo (default: 1024).
+        """
+        super().__init__()
+        self.per_second = per_second
+        self.burst = burst if burst is not None else max(per_second, 1)
+        self.clock = clock
+        self.max_keys = max_keys
+        # (logger, messaggio) -> [token, ultimo aggiornamento, soppressi], in ordine di ultimo uso
+        self.buckets: OrderedDict[tuple, list] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        # msg può essere un oggetto qualsiasi (anche non hashable): la chiave usa la sua forma testuale
+        key = (record.name, str(record.msg))
+        now = self.clock()
+        with self._lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [self.burst, now, 0]
+                if len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.per_second)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+class _DeferredQueueHandler(QueueHandler):
+    """QueueHandler che lascia la formattazione al listener (la coda è in memoria, il record non va serializzato)."""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _formatter() -> logging.Formatter:
+    if settings.LOG_FORMAT == "json":
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT)
+
+
+def setup_logging(level: int | str | None = None) -> None:
+    """Installa il QueueHandler sul root logger e avvia il listener che scrive su stdout (una sola volta per processo)."""
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler(sys.stdout)
+    stream.setFormatter(_formatter())
+
+    log_queue = queue.SimpleQueue()
+    handler = _DeferredQueueHandler(log_queue)
+    if settings.LOG_RATE_LIMIT_PER_SECOND:
+        handler.addFilter(RateLimitFilter(settings.LOG_RATE_LIMIT_PER_SECOND))
+
+    root = logging.getLogger()
+    root.addHandler(handler)
+    root.setLevel(level or settings.LOG_LEVEL)
+
+    _listener = QueueListener(log_queue, stream)
+    _listener.start()
+    atexit.register(shutdown_logging)
 
 
-def setup_logging(level: int | str = "INFO") -> None:
-    logging.basicConfig(
-        level=level,
-        stream=sys.stdout,
-        format="%(asctime)s %(levelname)s %(name)s - %(message)s",
-    )
+def shutdown_logging() -> None:
+    """Ferma il listener dopo aver scritto i record ancora in coda."""
+    global _listener
+    if _listener is None:
+        return
+    _listener.stop()
+    for handler in list(logging.getLogger().handlers):
+        if isinstance(handler, _DeferredQueueHandler):
+            logging.getLogger().removeHandler(handler)
+    _listener = None
 
 
 def get_logger(name: str) -> logging.Logger:
@@ -0,0 +1,66 @@
+from __future__ import annotations
+
+import asyncio
+
+from app.core.config import settings
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+class LoopLagMonitor:
+    """Misura il ritardo dell'event loop confrontando la durata reale di uno sleep con quella attesa."""
+
+    def __init__(self, interval: float = 0.5, warn_threshold: float = 0.1):
+        """Inizializza il monitor.
+
+        Args:
+            interval (float): Secondi tra due campioni (default: 0.5).
+            warn_threshold (float): Ritardo in secondi oltre il quale il campione è contato come stallo (default: 0.1).
+        """
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self.samples = 0
+        self.stalls = 0
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._task: asyncio.Task | None = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        return {
+            "samples": self.samples,
+            "stalls": self.stalls,
+            "last_lag_ms": round(self.last_lag * 1000, 3),
+            "max_lag_ms": round(self.max_lag * 1000, 3),
+        }
+
+    def record(self, lag: float):
+        self.samples += 1
+        self.last_lag = lag
+        self.max_lag = max(self.max_lag, lag)
+        if lag > self.warn_threshold:
+            self.stalls += 1
+            logger.warning(f"Event loop stalled for {lag * 1000:.1f} ms")
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval)
+            self.record(max(loop.time() - start - self.interval, 0.0))
+
+
+loop_monitor = LoopLagMonitor(interval=settings.LOOP_LAG_INTERVAL, warn_threshold=settings.LOOP_LAG_WARN_THRESHOLD)
@@ -0,0 +1,100 @@
+"""Metriche Prometheus del servizio, esposte su ``/metrics``.
+
+Contatori e istogrammi costano un incremento in memoria per evento, quindi possono stare sul percorso caldo
+al posto del tracing completo. Con ``PROMETHEUS_MULTIPROC_DIR`` (consumer multi-processo) ogni processo scrive
+i propri valori in quella directory e l'endpoint li aggrega.
+"""
+from __future__ import annotations
+
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, \
+    generate_latest, multiprocess
+
+# Bucket per operazioni sul percorso caldo (rendering, SMTP, elaborazione di un messaggio)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# Bucket per l'attesa in coda, che con backlog o campagne arriva a minuti
+QUEUE_WAIT_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+MESSAGES_CONSUMED = Counter(
+    "email_messages_consumed_total",
+    "Messaggi RabbitMQ elaborati, per coda ed esito (acked, retried, dead_lettered, requeued)",
+    ["queue", "outcome"],
+)
+CONSUME_DURATION = Histogram(
+    "email_consume_duration_seconds",
+    "Tempo dalla consegna del messaggio al suo ack (attesa locale inclusa)",
+    ["queue"],
+    buckets=LATENCY_BUCKETS,
+)
+QUEUE_WAIT = Histogram(
+    "email_queue_wait_seconds",
+    "Tempo dalla pubblicazione all'inizio dell'elaborazione (solo prime consegne)",
+    ["queue"],
+    buckets=QUEUE_WAIT_BUCKETS,
+)
+MESSAGES_IN_FLIGHT = Gauge(
+    "email_messages_in_flight",
+    "Messaggi in elaborazione",
+    ["queue"],
+    multiprocess_mode="livesum",
+)
+TEMPLATE_RENDER_DURATION = Histogram(
+    "email_template_render_seconds",
+    "Tempo di rendering di un template",
+    ["template"],
+    buckets=LATENCY_BUCKETS,
+)
+SMTP_CONNECT_DURATION = Histogram(
+    "email_smtp_connect_seconds",
+    "Tempo di apertura di una sessione SMTP (TCP, TLS e AUTH)",
+    ["relay"],
+    buckets=LATENCY_BUCKETS,
+)
+SMTP_SEND_DURATION = Histogram(
+    "email_smtp_send_seconds",
+    "Durata di una transazione SMTP (MAIL FROM, RCPT TO, DATA)",
+    ["relay"],
+    buckets=LATENCY_BUCKETS,
+)
+EMAILS = Counter(
+    "email_emails_total",
+    "Email elaborate, per esito (sent, spooled, scheduled, duplicate)",
+    ["outcome"],
+)
+FAILURES = Counter(
+    "email_failures_total",
+    "Errori per fase (consume, smtp) e classe dell'eccezione",
+    ["stage", "error"],
+)
+
+
+def record_failure(stage: str, error: BaseException):
+    FAILURES.labels(stage, type(error).__name__).inc()
+
+
+@contextmanager
+def timed(histogram: Histogram, *labels: str) -> Iterator[None]:
+    """Osserva la durata del blocco nell'istogramma (anche se il blocco solleva un'eccezione)."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(*labels).observe(time.perf_counter() - start)
+
+
+def metrics_registry() -> CollectorRegistry:
+    """Registry da esporre: aggregato su tutti i processi in modalità multi-processo."""
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """Restituisce il payload in formato testo Prometheus e il relativo content type."""
+    return generate_latest(metrics_registry()), CONTENT_TYPE_LATEST
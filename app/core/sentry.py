@@ -0,0 +1,156 @@
+"""Integrazione Sentry: campionamento delle trace e propagazione producer -> consumer.
+
+``sentry_sdk`` (con profiling e integrazioni) viene importato da ``init_sentry`` solo se ``SENTRY_DSN`` è
+configurato; senza DSN ``trace_headers`` e ``queue_transaction`` non fanno nulla e l'avvio non ne paga l'import.
+"""
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from types import ModuleType
+from typing import Callable, Iterator
+
+from app.core.config import settings
+
+# Header AMQP con cui il producer propaga la trace al consumer
+TRACE_HEADERS = ("sentry-trace", "baggage")
+
+
+class AdaptiveSampler:
+    """``traces_sampler`` con rate per transazione e budget di transazioni al secondo.
+
+    Il rate di base dipende dal nome della transazione (path HTTP o tipo del messaggio RabbitMQ), con
+    ``default_rate`` per quelle non configurate. Ogni ``window`` secondi il sampler stima quante transazioni
+    verrebbero campionate con i rate di base e, se la stima supera ``budget_per_second``, li scala tutti
+    dello stesso fattore. I retry (il tentativo precedente è fallito) e i messaggi rimasti in coda oltre
+    ``slow_threshold`` secondi sono sempre campionati e non consumano budget.
+
+    La decisione del producer non viene ereditata: la trace resta collegata anche se non campionata da entrambi,
+    e i rate restano validi per i messaggi provenienti da servizi campionati al 100%.
+    """
+
+    def __init__(self, default_rate: float, rates: dict[str, float] | None = None, *, budget_per_second: float = 0,
+                 slow_threshold: float = 0, window: float = 10, clock: Callable[[], float] = time.monotonic):
+        """Inizializza il sampler.
+
+        Args:
+            default_rate (float): Rate delle transazioni senza rate specifico.
+            rates (dict[str, float] | None): Rate per nome della transazione.
+            budget_per_second (float): Transazioni campionate al secondo da non superare, 0 = illimitate (default: 0).
+            slow_threshold (float): Attesa in coda in secondi oltre cui un messaggio è sempre campionato,
+                0 = disabilitata (default: 0).
+            window (float): Secondi tra un aggiornamento del fattore di scala e il successivo (default: 10).
+            clock (callable): Orologio monotono (sostituibile nei test).
+        """
+        self.default_rate = default_rate
+        self.rates = rates or {}
+        self.budget_per_second = budget_per_second
+        self.slow_threshold = slow_threshold
+        self.window = window
+        self.clock = clock
+        self.factor = 1.0
+        self.forced = 0
+        self._expected = 0.0  # transazioni campionabili nella finestra corrente con i rate di base
+        self._window_start = clock()
+
+    def __call__(self, sampling_context: dict) -> float:
+        if self._is_outlier(sampling_context):
+            self.forced += 1
+            return 1.0
+        rate = self.rates.get(self._name(sampling_context), self.default_rate)
+        self._observe(rate)
+        return rate * self.factor
+
+    def _name(self, sampling_context: dict) -> str | None:
+        scope = sampling_context.get("asgi_scope")
+        if scope is not None:
+            return scope.get("path")
+        return (sampling_context.get("transaction_context") or {}).get("name")
+
+    def _is_outlier(self, sampling_context: dict) -> bool:
+        if sampling_context.get("retry_attempt"):
+            return True
+        queue_wait = sampling_context.get("queue_wait")
+        return bool(self.slow_threshold) and queue_wait is not None and queue_wait >= self.slow_threshold
+
+    def _observe(self, rate: float):
+        if not self.budget_per_second:
+            return
+        self._expected += rate
+        now = self.clock()
+        elapsed = now - self._window_start
+        if elapsed < self.window:
+            return
+        expected_per_second = self._expected / elapsed
+        self.factor = min(1.0, self.budget_per_second / expected_per_second) if expected_per_second else 1.0
+        self._expected = 0.0
+        self._window_start = now
+
+    def stats(self) -> dict:
+        return {"default_rate": self.default_rate, "factor": round(self.factor, 4), "forced": self.forced}
+
+
+traces_sampler: AdaptiveSampler | None = None
+# Modulo sentry_sdk, impostato da init_sentry quando il tracing è attivo
+_sdk: ModuleType | None = None
+
+
+def init_sentry() -> None:
+    global traces_sampler, _sdk
+    if not settings.SENTRY_DSN:
+        return
+
+    import sentry_sdk
+    from sentry_sdk.integrations.httpx import HttpxIntegration
+
+    traces_sampler = AdaptiveSampler(
+        settings.TRACES_SAMPLE_RATE,
+        settings.TRACES_SAMPLE_RATES,
+        budget_per_second=settings.TRACES_BUDGET_PER_SECOND,
+        slow_threshold=settings.TRACES_SLOW_THRESHOLD,
+    )
+    sentry_sdk.init(
+        dsn=settings.SENTRY_DSN,
+        traces_sampler=traces_sampler,
+        # Relativo alle transazioni campionate
+        profiles_sample_rate=settings.PROFILES_SAMPLE_RATE,
+        integrations=[HttpxIntegration()],
+        environment=settings.SENTRY_ENVIRONMENT,
+        debug=settings.SENTRY_DEBUG,
+        release=settings.SENTRY_RELEASE,
+    )
+
+    sentry_sdk.set_tag("service.name", settings.SERVICE_NAME)
+    _sdk = sentry_sdk
+
+
+def trace_headers() -> dict[str, str]:
+    """Header da aggiungere a un messaggio pubblicato per collegare il consumer alla trace corrente."""
+    headers = {}
+    if _sdk is None:
+        return headers
+    if traceparent := _sdk.get_traceparent():
+        headers["sentry-trace"] = traceparent
+    if baggage := _sdk.get_baggage():
+        headers["baggage"] = baggage
+    return headers
+
+
+@contextmanager
+def queue_transaction(name: str, headers: dict, **sampling_context) -> Iterator[None]:
+    """Esegue il blocco in una transazione ``queue.process`` che continua la trace del producer.
+
+    Args:
+        name (str): Nome della transazione (tipo del messaggio), usato anche per il rate di campionamento.
+        headers (dict): Header del messaggio, da cui vengono letti ``sentry-trace`` e ``baggage``.
+        **sampling_context: Dati passati al sampler (es. ``queue_wait``, ``retry_attempt``).
+    """
+    if _sdk is None:
+        yield
+        return
+    from sentry_sdk.tracing import TransactionSource
+
+    incoming = {key: str(headers[key]) for key in TRACE_HEADERS if headers.get(key)}
+    transaction = _sdk.continue_trace(incoming, op="queue.process", name=name, source=TransactionSource.TASK)
+    with _sdk.start_transaction(transaction, custom_sampling_context=sampling_context):
+        yield
@@ -1,64 +1,80 @@
 from __future__ import annotations
 
 import asyncio
-import sentry_sdk
 import sys
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, APIRouter
+from fastapi import FastAPI, APIRouter, Response
 from fastapi.responses import ORJSONResponse
-from sentry_sdk.integrations.httpx import HttpxIntegration
 
 from app.api.v1.routes import email
-from app.consumers import email as email_consumer
+from app.consumers import registry
+from app.consumers.registry import subscribe_all
 from app.core.config import settings
+from app.core.executor import shutdown_executor
 from app.core.logging import setup_logging, get_logger
+from app.core.metrics import render_metrics
+from app.core.loop_monitor import loop_monitor
+from app.core import sentry
 from app.services import broker
+from app.services.email import dedup_store, rate_limiter, scheduler, smtp_relays, spool, warm_templates
 
-sentry_sdk.init(
-    dsn=settings.SENTRY_DSN,
-    traces_sample_rate=1.0,  # TODO Modificare in produzione
-    profiles_sample_rate=1.0,  # TODO Modificare in produzione
-    integrations=[HttpxIntegration()],
-    environment=settings.SENTRY_ENVIRONMENT,
-    debug=settings.SENTRY_DEBUG,
-    release=settings.SENTRY_RELEASE,
-)
-
-sentry_sdk.set_tag("service.name", settings.SERVICE_NAME)
+sentry.init_sentry()
 logger = None
 
-exchanges = {
-    "email": email_consumer.on_email_message,
-}
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     setup_logging()
     logger = get_logger(__name__)
     logger.info(f"Starting {settings.SERVICE_NAME}...")
-
-    # Avvia il broker asincrono all'avvio dell'app
-    broker_instance = broker.AsyncBrokerSingleton()
-    
-    # Connect ritorna False se fallisce dopo tutti i retry
-    connected = await broker_instance.connect(
-        retries=settings.RABBITMQ_CONNECTION_RETRIES,
-        delay=settings.RABBITMQ_CONNECTION_RETRY_DELAY
-    )
-    
-    if not connected:
-        logger.error("Could not connect to RabbitMQ after multiple attempts. Exiting...")
-        sys.exit(1)
-    
-    logger.info("Connected to RabbitMQ.")
-    for exchange, cb in exchanges.items():
-        await broker_instance.subscribe(exchange, cb, routing_key=settings.RABBITMQ_SEND_EMAIL_ROUTING_KEY)
+    loop_monitor.start()
+
+    # Compila i template prima di ricevere traffico (e prima che il pool di rendering venga creato,
+    # così i worker di un ProcessPoolExecutor li ereditano già compilati)
+    warm_templates()
+
+    broker_instance = None
+    if settings.API_CONSUMERS_ENABLED:
+        # Avvia il broker asincrono all'avvio dell'app
+        broker_instance = broker.AsyncBrokerSingleton()
+
+        # Connect ritorna False se fallisce dopo tutti i retry
+        connected = await broker_instance.connect(
+            retries=settings.RABBITMQ_CONNECTION_RETRIES,
+            delay=settings.RABBITMQ_CONNECTION_RETRY_DELAY
+        )
+
+        if not connected:
+            logger.error("Could not connect to RabbitMQ after multiple attempts. Exiting...")
+            sys.exit(1)
+
+        logger.info("Connected to RabbitMQ.")
+        await subscribe_all(broker_instance)
+    else:
+        logger.info("Queue consumption disabled in the API process (use python -m app.worker)")
+
+    # Apre le sessioni SMTP calde prima di ricevere traffico
+    await smtp_relays.start()
+    await dedup_store.purge()
+    if spool is not None:
+        await spool.start()
+    if scheduler is not None:
+        await scheduler.start()
 
     yield
 
     logger.info(f"Shutting down {settings.SERVICE_NAME}...")
-    await broker_instance.close()
-    logger.info("RabbitMQ connection closed.")
+    if broker_instance is not None:
+        # Prima si completano le email in corso, poi si chiudono broker, pool SMTP ed executor
+        await broker_instance.drain(settings.SHUTDOWN_DRAIN_TIMEOUT)
+        await broker_instance.close()
+        logger.info("RabbitMQ connection closed.")
+    if scheduler is not None:
+        await scheduler.close()
+    if spool is not None:
+        await spool.close()
+    await smtp_relays.close()
+    shutdown_executor()
+    await loop_monitor.stop()
 
 
 docs_url = None if settings.ENVIRONMENT == "production" else "/docs"
@@ -88,3 +104,29 @@ app.include_router(current_router, prefix=settings.API_PREFIX)
 @app.get("/health", tags=["health"])
 def health():
     return {"status": "ok", "service": settings.SERVICE_NAME}
+
+
+@app.get("/health/loop", tags=["health"])
+def health_loop():
+    return {"status": "ok", "service": settings.SERVICE_NAME, "loop_lag": loop_monitor.stats()}
+
+
+@app.get("/health/stats", tags=["health"])
+async def health_stats():
+    return {
+        "status": "ok",
+        "service": settings.SERVICE_NAME,
+        "smtp_relays": smtp_relays.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "dedup": dedup_store.stats(),
+        "spool": await spool.stats() if spool is not None else None,
+        "scheduled": await scheduler.stats() if scheduler is not None else None,
+        "lanes": registry.lane_scheduler.stats() if registry.lane_scheduler is not None else None,
+        "tracing": sentry.traces_sampler.stats() if sentry.traces_sampler is not None else None,
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    payload, content_type = render_metrics()
+    return Response(content=payload, media_type=content_type)
@@ -1,3 +0,0 @@
-from .user import User
-
-__all__ = ["User"]
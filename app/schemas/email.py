@@ -1,18 +1,119 @@
 from __future__ import annotations
 
-from typing import Dict, Any
+import sys
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Annotated, Dict, Any, List, Union
 
-from pydantic import BaseModel, NameEmail
+from pydantic import AfterValidator, BaseModel, Discriminator, Field, NameEmail, Tag, TypeAdapter, \
+    ValidatorFunctionWrapHandler, WrapValidator, field_validator
+
+from app.core.config import settings
+
+# Indirizzi già validati: la validazione di NameEmail (email_validator, con la normalizzazione IDNA del dominio)
+# è la parte più costosa del parsing di un messaggio, e retry e notifiche ricorrenti ripetono gli stessi indirizzi
+_validated_addresses: OrderedDict[str, NameEmail] = OrderedDict()
+
+
+def _cached_name_email(value: Any, handler: ValidatorFunctionWrapHandler) -> NameEmail:
+    if not isinstance(value, str) or not settings.ADDRESS_CACHE_SIZE:
+        return handler(value)
+    cached = _validated_addresses.get(value)
+    if cached is not None:
+        _validated_addresses.move_to_end(value)
+        return cached
+    validated = _validated_addresses[value] = handler(value)
+    if len(_validated_addresses) > settings.ADDRESS_CACHE_SIZE:
+        _validated_addresses.popitem(last=False)
+    return validated
+
+
+Address = Annotated[NameEmail, WrapValidator(_cached_name_email)]
+# Pochi nomi di template distinti: internati, lookup di template e label delle metriche confrontano per identità
+TemplateName = Annotated[str, AfterValidator(sys.intern)]
 
 
 class EmailRequest(BaseModel):
-    to: NameEmail
+    to: Address
     subject: str
-    template_name: str
+    template_name: TemplateName
     context: Dict[str, Any]
+    # Orario di invio; se nel futuro l'email viene programmata invece che inviata subito (senza fuso = UTC)
+    send_at: datetime | None = None
+
+    @field_validator("send_at")
+    @classmethod
+    def _as_utc(cls, value: datetime | None) -> datetime | None:
+        if value is not None and value.tzinfo is None:
+            return value.replace(tzinfo=timezone.utc)
+        return value
+
+
+class BatchRecipient(BaseModel):
+    # Senza cache: i destinatari di un batch sono quasi sempre tutti diversi e, più numerosi della cache,
+    # la svuoterebbero pagando solo il costo di lookup e inserimento
+    to: NameEmail
+    context: Dict[str, Any] = {}  # Sovrascrive le chiavi del contesto condiviso
+
+
+class BatchEmailRequest(BaseModel):
+    subject: str
+    template_name: TemplateName
+    context: Dict[str, Any] = {}  # Contesto condiviso da tutti i destinatari
+    recipients: List[BatchRecipient] = Field(min_length=1, max_length=settings.BATCH_MAX_RECIPIENTS)
+    # Un solo messaggio (To: undisclosed-recipients) per i destinatari senza contesto proprio,
+    # inviato con transazioni multi-RCPT raggruppate per dominio
+    merge_recipients: bool = False
+
+
+def _payload_kind(value: Any) -> str:
+    """Discriminatore dei messaggi email: envelope ``{id, type, data}``, batch o email singola."""
+    if isinstance(value, dict):
+        if "data" in value:
+            return "envelope"
+        return "batch" if "recipients" in value else "single"
+    return "batch" if isinstance(value, BatchEmailRequest) else "single"
+
+
+EmailPayload = Annotated[
+    Union[Annotated[EmailRequest, Tag("single")], Annotated[BatchEmailRequest, Tag("batch")]],
+    Discriminator(_payload_kind),
+]
+
+
+class EmailEnvelope(BaseModel):
+    """Envelope standard dei messaggi pubblicati da ``AsyncBrokerSingleton.build_message``."""
+    id: str | None = None
+    type: str | None = None
+    data: EmailPayload
+
+
+# Validatore dei body AMQP della coda email, creato una volta: il consumer valida direttamente i bytes JSON
+email_message_adapter: TypeAdapter[EmailEnvelope | EmailRequest | BatchEmailRequest] = TypeAdapter(Annotated[
+    Union[
+        Annotated[EmailEnvelope, Tag("envelope")],
+        Annotated[EmailRequest, Tag("single")],
+        Annotated[BatchEmailRequest, Tag("batch")],
+    ],
+    Discriminator(_payload_kind),
+])
 
 
 class SendEmailResponseStatus(BaseModel):
     code: int
     message: str
     detail: str
+
+
+class RecipientSendResult(BaseModel):
+    to: str
+    code: int
+    detail: str
+
+
+class BatchSendResponseStatus(BaseModel):
+    code: int
+    message: str
+    sent: int
+    failed: int
+    results: List[RecipientSendResult]
@@ -0,0 +1,46 @@
+"""Ripubblica in blocco i messaggi della dead-letter queue di un exchange.
+
+Uso: ``python -m app.scripts.replay_dlq --exchange email [--limit 1000]``
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+
+from app.core.config import settings
+from app.core.logging import get_logger, setup_logging
+from app.services.broker import AsyncBrokerSingleton
+
+logger = get_logger(__name__)
+
+
+async def replay(exchange_name: str, limit: int | None) -> int:
+    broker_instance = AsyncBrokerSingleton()
+    connected = await broker_instance.connect(
+        retries=settings.RABBITMQ_CONNECTION_RETRIES,
+        delay=settings.RABBITMQ_CONNECTION_RETRY_DELAY
+    )
+    if not connected:
+        logger.error("Could not connect to RabbitMQ. Exiting...")
+        return 1
+
+    try:
+        await broker_instance.replay_dead_letters(exchange_name, limit=limit)
+    finally:
+        await broker_instance.close()
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay dead-lettered messages")
+    parser.add_argument("--exchange", default="email", help="Exchange di cui svuotare la DLQ (default: email)")
+    parser.add_argument("--limit", type=int, default=None, help="Numero massimo di messaggi da ripubblicare")
+    args = parser.parse_args()
+
+    setup_logging()
+    sys.exit(asyncio.run(replay(args.exchange, args.limit)))
+
+
+if __name__ == "__main__":
+    main()
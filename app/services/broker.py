@@ -1,15 +1,84 @@
 from __future__ import annotations
 
-import json
 import asyncio
+import contextlib
+import logging
+import random
+import time
 import uuid
+from datetime import datetime
+
 import aio_pika
+import orjson
 
+from app.core import metrics
 from app.core.config import settings
 from app.core.logging import get_logger, setup_logging
+from app.core.sentry import trace_headers
 
 logger = get_logger(__name__)
 
+# Header usati dalla pipeline di retry
+RETRY_ATTEMPT_HEADER = "x-retry-attempt"
+RETRY_QUEUE_HEADER = "x-retry-queue"
+RETRY_ERROR_HEADER = "x-retry-last-error"
+# Istante di pubblicazione (secondi UNIX con decimali), per misurare la latenza di coda
+PUBLISHED_AT_HEADER = "x-published-at"
+
+
+def retry_delay(attempt, base_delay, max_delay):
+    """Calcola il ritardo (in secondi) del tentativo ``attempt`` con backoff esponenziale.
+
+    Args:
+        attempt (int): Numero del tentativo di retry, a partire da 1.
+        base_delay (float): Ritardo del primo tentativo in secondi.
+        max_delay (float): Ritardo massimo in secondi.
+    """
+    return min(base_delay * 2 ** (attempt - 1), max_delay)
+
+
+def published_at(message) -> float | None:
+    """Timestamp di pubblicazione della prima consegna di un messaggio (None per i retry o se assente).
+
+    Usa l'header ``x-published-at`` (precisione sub-secondo) e in mancanza la proprietà AMQP ``timestamp``.
+    """
+    headers = getattr(message, "headers", None) or {}
+    if headers.get(RETRY_ATTEMPT_HEADER):
+        # Un retry è rimasto in coda anche per il backoff: non è latenza di coda
+        return None
+    if (value := headers.get(PUBLISHED_AT_HEADER)) is not None:
+        return float(value)
+    timestamp = getattr(message, "timestamp", None)
+    return timestamp.timestamp() if isinstance(timestamp, datetime) else None
+
+
+class PublishConfirmError(Exception):
+    """Messaggi di ``publish_many`` non confermati dal broker (nack o errore del canale).
+
+    Attributes:
+        published (int): Messaggi pubblicati e confermati.
+        failed (list[int]): Posizioni in ``items`` dei messaggi non confermati.
+        attempted (int): Messaggi inviati; quelli successivi non sono stati pubblicati.
+    """
+
+    def __init__(self, published: int, failed: list[int], attempted: int, error: BaseException):
+        super().__init__(f"{len(failed)} of {attempted} messages not confirmed ({published} confirmed): {error}")
+        self.published = published
+        self.failed = failed
+        self.attempted = attempted
+
+
+def _republished(message, headers: dict) -> aio_pika.Message:
+    """Copia persistente di un messaggio ricevuto, con gli header indicati."""
+    return aio_pika.Message(
+        body=message.body,
+        headers=headers,
+        content_type=message.content_type,
+        message_id=message.message_id,
+        type=message.type,
+        delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+    )
+
 
 class AsyncBrokerSingleton:
     """Singleton asincrono per la gestione della connessione a RabbitMQ e delle operazioni di publish/subscribe."""
@@ -39,6 +108,15 @@ class AsyncBrokerSingleton:
             self.channel = None
             self.queues = {}
             self.consumer_tags = {}
+            self.exchanges = {}
+            self.retry_queues = {}
+            self.dead_letter_queues = {}
+            self.draining = False
+            self.pending = 0  # consegne ricevute e non ancora concluse (in attesa del semaforo o in esecuzione)
+            self.in_flight = 0  # consegne in esecuzione nella callback
+            self.completed = 0
+            self._idle = asyncio.Event()
+            self._idle.set()
             self.initialized = True
 
     async def connect(self, retries=5, delay=5):
@@ -62,7 +140,9 @@ class AsyncBrokerSingleton:
                     login=settings.RABBITMQ_USER,
                     password=settings.RABBITMQ_PASS
                 )
-                self.channel = await self.connection.channel()
+                # publisher_confirms: ogni publish attende l'ack del broker
+                self.channel = await self.connection.channel(publisher_confirms=True)
+                self.exchanges = {}
                 logger.info("Connected to RabbitMQ (aio-pika)")
                 return True
             except Exception as e:
@@ -77,7 +157,8 @@ class AsyncBrokerSingleton:
                     return False
         return False
 
-    async def subscribe(self, exchange_name, callback, *, ex_type="direct", routing_key=""):
+    async def subscribe(self, exchange_name, callback, *, ex_type="direct", routing_key="", prefetch_count=None,
+                        concurrency=None, max_retries=None, limiter=None):
         """Sottoscrive a un exchange RabbitMQ con una callback specifica (asincrono).
 
         Args:
@@ -85,8 +166,29 @@ class AsyncBrokerSingleton:
             callback (callable): Funzione di callback da chiamare quando arriva un messaggio.
             ex_type (str): Tipo di exchange (default: "direct").
             routing_key (str): Chiave di routing per il binding della coda (default: ""). Se vuota, si sottoscrive a tutti i messaggi dell'exchange.
+            prefetch_count (int | None): Numero massimo di messaggi non confermati consegnati a questo consumer
+                (default: settings.CONSUMER_PREFETCH). 0 significa illimitato.
+            concurrency (int | None): Numero massimo di callback eseguite contemporaneamente
+                (default: settings.CONSUMER_CONCURRENCY).
+            max_retries (int | None): Numero di retry ritardati prima di spostare il messaggio nella DLQ
+                (default: settings.RETRY_MAX_ATTEMPTS).
+            limiter (callable | None): Funzione che riceve il messaggio e restituisce il context manager asincrono
+                da tenere durante l'elaborazione (es. ``LaneScheduler.limiter``). Se presente sostituisce
+                il limite ``concurrency`` della singola sottoscrizione.
+
+        La callback non deve fare ack/nack: il broker conferma il messaggio quando la callback termina e,
+        se solleva un'eccezione, lo ripubblica in una coda di ritardo (TTL + dead-letter verso la coda principale)
+        con backoff esponenziale e jitter. Esauriti i tentativi il messaggio finisce in
+        ``<service>.<exchange>.dlq``.
         """
-        exchange = await self.channel.declare_exchange(exchange_name, ex_type, durable=True)
+        if prefetch_count is None:
+            prefetch_count = settings.CONSUMER_PREFETCH
+        if concurrency is None:
+            concurrency = settings.CONSUMER_CONCURRENCY
+        if max_retries is None:
+            max_retries = settings.RETRY_MAX_ATTEMPTS
+
+        exchange = await self.get_exchange(exchange_name, ex_type)
         if routing_key:
             queue_name = f"{self.service_name}.{exchange_name}.{routing_key}"
         else:
@@ -94,14 +196,221 @@ class AsyncBrokerSingleton:
 
         queue = await self.channel.declare_queue(queue_name, durable=True)
         await queue.bind(exchange, routing_key=routing_key)
+        await self._declare_retry_pipeline(exchange_name, queue_name, max_retries)
+
+        # Il QoS non globale si applica ai consumer creati da qui in poi sul canale, quindi è per-sottoscrizione
+        await self.channel.set_qos(prefetch_count=prefetch_count)
 
         # consume returns a consumer tag, it is NOT a blocking task that needs asyncio.create_task
-        consumer_tag = await queue.consume(callback)
+        consumer_tag = await queue.consume(
+            self._bounded(queue_name, self._with_retry(queue_name, callback), concurrency, limiter)
+        )
 
         self.queues[queue_name] = queue
         self.consumer_tags[queue_name] = consumer_tag
         logger.info(
-            f"Subscribed to exchange {exchange_name} with queue '{queue_name}' and routing key '{routing_key}' (aio-pika)")
+            f"Subscribed to exchange {exchange_name} with queue '{queue_name}' and routing key '{routing_key}' "
+            f"(prefetch={prefetch_count}, concurrency={concurrency}) (aio-pika)")
+
+    def _bounded(self, queue_name, callback, concurrency, limiter=None):
+        """Avvolge la callback in un semaforo che limita le esecuzioni concorrenti.
+
+        aio-pika avvia un task per ogni consegna: i messaggi oltre il limite restano in attesa del semaforo
+        (al massimo prefetch_count - concurrency), senza essere processati.
+        Misura attesa in coda, messaggi in elaborazione e tempo dalla consegna all'ack.
+
+        Args:
+            queue_name (str): Nome della coda (etichetta delle metriche).
+            callback (callable): Callback originale.
+            concurrency (int): Numero massimo di esecuzioni concorrenti.
+            limiter (callable | None): Se presente, usato al posto del semaforo (vedi ``subscribe``).
+        """
+        if limiter is None:
+            semaphore = asyncio.Semaphore(concurrency) if concurrency > 0 else contextlib.nullcontext()
+
+            def limiter(message):
+                return semaphore
+
+        in_flight = metrics.MESSAGES_IN_FLIGHT.labels(queue_name)
+
+        async def handler(message):
+            received = time.perf_counter()
+            self.pending += 1
+            self._idle.clear()
+            try:
+                async with limiter(message):
+                    if self.draining:
+                        # In chiusura: i messaggi non ancora iniziati tornano subito in coda per le altre repliche
+                        await message.reject(requeue=True)
+                        metrics.MESSAGES_CONSUMED.labels(queue_name, "requeued").inc()
+                        return
+                    if (enqueued_at := published_at(message)) is not None:
+                        metrics.QUEUE_WAIT.labels(queue_name).observe(max(time.time() - enqueued_at, 0))
+                    self.in_flight += 1
+                    in_flight.inc()
+                    try:
+                        return await callback(message)
+                    finally:
+                        self.in_flight -= 1
+                        in_flight.dec()
+                        self.completed += 1
+                        metrics.CONSUME_DURATION.labels(queue_name).observe(time.perf_counter() - received)
+            finally:
+                self.pending -= 1
+                if self.pending == 0:
+                    self._idle.set()
+
+        return handler
+
+    async def _declare_retry_pipeline(self, exchange_name, queue_name, max_retries):
+        """Dichiara le code di ritardo per ogni tentativo e la DLQ dell'exchange.
+
+        Le code di ritardo sono nominate in base al TTL, quindi i tentativi con lo stesso ritardo (dopo il cap)
+        condividono la stessa coda e un cambio di configurazione non va in conflitto con code già esistenti.
+
+        Args:
+            exchange_name (str): Nome dell'exchange sottoscritto.
+            queue_name (str): Nome della coda principale a cui i messaggi tornano dopo il ritardo.
+            max_retries (int): Numero di tentativi ritardati.
+        """
+        retry_queues = []
+        for attempt in range(1, max_retries + 1):
+            delay_ms = int(retry_delay(attempt, settings.RETRY_BASE_DELAY, settings.RETRY_MAX_DELAY) * 1000)
+            retry_queue_name = f"{queue_name}.retry.{delay_ms}"
+            if retry_queue_name not in retry_queues:
+                await self.channel.declare_queue(
+                    retry_queue_name,
+                    durable=True,
+                    arguments={
+                        "x-message-ttl": delay_ms,
+                        "x-dead-letter-exchange": "",
+                        "x-dead-letter-routing-key": queue_name,
+                    },
+                )
+            retry_queues.append(retry_queue_name)
+
+        dlq_name = f"{self.service_name}.{exchange_name}.dlq"
+        await self.channel.declare_queue(dlq_name, durable=True)
+
+        self.retry_queues[queue_name] = retry_queues
+        self.dead_letter_queues[queue_name] = dlq_name
+
+    def _with_retry(self, queue_name, callback):
+        """Avvolge la callback gestendo ack e retry ritardati.
+
+        Se la ripubblicazione verso la coda di retry fallisce, il messaggio viene rifiutato con requeue
+        per non perderlo.
+
+        Args:
+            queue_name (str): Nome della coda principale.
+            callback (callable): Callback originale.
+        """
+        async def handler(message):
+            try:
+                async with message.process(requeue=True, ignore_processed=True):
+                    try:
+                        result = await callback(message)
+                    except Exception as e:
+                        await self._schedule_retry(queue_name, message, e)
+                        return
+            except Exception:
+                # Ripubblicazione fallita: process() ha rifiutato il messaggio con requeue
+                metrics.MESSAGES_CONSUMED.labels(queue_name, "requeued").inc()
+                raise
+            metrics.MESSAGES_CONSUMED.labels(queue_name, "acked").inc()
+            return result
+
+        return handler
+
+    async def _schedule_retry(self, queue_name, message, error):
+        """Ripubblica un messaggio fallito nella coda di ritardo del tentativo successivo o nella DLQ.
+
+        Args:
+            queue_name (str): Nome della coda principale.
+            message (IncomingMessage): Messaggio fallito.
+            error (Exception): Errore sollevato dalla callback.
+        """
+        headers = dict(message.headers or {})
+        attempt = int(headers.get(RETRY_ATTEMPT_HEADER, 0)) + 1
+        retry_queues = self.retry_queues.get(queue_name, [])
+        headers[RETRY_ATTEMPT_HEADER] = attempt
+        headers[RETRY_QUEUE_HEADER] = queue_name
+        headers[RETRY_ERROR_HEADER] = str(error)[:512]
+
+        if attempt > len(retry_queues):
+            target = self.dead_letter_queues[queue_name]
+            expiration = None
+            logger.error(f"Message {message.message_id} failed {attempt} times. Moved to dead-letter queue '{target}'")
+        else:
+            target = retry_queues[attempt - 1]
+            delay = retry_delay(attempt, settings.RETRY_BASE_DELAY, settings.RETRY_MAX_DELAY)
+            # Jitter solo verso il basso: la scadenza del messaggio non supera mai il TTL della coda
+            expiration = delay * (1 - settings.RETRY_JITTER * random.random())
+            logger.warning(
+                f"Message {message.message_id} failed (attempt {attempt}/{len(retry_queues)}): {error}. "
+                f"Retrying in {expiration:.1f}s")
+
+        await self.channel.default_exchange.publish(
+            aio_pika.Message(
+                body=message.body,
+                headers=headers,
+                content_type=message.content_type,
+                message_id=message.message_id,
+                type=message.type,
+                delivery_mode=aio_pika.DeliveryMode.PERSISTENT,
+                expiration=expiration,
+            ),
+            routing_key=target,
+        )
+        metrics.MESSAGES_CONSUMED.labels(queue_name, "retried" if expiration is not None else "dead_lettered").inc()
+
+    async def replay_dead_letters(self, exchange_name, limit=None):
+        """Ripubblica i messaggi della DLQ di un exchange nelle rispettive code di origine (asincrono).
+
+        I messaggi senza coda di origine vengono spostati in ``<service>.<exchange>.parking``, così non
+        bloccano quelli successivi.
+
+        Args:
+            exchange_name (str): Nome dell'exchange di cui svuotare la DLQ.
+            limit (int | None): Numero massimo di messaggi da ripubblicare (default: tutti).
+
+        Returns:
+            int: Numero di messaggi ripubblicati.
+        """
+        dlq = await self.channel.declare_queue(f"{self.service_name}.{exchange_name}.dlq", durable=True)
+        parking_name = f"{self.service_name}.{exchange_name}.parking"
+        parking_declared = False
+        replayed = 0
+        parked = 0
+        while limit is None or replayed < limit:
+            message = await dlq.get(no_ack=False, fail=False)
+            if message is None:
+                break
+
+            headers = dict(message.headers or {})
+            target = headers.get(RETRY_QUEUE_HEADER)
+            if isinstance(target, bytes):
+                target = target.decode()
+            if not target:
+                logger.error(f"Message {message.message_id} in DLQ has no origin queue. Moving it to {parking_name}")
+                if not parking_declared:
+                    await self.channel.declare_queue(parking_name, durable=True)
+                    parking_declared = True
+                await self.channel.default_exchange.publish(_republished(message, headers), routing_key=parking_name)
+                await message.ack()
+                parked += 1
+                continue
+
+            # Il messaggio riparte con un nuovo ciclo completo di retry
+            headers[RETRY_ATTEMPT_HEADER] = 0
+            headers.pop(RETRY_ERROR_HEADER, None)
+            await self.channel.default_exchange.publish(_republished(message, headers), routing_key=target)
+            await message.ack()
+            replayed += 1
+
+        logger.info(f"Replayed {replayed} messages from DLQ of exchange {exchange_name} (aio-pika)"
+                    + (f", {parked} moved to {parking_name}" if parked else ""))
+        return replayed
 
     async def unsubscribe(self, queue_name, unbind=True):
         """Annulla la sottoscrizione a una coda RabbitMQ (asincrono).
@@ -123,28 +432,134 @@ class AsyncBrokerSingleton:
             del self.queues[queue_name]
         logger.info(f"Unsubscribed from queue '{queue_name}' (unbind={unbind}) (aio-pika)")
 
-    async def publish_message(self, exchange_name, msg_type, data, routing_key=""):
-        """Pubblica un messaggio su un exchange RabbitMQ (asincrono).
+    async def get_exchange(self, exchange_name, ex_type="direct"):
+        """Restituisce l'exchange dichiarato, dichiarandolo solo la prima volta per canale (asincrono).
+
+        Args:
+            exchange_name (str): Nome dell'exchange.
+            ex_type (str): Tipo di exchange (default: "direct").
+        """
+        exchange = self.exchanges.get(exchange_name)
+        if exchange is None:
+            exchange = await self.channel.declare_exchange(exchange_name, ex_type, durable=True)
+            self.exchanges[exchange_name] = exchange
+        return exchange
+
+    @staticmethod
+    def build_message(msg_type, data):
+        """Costruisce il messaggio AMQP persistente con l'envelope standard ``{id, type, data}``.
+
         Args:
-            exchange_name (str): Nome dell'exchange su cui pubblicare il messaggio.
             msg_type (str): Tipo di messaggio.
             data (dict): Dati del messaggio.
-            routing_key (str): Chiave di routing per il messaggio (default: ""). Se vuota, il messaggio viene inviato a tutti i consumatori dell'exchange.
         """
-        exchange = await self.channel.declare_exchange(exchange_name, "direct", durable=True)
-        message = aio_pika.Message(
-            body=json.dumps({
-                "id": str(uuid.uuid4()),
+        message_id = str(uuid.uuid4())
+        now = time.time()
+        return aio_pika.Message(
+            body=orjson.dumps({
+                "id": message_id,
                 "type": msg_type,
                 "data": data
-            }).encode("utf-8"),
+            }),
             content_type="application/json",
+            message_id=message_id,
+            timestamp=now,
+            type=msg_type,
+            headers={PUBLISHED_AT_HEADER: now, **trace_headers()},
             delivery_mode=aio_pika.DeliveryMode.PERSISTENT
         )
-        await exchange.publish(message, routing_key=routing_key)
+
+    async def publish_message(self, exchange_name, msg_type, data, routing_key=""):
+        """Pubblica un messaggio su un exchange RabbitMQ (asincrono).
+        Args:
+            exchange_name (str): Nome dell'exchange su cui pubblicare il messaggio.
+            msg_type (str): Tipo di messaggio.
+            data (dict): Dati del messaggio.
+            routing_key (str): Chiave di routing per il messaggio (default: ""). Se vuota, il messaggio viene inviato a tutti i consumatori dell'exchange.
+        """
+        exchange = await self.get_exchange(exchange_name)
+        await exchange.publish(self.build_message(msg_type, data), routing_key=routing_key)
         logger.info(
             f"Sent message to exchange {exchange_name}. Type: {msg_type}, Routing key: {routing_key} (aio-pika)")
 
+    async def publish_many(self, exchange_name, msg_type, items, routing_key="", window=None):
+        """Pubblica molti messaggi con publisher confirms, tenendo in volo fino a ``window`` conferme (asincrono).
+
+        I messaggi di una finestra vengono inviati senza attendere l'ack del precedente; la finestra successiva
+        parte quando il broker ha confermato tutta quella corrente. Se qualche messaggio di una finestra non viene
+        confermato (nack) la pubblicazione si ferma a fine finestra con ``PublishConfirmError``, che riporta
+        quanti messaggi sono stati confermati e quali no.
+
+        Args:
+            exchange_name (str): Nome dell'exchange su cui pubblicare i messaggi.
+            msg_type (str): Tipo dei messaggi.
+            items (Iterable[dict]): Dati dei messaggi.
+            routing_key (str): Chiave di routing dei messaggi (default: "").
+            window (int | None): Numero massimo di conferme in attesa (default: settings.PUBLISH_CONFIRM_WINDOW).
+
+        Returns:
+            int: Numero di messaggi pubblicati e confermati.
+        """
+        if window is None:
+            window = settings.PUBLISH_CONFIRM_WINDOW
+        exchange = await self.get_exchange(exchange_name)
+
+        published = 0
+        attempted = 0
+
+        async def confirm(pending):
+            nonlocal published, attempted
+            results = await asyncio.gather(*pending, return_exceptions=True)
+            errors = {attempted + i: result for i, result in enumerate(results) if isinstance(result, BaseException)}
+            attempted += len(results)
+            published += len(results) - len(errors)
+            if errors:
+                error = next(iter(errors.values()))
+                raise PublishConfirmError(published, list(errors), attempted, error) from error
+
+        pending = []
+        for data in items:
+            pending.append(exchange.publish(self.build_message(msg_type, data), routing_key=routing_key))
+            if len(pending) >= window:
+                await confirm(pending)
+                pending = []
+        if pending:
+            await confirm(pending)
+
+        logger.info(
+            f"Sent {published} messages to exchange {exchange_name}. Type: {msg_type}, Routing key: {routing_key} "
+            f"(aio-pika)")
+        return published
+
+    async def drain(self, timeout):
+        """Smette di ricevere nuovi messaggi e attende la conclusione di quelli in corso (asincrono).
+
+        I consumer vengono cancellati (il canale resta aperto per ack e retry), i messaggi ricevuti ma non ancora
+        iniziati vengono rimessi in coda e si attende fino a ``timeout`` secondi che quelli in esecuzione finiscano.
+
+        Args:
+            timeout (float): Secondi massimi di attesa.
+
+        Returns:
+            bool: True se tutti i messaggi in corso sono stati conclusi entro il timeout.
+        """
+        self.draining = True
+        for queue_name in list(self.consumer_tags.keys()):
+            await self.unsubscribe(queue_name, unbind=False)
+
+        in_flight, buffered, completed = self.in_flight, self.pending - self.in_flight, self.completed
+        logger.info(f"Draining RabbitMQ consumers: {in_flight} in flight, {buffered} buffered (timeout {timeout}s)")
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+            drained = True
+        except asyncio.TimeoutError:
+            drained = False
+        logger.log(
+            logging.INFO if drained else logging.WARNING,
+            f"Drain {'completed' if drained else 'timed out'}: {self.completed - completed} messages finished, "
+            f"{self.in_flight} still in flight")
+        return drained
+
     async def close(self):
         """Chiude la connessione a RabbitMQ e annulla tutte le sottoscrizioni (asincrono)."""
         for queue_name in list(self.consumer_tags.keys()):
@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+
+from app.core.logging import get_logger
+
+if TYPE_CHECKING:
+    # SQLAlchemy viene importato solo se DEDUP_BACKEND_URL è configurato
+    from app.services.dedup_backend import SQLDeduplicationBackend
+
+logger = get_logger(__name__)
+
+
+class DeliveryInProgressError(RuntimeError):
+    """Un altro task sta già consegnando il messaggio con la stessa chiave: riprovare più tardi."""
+
+
+class DeduplicationStore:
+    """Registro delle consegne già effettuate, per non inviare due volte lo stesso messaggio.
+
+    La cache in memoria è un LRU con TTL: con TTL costante l'ordine di inserimento coincide con l'ordine
+    di scadenza, quindi scadenze ed evizioni si gestiscono dalla testa in O(1) ammortizzato.
+    Il backend persistente opzionale viene consultato solo se la chiave non è in memoria.
+    """
+
+    def __init__(self, ttl: float = 86400, max_entries: int = 100_000, backend: SQLDeduplicationBackend | None = None):
+        """Inizializza lo store.
+
+        Args:
+            ttl (float): Secondi per cui una consegna viene ricordata (default: 86400).
+            max_entries (int): Numero massimo di chiavi in memoria (default: 100000).
+            backend (SQLDeduplicationBackend | None): Backend persistente opzionale.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.backend = backend
+        self.duplicates = 0
+        self._delivered: OrderedDict[str, float] = OrderedDict()
+        self._in_flight: set[str] = set()
+
+    def _expire(self, now: float):
+        while self._delivered:
+            key, expires_at = next(iter(self._delivered.items()))
+            if expires_at > now:
+                break
+            del self._delivered[key]
+
+    def _remember(self, key: str, expires_at: float):
+        self._delivered[key] = expires_at
+        self._delivered.move_to_end(key)
+        if len(self._delivered) > self.max_entries:
+            self._delivered.popitem(last=False)
+
+    async def claim(self, key: str) -> bool:
+        """Prenota la consegna di ``key``.
+
+        Returns:
+            bool: False se il messaggio è già stato consegnato, True se il chiamante deve consegnarlo
+            (e poi chiamare ``complete`` o ``release``).
+
+        Raises:
+            DeliveryInProgressError: Se la stessa chiave è in consegna in questo momento.
+        """
+        now = time.time()
+        self._expire(now)
+        if key in self._delivered:
+            self.duplicates += 1
+            return False
+        if key in self._in_flight:
+            raise DeliveryInProgressError(f"Delivery of {key} already in progress")
+        self._in_flight.add(key)
+
+        if self.backend is not None:
+            try:
+                delivered = await asyncio.to_thread(self.backend.contains, key, now)
+            except BaseException:
+                self._in_flight.discard(key)
+                raise
+            if delivered:
+                self._in_flight.discard(key)
+                self._remember(key, now + self.ttl)
+                self.duplicates += 1
+                return False
+        return True
+
+    async def complete(self, key: str):
+        """Registra ``key`` come consegnata."""
+        self._in_flight.discard(key)
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at)
+        if self.backend is not None:
+            try:
+                await asyncio.to_thread(self.backend.add, key, expires_at)
+            except Exception as e:
+                # La consegna è già avvenuta: resta comunque registrata in memoria
+                logger.error(f"Failed to persist delivered key {key}: {e}")
+
+    def release(self, key: str):
+        """Annulla la prenotazione di ``key`` dopo una consegna fallita."""
+        self._in_flight.discard(key)
+
+    async def purge(self) -> int:
+        """Rimuove le chiavi scadute dal backend persistente (la memoria scade da sola)."""
+        if self.backend is None:
+            return 0
+        return await asyncio.to_thread(self.backend.purge, time.time())
+
+    def stats(self) -> dict:
+        return {"entries": len(self._delivered), "in_flight": len(self._in_flight), "duplicates": self.duplicates}
@@ -0,0 +1,59 @@
+from __future__ import annotations
+
+from sqlalchemy import Column, Float, MetaData, String, Table, create_engine, delete, event, select
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+_metadata = MetaData()
+
+delivered_messages = Table(
+    "delivered_messages",
+    _metadata,
+    Column("key", String(255), primary_key=True),
+    Column("expires_at", Float, nullable=False, index=True),
+)
+
+
+class SQLDeduplicationBackend:
+    """Backend persistente (SQLAlchemy) delle chiavi già consegnate, ad esempio ``sqlite:///./dedup.db``.
+
+    I metodi sono sincroni: ``DeduplicationStore`` li esegue in un thread.
+    """
+
+    def __init__(self, url: str):
+        self.engine = create_engine(url)
+        if self.engine.dialect.name == "sqlite":
+            event.listen(self.engine, "connect", _enable_sqlite_wal)
+        _metadata.create_all(self.engine)
+
+    def contains(self, key: str, now: float) -> bool:
+        with self.engine.connect() as conn:
+            row = conn.execute(
+                select(delivered_messages.c.expires_at).where(delivered_messages.c.key == key)
+            ).first()
+        return row is not None and row.expires_at > now
+
+    def add(self, key: str, expires_at: float) -> None:
+        with self.engine.begin() as conn:
+            if self.engine.dialect.name == "sqlite":
+                conn.execute(
+                    sqlite_insert(delivered_messages)
+                    .values(key=key, expires_at=expires_at)
+                    .on_conflict_do_update(index_elements=["key"], set_={"expires_at": expires_at})
+                )
+            else:
+                conn.execute(delete(delivered_messages).where(delivered_messages.c.key == key))
+                conn.execute(delivered_messages.insert().values(key=key, expires_at=expires_at))
+
+    def purge(self, now: float) -> int:
+        with self.engine.begin() as conn:
+            return conn.execute(delete(delivered_messages).where(delivered_messages.c.expires_at <= now)).rowcount
+
+    def close(self) -> None:
+        self.engine.dispose()
+
+
+def _enable_sqlite_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
@@ -0,0 +1,123 @@
+"""Firma DKIM (RFC 6376, ``rsa-sha256`` con canonicalizzazione ``relaxed/relaxed``).
+
+La firma RSA è CPU-bound: ``sign_message`` è una funzione a livello di modulo, con argomenti e risultato
+serializzabili, pensata per girare nel pool di processi di firma (vedi ``app.core.executor.run_signing``).
+In ogni processo la chiave privata viene letta una sola volta per dominio/selettore e gli header ripetuti
+(From, MIME-Version, spesso Subject) vengono canonicalizzati una sola volta.
+"""
+from __future__ import annotations
+
+import base64
+import hashlib
+import re
+import time
+from functools import lru_cache
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+from app.services.message import PreparedEmail
+
+DEFAULT_SIGNED_HEADERS = ("From", "To", "Subject", "Date", "Message-ID", "MIME-Version", "Content-Type")
+
+_WSP = re.compile(rb"[ \t]+")
+_FOLD = re.compile(rb"\r\n(?=[ \t])")
+
+
+def relaxed_header(field: bytes) -> bytes:
+    """Canonicalizza un header (nome e valore, eventualmente ripiegato) secondo l'algoritmo ``relaxed``."""
+    name, _, value = field.partition(b":")
+    value = _WSP.sub(b" ", _FOLD.sub(b"", value)).strip(b" ")
+    return name.strip().lower() + b":" + value + b"\r\n"
+
+
+# Gli header uguali in tutti i messaggi (From, MIME-Version, Subject di una campagna) restano in cache
+_cached_relaxed_header = lru_cache(maxsize=4096)(relaxed_header)
+
+
+def relaxed_body(body: bytes) -> bytes:
+    """Canonicalizza il body secondo l'algoritmo ``relaxed`` (spazi compressi, righe vuote finali rimosse)."""
+    body = _WSP.sub(b" ", body).replace(b" \r\n", b"\r\n")
+    body = body.rstrip(b"\r\n").rstrip(b" ")
+    return body + b"\r\n" if body else b""
+
+
+def split_message(data: bytes) -> tuple[list[tuple[bytes, bytes]], bytes]:
+    """Separa gli header (nome in minuscolo, campo completo senza CRLF finale) dal body."""
+    end = data.find(b"\r\n\r\n")
+    if end == -1:
+        head, body = data, b""
+    else:
+        head, body = data[:end], data[end + 4:]
+    fields: list[tuple[bytes, bytes]] = []
+    for line in head.split(b"\r\n"):
+        if line[:1] in (b" ", b"\t") and fields:
+            name, field = fields[-1]
+            fields[-1] = (name, field + b"\r\n" + line)
+        else:
+            fields.append((line.partition(b":")[0].strip().lower(), line))
+    return fields, body
+
+
+class DKIMSigner:
+    """Firma i messaggi di un dominio con la chiave di un selettore."""
+
+    def __init__(self, domain: str, selector: str, private_key: rsa.RSAPrivateKey,
+                 signed_headers: tuple[str, ...] = DEFAULT_SIGNED_HEADERS):
+        """Inizializza il signer.
+
+        Args:
+            domain (str): Dominio della firma (tag ``d=``).
+            selector (str): Selettore della chiave pubblicata in DNS (tag ``s=``).
+            private_key (RSAPrivateKey): Chiave privata RSA.
+            signed_headers (tuple[str, ...]): Header da firmare, se presenti nel messaggio.
+        """
+        if not isinstance(private_key, rsa.RSAPrivateKey):
+            raise ValueError(f"DKIM key for {selector}._domainkey.{domain} is not an RSA key")
+        self.domain = domain
+        self.selector = selector
+        self.private_key = private_key
+        self.signed_headers = tuple(name.lower().encode() for name in signed_headers)
+        # Parte fissa del DKIM-Signature, uguale per tutti i messaggi del signer
+        self._prefix = f"DKIM-Signature: v=1; a=rsa-sha256; c=relaxed/relaxed; d={domain}; s={selector};\r\n\t"
+
+    def sign(self, data: bytes, timestamp: int | None = None) -> bytes:
+        """Restituisce il messaggio con l'header ``DKIM-Signature`` in testa."""
+        fields, body = split_message(data)
+        body_hash = base64.b64encode(hashlib.sha256(relaxed_body(body)).digest()).decode()
+
+        # Per gli header ripetuti si firma l'istanza più in basso (RFC 6376, 5.4.2)
+        available: dict[bytes, list[bytes]] = {}
+        for name, field in fields:
+            available.setdefault(name, []).append(field)
+        names, canonical = [], []
+        for name in self.signed_headers:
+            if available.get(name):
+                names.append(name.decode())
+                canonical.append(_cached_relaxed_header(available[name].pop()))
+
+        timestamp = int(time.time()) if timestamp is None else timestamp
+        header = f"{self._prefix}t={timestamp}; h={':'.join(names)};\r\n\tbh={body_hash};\r\n\tb="
+        # L'header DKIM-Signature stesso è firmato con b= vuoto e senza CRLF finale
+        signed = b"".join(canonical) + relaxed_header(header.encode())[:-2]
+        signature = self.private_key.sign(signed, padding.PKCS1v15(), hashes.SHA256())
+        return header.encode() + base64.b64encode(signature) + b"\r\n" + data
+
+
+@lru_cache(maxsize=None)
+def load_private_key(path: str) -> rsa.RSAPrivateKey:
+    with open(path, "rb") as f:
+        return serialization.load_pem_private_key(f.read(), password=None)
+
+
+@lru_cache(maxsize=None)
+def get_signer(domain: str, selector: str, key_path: str, signed_headers: tuple[str, ...]) -> DKIMSigner:
+    """Signer del dominio/selettore, creato (e chiave letta) una sola volta per processo."""
+    return DKIMSigner(domain, selector, load_private_key(key_path), signed_headers)
+
+
+def sign_message(prepared: PreparedEmail, domain: str, selector: str, key_path: str,
+                 signed_headers: tuple[str, ...] = DEFAULT_SIGNED_HEADERS) -> PreparedEmail:
+    """Firma un messaggio già serializzato (sincrona, eseguita nel pool di firma)."""
+    signer = get_signer(domain, selector, key_path, signed_headers)
+    return PreparedEmail(sender=prepared.sender, recipients=prepared.recipients, data=signer.sign(prepared.data))
@@ -1,19 +1,97 @@
 from __future__ import annotations
 
+import asyncio
 import logging
+import sys
+import time
+from contextlib import asynccontextmanager
+from dataclasses import replace
+from functools import lru_cache
 from pathlib import Path
+from typing import TYPE_CHECKING, Any, AsyncIterator, Callable
 
-from fastapi.templating import Jinja2Templates
-from fastapi_mail import ConnectionConfig, FastMail, MessageSchema, MessageType
+import aiosmtplib
+from fastapi_mail import ConnectionConfig
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template
+from pydantic import SecretStr
 
-from app.core.config import settings
+from app.core import metrics
+from app.core.config import RelaySettings, settings
+from app.core.executor import run_blocking, run_signing
 from app.core.logging import get_logger
-from app.schemas.email import EmailRequest, SendEmailResponseStatus
+from app.schemas.email import (
+    BatchEmailRequest,
+    BatchRecipient,
+    BatchSendResponseStatus,
+    EmailRequest,
+    RecipientSendResult,
+    SendEmailResponseStatus,
+)
+from app.services.dedup import DeduplicationStore, DeliveryInProgressError
+from app.services.dkim import sign_message
+from app.services.message import PreparedEmail, build_html_message, group_recipients
+from app.services.rate_limit import SendRateLimiter, is_relay_unavailable
+from app.services.rendering import BulkTemplateRenderer
+from app.services.relays import CircuitBreaker, Relay, RelayRouter
+from app.services.smtp_pool import PooledFastMail, SMTPConnectionPool
+
+if TYPE_CHECKING:
+    # Moduli con SQLAlchemy, importati solo se il relativo *_URL è configurato
+    from app.services.scheduled import DeliveryScheduler
+    from app.services.spool import OutboundSpool
 
 logger = get_logger(__name__)
 
+# Esiti considerati consegnati: inviata (200) o salvata nello spool locale o tra le programmate (202)
+DELIVERED_CODES = frozenset({200, 202})
+
+# Header To dei messaggi inviati a più destinatari con una sola transazione (RFC 5322, gruppo vuoto)
+UNDISCLOSED_RECIPIENTS = "undisclosed-recipients:;"
+
 BASE_DIR = Path(__file__).resolve().parents[1]  # recupera la directory principale dell'applicazione
-templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))  # Imposta la directory dei template
+
+
+def create_template_environment() -> Environment:
+    """Crea l'ambiente Jinja2 dei template email.
+
+    Il bytecode compilato viene salvato in ``TEMPLATE_BYTECODE_CACHE_DIR`` (condiviso tra i worker dello stesso
+    container) e in produzione i template in memoria non vengono ricontrollati sul filesystem.
+    """
+    bytecode_cache = None
+    if settings.TEMPLATE_BYTECODE_CACHE_DIR:
+        cache_dir = Path(settings.TEMPLATE_BYTECODE_CACHE_DIR)
+        try:
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(str(cache_dir))
+        except OSError as e:
+            logger.warning(f"Template bytecode cache disabled ({cache_dir}): {e}")
+
+    return Environment(
+        loader=FileSystemLoader(str(BASE_DIR / "templates")),  # Imposta la directory dei template
+        autoescape=True,
+        bytecode_cache=bytecode_cache,
+        auto_reload=settings.ENVIRONMENT != "production",
+        cache_size=-1,  # tutti i template restano compilati in memoria
+    )
+
+
+# Ambiente Jinja2 senza fastapi.templating: il worker non importa FastAPI
+templates = create_template_environment()
+
+
+def warm_templates() -> int:
+    """Compila in anticipo tutti i template HTML, così il traffico reale non paga la compilazione.
+
+    Returns:
+        int: Numero di template compilati.
+    """
+    start = time.perf_counter()
+    names = templates.list_templates(extensions=["html"])
+    for name in names:
+        templates.get_template(name)
+    logger.info(f"Warmed {len(names)} templates in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return len(names)
+
 
 conf = ConnectionConfig(
     MAIL_USERNAME=settings.MAIL_USERNAME,
@@ -28,30 +106,478 @@ conf = ConnectionConfig(
     VALIDATE_CERTS=settings.VALIDATE_CERTS
 )
 
-fast_mail = FastMail(conf)
+# Limiti di invio imposti dai relay (token bucket per relay e mittente + concorrenza adattiva)
+rate_limiter = SendRateLimiter(
+    per_second=settings.SMTP_RATE_LIMIT_PER_SECOND,
+    per_hour=settings.SMTP_RATE_LIMIT_PER_HOUR,
+    sender_per_second=settings.SMTP_SENDER_RATE_LIMIT_PER_SECOND,
+    sender_per_hour=settings.SMTP_SENDER_RATE_LIMIT_PER_HOUR,
+    min_concurrency=settings.SMTP_MIN_CONCURRENCY,
+    max_concurrency=settings.SMTP_POOL_MAX_SIZE,
+)
+
+
+def create_relay_router() -> RelayRouter:
+    """Crea un pool di sessioni SMTP persistenti e un circuit breaker per ogni relay di ``MAIL_RELAYS``
+    (o per il solo ``MAIL_SERVER`` se la lista è vuota).
+    """
+    relay_settings = settings.MAIL_RELAYS or [RelaySettings(
+        server=settings.MAIL_SERVER,
+        port=settings.MAIL_PORT,
+        starttls=settings.MAIL_STARTTLS,
+        ssl_tls=settings.MAIL_SSL_TLS,
+    )]
+    relays = []
+    for relay in relay_settings:
+        relay_conf = conf.model_copy(update={
+            "MAIL_SERVER": relay.server,
+            "MAIL_PORT": relay.port,
+            "MAIL_USERNAME": relay.username or conf.MAIL_USERNAME,
+            "MAIL_PASSWORD": SecretStr(relay.password) if relay.password else conf.MAIL_PASSWORD,
+            "MAIL_STARTTLS": relay.starttls,
+            "MAIL_SSL_TLS": relay.ssl_tls,
+        })
+        name = f"{relay.server}:{relay.port}"
+        relays.append(Relay(
+            name=name,
+            pool=SMTPConnectionPool(
+                relay_conf,
+                name=name,
+                min_size=settings.SMTP_POOL_MIN_SIZE,
+                max_size=settings.SMTP_POOL_MAX_SIZE,
+                idle_timeout=settings.SMTP_POOL_IDLE_TIMEOUT,
+            ),
+            weight=relay.weight,
+            breaker=CircuitBreaker(
+                failure_threshold=settings.SMTP_BREAKER_FAILURE_THRESHOLD,
+                latency_threshold=settings.SMTP_BREAKER_LATENCY_THRESHOLD,
+                reset_timeout=settings.SMTP_BREAKER_RESET_TIMEOUT,
+            ),
+        ))
+    return RelayRouter(relays, rate_limiter=rate_limiter)
+
+
+# Relay SMTP con sessioni persistenti, bilanciamento e failover condivisi da tutti gli invii
+smtp_relays = create_relay_router()
+
+fast_mail = PooledFastMail(conf, smtp_relays)
+
+
+def create_dedup_store() -> DeduplicationStore:
+    backend = None
+    if settings.DEDUP_BACKEND_URL:
+        from app.services.dedup_backend import SQLDeduplicationBackend
+
+        backend = SQLDeduplicationBackend(settings.DEDUP_BACKEND_URL)
+    return DeduplicationStore(ttl=settings.DEDUP_TTL, max_entries=settings.DEDUP_MAX_ENTRIES, backend=backend)
+
+
+# Registro delle consegne già effettuate (id dei messaggi broker e chiavi di idempotenza delle API)
+dedup_store = create_dedup_store()
+
+
+async def _send_now(prepared: PreparedEmail) -> dict:
+    """Invia l'email in modo asincrono tramite i relay (che applicano i limiti di invio).
+
+    Returns:
+        dict: Destinatari rifiutati dal relay (``{indirizzo: SMTPResponse}``), vuoto se tutti accettati.
+    """
+    result = await fast_mail.send_message(prepared)
+    # aiosmtplib restituisce (rifiutati, risposta al DATA); None con SUPPRESS_SEND
+    return result[0] if isinstance(result, tuple) else {}
+
+
+def create_spool() -> OutboundSpool | None:
+    if not settings.SPOOL_URL:
+        return None
+    from app.services.spool import OutboundSpool, SQLSpoolBackend
+
+    return OutboundSpool(
+        SQLSpoolBackend(settings.SPOOL_URL),
+        _send_now,
+        flush_interval=settings.SPOOL_FLUSH_INTERVAL,
+        batch_size=settings.SPOOL_BATCH_SIZE,
+        max_attempts=settings.SPOOL_MAX_ATTEMPTS,
+    )
+
+
+# Spool locale dei messaggi da inviare quando il relay non risponde (disabilitato senza SPOOL_URL)
+spool = create_spool()
+
+
+class SchedulingDisabledError(ValueError):
+    """Richiesta con ``send_at`` nel futuro ma ``SCHEDULE_URL`` non configurato.
+
+    È un ``ValueError`` perché riprovare non serve: il consumer scarta il messaggio invece di rimetterlo in coda.
+    """
+
+
+async def _send_scheduled(payload: bytes, idempotency_key: str | None) -> None:
+    """Invia un'email programmata giunta all'orario previsto (il payload non contiene più ``send_at``)."""
+    await send_email(EmailRequest.model_validate_json(payload), idempotency_key)
+
+
+def create_scheduler() -> DeliveryScheduler | None:
+    if not settings.SCHEDULE_URL:
+        return None
+    from app.services.scheduled import DeliveryScheduler, SQLScheduleBackend
+
+    return DeliveryScheduler(
+        SQLScheduleBackend(settings.SCHEDULE_URL),
+        _send_scheduled,
+        release_rate=settings.SCHEDULE_RELEASE_RATE,
+        horizon=settings.SCHEDULE_HORIZON,
+        max_in_memory=settings.SCHEDULE_MAX_IN_MEMORY,
+        poll_interval=settings.SCHEDULE_POLL_INTERVAL,
+        max_attempts=settings.SCHEDULE_MAX_ATTEMPTS,
+        base_delay=settings.RETRY_BASE_DELAY,
+        max_delay=settings.RETRY_MAX_DELAY,
+    )
+
+
+# Email programmate con send_at (disabilitate senza SCHEDULE_URL)
+scheduler = create_scheduler()
+
+# Cache dei template pre-renderizzati per gli invii batch
+bulk_renderer = BulkTemplateRenderer(max_entries=settings.BULK_RENDER_CACHE_SIZE)
+
+
+# Chiavi DKIM per dominio mittente
+dkim_keys = {key.domain.lower(): key for key in settings.DKIM_KEYS}
+DKIM_SIGNED_HEADERS = tuple(settings.DKIM_SIGNED_HEADERS)
+
+
+async def dkim_sign(prepared: PreparedEmail) -> PreparedEmail:
+    """Firma il messaggio nel pool di firma con la chiave DKIM del dominio mittente.
+
+    Senza una chiave per quel dominio il messaggio resta invariato: una firma con ``d=`` diverso dal dominio
+    del From non passerebbe l'allineamento DMARC.
+    """
+    if not dkim_keys:
+        return prepared
+    domain = prepared.sender.rpartition("@")[2].lower()
+    key = dkim_keys.get(domain)
+    if key is None:
+        logger.warning(f"No DKIM key for sender domain {domain}: sending unsigned")
+        return prepared
+    return await run_signing(
+        sign_message, prepared, key.domain, key.selector, key.private_key_path, DKIM_SIGNED_HEADERS
+    )
 
 
-async def send_email(request: EmailRequest) -> SendEmailResponseStatus:
+@lru_cache(maxsize=1024)
+def _template_file(template_name: str) -> str:
+    # Stessa stringa (con hash già calcolato) per tutte le richieste: la cache dei template di Jinja2 la confronta per identità
+    return sys.intern(f"{template_name}.html")
+
+
+def get_template(template_name: str) -> Template:
     template = templates.get_template(
-        f"{request.template_name}.html")  # Carica il template Jinja2 specificato dalla richiesta
+        _template_file(template_name))  # Carica il template Jinja2 specificato dalla richiesta
 
     if not template:
-        raise ValueError(f"Template {request.template_name} not found")
+        raise ValueError(f"Template {template_name} not found")
+    return template
+
+
+def render_message(template_name: str, context: dict, subject: str, to_header: str, to_address: str) -> PreparedEmail:
+    """Renderizza il template e costruisce il messaggio MIME (sincrono, eseguito nel pool di rendering)."""
+    template = get_template(template_name)
+    html_content = template.render(**context)  # Rederizza il template con il contesto fornito
+    return build_message(subject, to_header, to_address, html_content)
+
+
+def render_bulk_message(template_name: str, shared_context: dict, recipient_context: dict, subject: str,
+                        to_header: str, to_address: str) -> PreparedEmail:
+    """Come ``render_message`` per gli invii batch, con la cache di ``bulk_renderer`` (eseguito nel pool di rendering).
+
+    Con un pool di processi ogni processo ha la propria cache dei template pre-renderizzati.
+    """
+    template = get_template(template_name)
+    html_content = bulk_renderer.render(template, shared_context, recipient_context)
+    return build_message(subject, to_header, to_address, html_content)
+
+
+async def _render(render: Callable[..., PreparedEmail], template_name: str, *args: Any) -> PreparedEmail:
+    """Esegue ``render`` nel pool di rendering misurandone la durata lato event loop.
+
+    La durata è osservata qui perché i processi del pool di rendering non esportano le proprie metriche.
+    """
+    with metrics.timed(metrics.TEMPLATE_RENDER_DURATION, template_name):
+        return await run_blocking(render, template_name, *args)
+
+
+def build_message(subject: str, to_header: str, to_address: str, html_content: str) -> PreparedEmail:
+    return build_html_message(subject, to_header, to_address, html_content, fast_mail.sender, str(conf.MAIL_FROM))
+
 
-    html_content = template.render(**request.context)  # Rederizza il template con il contesto fornito
+@asynccontextmanager
+async def _idempotent(idempotency_key: str | None) -> AsyncIterator[bool]:
+    """Restituisce False se il messaggio con questa chiave è già stato consegnato.
 
-    message = MessageSchema(
-        subject=request.subject,
-        recipients=[request.to],
-        body=html_content,
-        subtype=MessageType.html
+    Alla chiusura senza errori la chiave viene registrata come consegnata, in caso di errore viene liberata.
+    """
+    if idempotency_key is None:
+        yield True
+        return
+    if not await dedup_store.claim(idempotency_key):
+        logger.info("Skipping duplicate delivery %s", idempotency_key)
+        yield False
+        return
+    try:
+        yield True
+    except BaseException:
+        dedup_store.release(idempotency_key)
+        raise
+    await dedup_store.complete(idempotency_key)
+
+
+def _already_sent(request: EmailRequest, idempotency_key: str) -> SendEmailResponseStatus:
+    metrics.EMAILS.labels("duplicate").inc()
+    return SendEmailResponseStatus(
+        code=200,
+        message="Email already sent",
+        detail=f"Email to {request.to} already sent (idempotency key {idempotency_key})"
     )
 
-    # Invia l'email in modo asincrono
-    await fast_mail.send_message(message)
+
+async def schedule_email(request: EmailRequest, idempotency_key: str | None = None) -> SendEmailResponseStatus:
+    """Salva l'email per l'invio all'orario ``send_at`` (ritorna dopo che è stata scritta su disco)."""
+    if scheduler is None:
+        raise SchedulingDisabledError(f"Cannot schedule email to {request.to}: scheduled delivery is not configured")
+    payload = request.model_dump_json(exclude={"send_at"}).encode()
+    if not await scheduler.add(payload, request.send_at.timestamp(), idempotency_key):
+        metrics.EMAILS.labels("duplicate").inc()
+        return SendEmailResponseStatus(
+            code=202,
+            message="Email already scheduled",
+            detail=f"Email to {request.to} already scheduled (idempotency key {idempotency_key})"
+        )
+    metrics.EMAILS.labels("scheduled").inc()
+    return SendEmailResponseStatus(
+        code=202,
+        message="Email scheduled",
+        detail=f"Email to {request.to} scheduled for {request.send_at.isoformat()}"
+    )
+
+
+async def send_email(request: EmailRequest, idempotency_key: str | None = None) -> SendEmailResponseStatus:
+    if request.send_at is not None and request.send_at.timestamp() > time.time():
+        return await schedule_email(request, idempotency_key)
+
+    async with _idempotent(idempotency_key) as first_delivery:
+        if not first_delivery:
+            return _already_sent(request, idempotency_key)
+
+        # Rendering Jinja2 e serializzazione MIME fuori dall'event loop
+        prepared = await _render(
+            render_message, request.template_name, request.context, request.subject, str(request.to), request.to.email
+        )
+
+        return await _deliver(request, prepared)
+
+
+async def _transmit(prepared: PreparedEmail, description: str) -> tuple[int, dict]:
+    """Invia il messaggio o, se il relay non è disponibile e lo spool è attivo, lo salva nello spool.
+
+    Returns:
+        tuple[int, dict]: 200 se inviato o 202 se salvato nello spool, e destinatari rifiutati dal relay.
+    """
+    if spool is None or not spool.relay_down:
+        try:
+            refused = await _send_now(prepared)
+        except Exception as e:
+            if spool is None or not is_relay_unavailable(e):
+                raise
+            logger.warning(f"SMTP relay unavailable while sending to {description}: {e}")
+            spool.mark_unavailable()
+        else:
+            metrics.EMAILS.labels("sent").inc()
+            return 200, refused
+    # Il messaggio è su disco: il chiamante può confermarlo e verrà inviato dal flusher dello spool
+    await spool.append(prepared)
+    metrics.EMAILS.labels("spooled").inc()
+    return 202, {}
+
+
+async def _deliver(request: EmailRequest, prepared: PreparedEmail) -> SendEmailResponseStatus:
+    code, _ = await _transmit(await dkim_sign(prepared), str(request.to))
+    if code == 202:
+        return SendEmailResponseStatus(
+            code=202,
+            message="Email queued for delivery",
+            detail=f"SMTP relay unavailable: email to {request.to} spooled for later delivery"
+        )
 
     return SendEmailResponseStatus(
         code=200,
         message="Email sent successfully",
         detail=f"Email sent to {request.to} using template {request.template_name}"
     )
+
+
+async def _send_merged(request: BatchEmailRequest, recipients: list[BatchRecipient],
+                       idempotency_key: str | None, semaphore: asyncio.Semaphore) -> dict[str, RecipientSendResult]:
+    """Invia lo stesso messaggio a tutti i ``recipients`` con una transazione SMTP per blocco di destinatari.
+
+    Il corpo viene renderizzato e serializzato una sola volta, con header ``To: undisclosed-recipients:;``
+    per non esporre gli altri indirizzi; ogni blocco (stesso dominio, al massimo
+    ``SMTP_MAX_RECIPIENTS_PER_TRANSACTION`` destinatari) carica il DATA una volta sola con più RCPT TO.
+    I destinatari rifiutati dal relay sono riportati singolarmente.
+
+    Returns:
+        dict[str, RecipientSendResult]: Esito per indirizzo.
+    """
+    outcomes, keys = await _claim_recipients(recipients, idempotency_key)
+
+    if keys:
+        try:
+            prepared = await dkim_sign(await _render(
+                render_bulk_message, request.template_name, request.context, {}, request.subject,
+                UNDISCLOSED_RECIPIENTS, next(iter(keys)),
+            ))
+        except Exception as e:
+            logger.error(f"Failed to render batch email: {e}")
+            outcomes.update((address, (500, str(e))) for address in keys)
+        else:
+            chunks = group_recipients(list(keys), settings.SMTP_MAX_RECIPIENTS_PER_TRANSACTION)
+            for chunk_outcomes in await asyncio.gather(*(
+                _send_chunk(replace(prepared, recipients=chunk), request.template_name, semaphore) for chunk in chunks
+            )):
+                outcomes.update(chunk_outcomes)
+
+    for address, key in keys.items():
+        if key is None:
+            continue
+        if outcomes[address][0] in DELIVERED_CODES:
+            await dedup_store.complete(key)
+        else:
+            dedup_store.release(key)
+
+    return {
+        recipient.to.email: RecipientSendResult(
+            to=str(recipient.to), code=outcomes[recipient.to.email][0], detail=outcomes[recipient.to.email][1]
+        )
+        for recipient in recipients
+    }
+
+
+async def _claim_recipients(recipients: list[BatchRecipient],
+                            idempotency_key: str | None) -> tuple[dict[str, tuple[int, str]], dict[str, str | None]]:
+    """Prenota la consegna di ogni indirizzo (una volta sola anche se ripetuto nel batch).
+
+    Returns:
+        tuple: Esiti già noti (già inviati o in consegna altrove) e chiavi degli indirizzi da inviare.
+    """
+    outcomes: dict[str, tuple[int, str]] = {}
+    keys: dict[str, str | None] = {}
+    for recipient in recipients:
+        address = recipient.to.email
+        if address in outcomes or address in keys:
+            continue
+        key = f"{idempotency_key}:{address}" if idempotency_key is not None else None
+        try:
+            if key is not None and not await dedup_store.claim(key):
+                outcomes[address] = (200, f"Email to {recipient.to} already sent (idempotency key {key})")
+                continue
+        except DeliveryInProgressError as e:
+            outcomes[address] = (500, str(e))
+            continue
+        keys[address] = key
+    return outcomes, keys
+
+
+async def _send_chunk(prepared: PreparedEmail, template_name: str,
+                      semaphore: asyncio.Semaphore) -> dict[str, tuple[int, str]]:
+    """Invia un blocco multi-RCPT e restituisce l'esito di ogni destinatario."""
+    async with semaphore:
+        try:
+            code, refused = await _transmit(prepared, f"{len(prepared.recipients)} recipients")
+        except aiosmtplib.SMTPRecipientsRefused as e:
+            code, refused = 500, {error.recipient: error for error in e.recipients}
+        except Exception as e:
+            logger.error(f"Failed to send batch email to {len(prepared.recipients)} recipients: {e}")
+            return {address: (500, str(e)) for address in prepared.recipients}
+
+    outcomes = {}
+    for address in prepared.recipients:
+        if address in refused:
+            outcomes[address] = (500, f"Recipient refused: {refused[address]}")
+        elif code == 202:
+            outcomes[address] = (202, f"SMTP relay unavailable: email to {address} spooled for later delivery")
+        else:
+            outcomes[address] = (200, f"Email sent to {address} using template {template_name}")
+    return outcomes
+
+
+async def send_email_batch(request: BatchEmailRequest, idempotency_key: str | None = None) -> BatchSendResponseStatus:
+    """Invia lo stesso template a più destinatari in modo concorrente.
+
+    Con ``idempotency_key`` ogni destinatario viene deduplicato con la chiave ``<idempotency_key>:<indirizzo>``,
+    quindi un batch ripetuto invia solo ai destinatari non ancora raggiunti.
+
+    Il contesto di ogni destinatario viene unito a quello condiviso (le chiavi del destinatario hanno la precedenza).
+    Il template viene renderizzato una sola volta con il contesto condiviso e per ogni destinatario
+    vengono sostituiti solo i suoi valori (vedi BulkTemplateRenderer).
+    Con ``merge_recipients`` i destinatari senza contesto proprio ricevono un unico messaggio, inviato con
+    transazioni multi-RCPT raggruppate per dominio (vedi ``_send_merged``).
+    Gli errori dei singoli destinatari non interrompono il batch ma sono riportati nei risultati.
+    """
+    try:
+        get_template(request.template_name)  # template inesistente: il batch fallisce subito
+    except Exception as e:
+        results = [RecipientSendResult(to=str(r.to), code=500, detail=str(e)) for r in request.recipients]
+        return BatchSendResponseStatus(code=500, message="Failed to send batch", sent=0, failed=len(results),
+                                       results=results)
+
+    semaphore = asyncio.Semaphore(settings.BATCH_SEND_CONCURRENCY)
+
+    async def send_one(recipient: BatchRecipient) -> RecipientSendResult:
+        # I campi sono già stati validati insieme al batch: model_construct evita una seconda validazione
+        email_request = EmailRequest.model_construct(
+            to=recipient.to,
+            subject=request.subject,
+            template_name=request.template_name,
+            context={**request.context, **recipient.context},
+        )
+        recipient_key = f"{idempotency_key}:{recipient.to.email}" if idempotency_key is not None else None
+        async with semaphore:
+            try:
+                async with _idempotent(recipient_key) as first_delivery:
+                    if not first_delivery:
+                        result = _already_sent(email_request, recipient_key)
+                    else:
+                        prepared = await _render(
+                            render_bulk_message, request.template_name, request.context, recipient.context,
+                            request.subject, str(recipient.to), recipient.to.email,
+                        )
+                        result = await _deliver(email_request, prepared)
+                return RecipientSendResult(to=str(recipient.to), code=result.code, detail=result.detail)
+            except Exception as e:
+                logger.error(f"Failed to send batch email to {recipient.to}: {e}")
+                return RecipientSendResult(to=str(recipient.to), code=500, detail=str(e))
+
+    merged = [recipient for recipient in request.recipients if not recipient.context]
+    if request.merge_recipients and merged:
+        merged_results, individual = await asyncio.gather(
+            _send_merged(request, merged, idempotency_key, semaphore),
+            asyncio.gather(*(send_one(recipient) for recipient in request.recipients if recipient.context)),
+        )
+        individual = iter(individual)
+        results = [
+            merged_results[recipient.to.email] if not recipient.context else next(individual)
+            for recipient in request.recipients
+        ]
+    else:
+        results = await asyncio.gather(*(send_one(recipient) for recipient in request.recipients))
+
+    sent = sum(1 for result in results if result.code in DELIVERED_CODES)
+    failed = len(results) - sent
+    if failed == 0:
+        code, message = 200, "Batch sent successfully"
+    elif sent == 0:
+        code, message = 500, "Failed to send batch"
+    else:
+        code, message = 207, "Batch partially sent"
+
+    return BatchSendResponseStatus(code=code, message=message, sent=sent, failed=failed, results=list(results))
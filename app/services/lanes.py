@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager, suppress
+from typing import AsyncIterator
+
+from app.core.logging import get_logger
+from app.services.broker import published_at
+from app.services.rate_limit import TokenBucket
+
+logger = get_logger(__name__)
+
+TRANSACTIONAL = "transactional"
+BULK = "bulk"
+LANES = (TRANSACTIONAL, BULK)  # in ordine di priorità
+
+
+class LaneLatency:
+    """Latenza di coda di una lane: dalla pubblicazione del messaggio all'inizio dell'elaborazione."""
+    __slots__ = ("count", "total", "max", "last")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+
+    def record(self, seconds: float):
+        seconds = max(seconds, 0.0)  # tollera piccoli sfasamenti di clock tra producer e consumer
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.last = seconds
+
+    def stats(self) -> dict:
+        return {
+            "count": self.count,
+            "avg": round(self.total / self.count, 4) if self.count else 0.0,
+            "max": round(self.max, 4),
+            "last": round(self.last, 4),
+        }
+
+
+class LaneScheduler:
+    """Ripartisce gli slot di elaborazione tra la lane transazionale e quella bulk.
+
+    Gli slot liberi vanno sempre prima ai messaggi transazionali in attesa. La lane bulk usa al massimo
+    ``bulk_max_share`` degli slot e ne ha ``bulk_min`` riservati quando ha messaggi in attesa, così una campagna
+    non ritarda le email transazionali ma continua comunque ad avanzare.
+    """
+
+    def __init__(self, concurrency: int, *, bulk_max_share: float = 0.5, bulk_min: int = 1, bulk_rate: float = 0):
+        """Inizializza lo scheduler.
+
+        Args:
+            concurrency (int): Numero totale di messaggi elaborati contemporaneamente (>= 1).
+            bulk_max_share (float): Frazione massima degli slot usabile dalla lane bulk (default: 0.5).
+            bulk_min (int): Slot riservati alla lane bulk quando ha messaggi in attesa (default: 1).
+            bulk_rate (float): Messaggi bulk al secondo, 0 = nessun limite (default: 0).
+        """
+        if concurrency < 1:
+            raise ValueError("concurrency must be >= 1")
+        self.concurrency = concurrency
+        self.bulk_max = max(1, min(concurrency, int(concurrency * bulk_max_share)))
+        # Almeno uno slot resta sempre disponibile per la lane transazionale
+        self.bulk_min = max(0, min(bulk_min, self.bulk_max, concurrency - 1))
+        self.running = {lane: 0 for lane in LANES}
+        self.latency = {lane: LaneLatency() for lane in LANES}
+        self._waiters: dict[str, deque[asyncio.Future]] = {lane: deque() for lane in LANES}
+        self._bulk_bucket = TokenBucket(bulk_rate, capacity=max(bulk_rate, 1)) if bulk_rate > 0 else None
+
+    def _has_waiters(self, lane: str) -> bool:
+        # I waiter cancellati ma non ancora rimossi non contano
+        return any(not waiter.done() for waiter in self._waiters[lane])
+
+    def _can_start(self, lane: str) -> bool:
+        total = sum(self.running.values())
+        if total >= self.concurrency:
+            return False
+        if lane == TRANSACTIONAL:
+            reserved = 0
+            if self._has_waiters(BULK) and self.running[BULK] < self.bulk_min:
+                reserved = self.bulk_min - self.running[BULK]
+            return total + reserved < self.concurrency
+        if self.running[BULK] >= self.bulk_max:
+            return False
+        return self.running[BULK] < self.bulk_min or not self._has_waiters(TRANSACTIONAL)
+
+    def _wake(self):
+        granted = True
+        while granted:
+            granted = False
+            for lane in LANES:
+                waiters = self._waiters[lane]
+                while waiters and waiters[0].done():
+                    waiters.popleft()  # waiter cancellati
+                if waiters and self._can_start(lane):
+                    self.running[lane] += 1
+                    waiters.popleft().set_result(None)
+                    granted = True
+                    break
+
+    @asynccontextmanager
+    async def slot(self, lane: str, enqueued_at: float | None = None) -> AsyncIterator[None]:
+        """Attende uno slot per la lane e lo occupa per la durata del blocco.
+
+        Args:
+            lane (str): ``TRANSACTIONAL`` o ``BULK``.
+            enqueued_at (float | None): Timestamp UNIX di pubblicazione, per misurare la latenza di coda.
+        """
+        if lane == BULK and self._bulk_bucket is not None:
+            await self._bulk_bucket.acquire()
+        if self._has_waiters(lane) or not self._can_start(lane):
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters[lane].append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Lo slot era già stato assegnato: lo si restituisce
+                    self.running[lane] -= 1
+                else:
+                    # Waiter abbandonato (consumer fermato o timeout): non deve più riservare slot
+                    with suppress(ValueError):
+                        self._waiters[lane].remove(waiter)
+                self._wake()
+                raise
+        else:
+            self.running[lane] += 1
+
+        if enqueued_at is not None:
+            self.latency[lane].record(time.time() - enqueued_at)
+        try:
+            yield
+        finally:
+            self.running[lane] -= 1
+            self._wake()
+
+    def limiter(self, lane: str):
+        """Restituisce il limiter per ``AsyncBrokerSingleton.subscribe`` che assegna i messaggi a ``lane``."""
+
+        def message_slot(message):
+            return self.slot(lane, published_at(message))
+
+        return message_slot
+
+    def stats(self) -> dict:
+        return {
+            lane: {
+                "running": self.running[lane],
+                "waiting": sum(1 for waiter in self._waiters[lane] if not waiter.done()),
+                "queue_latency": self.latency[lane].stats(),
+            }
+            for lane in LANES
+        }
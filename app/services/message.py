@@ -0,0 +1,53 @@
+from __future__ import annotations
+
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from email import policy
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import formatdate, make_msgid
+
+
+@dataclass(slots=True)
+class PreparedEmail:
+    """Messaggio già serializzato, pronto per la transazione SMTP."""
+    sender: str  # indirizzo MAIL FROM
+    recipients: list[str]  # indirizzi RCPT TO
+    data: bytes  # messaggio MIME completo (header + body)
+
+
+def build_html_message(subject: str, to_header: str, to_address: str, html: str, from_header: str,
+                       from_address: str, charset: str = "utf-8") -> PreparedEmail:
+    """Costruisce e serializza un messaggio HTML con la stessa struttura prodotta da fastapi-mail.
+
+    È una funzione sincrona e pura (argomenti e risultato serializzabili con pickle)
+    per poter essere eseguita in un pool di thread o di processi.
+    """
+    message = MIMEMultipart("mixed")
+    message.set_charset(charset)
+    message.attach(MIMEText(html, _subtype="html", _charset=charset))
+    message["Date"] = formatdate(time.time(), localtime=True)
+    message["Message-ID"] = make_msgid()
+    message["To"] = to_header
+    message["From"] = from_header
+    if subject:
+        message["Subject"] = subject
+    return PreparedEmail(sender=from_address, recipients=[to_address], data=message.as_bytes(policy=policy.SMTP))
+
+
+def group_recipients(addresses: list[str], max_per_transaction: int = 100) -> list[list[str]]:
+    """Raggruppa gli indirizzi per dominio in blocchi da inviare con un'unica transazione SMTP (più RCPT TO).
+
+    Gli indirizzi dello stesso dominio vengono consegnati dal relay allo stesso MX, quindi restano insieme;
+    ogni blocco contiene al massimo ``max_per_transaction`` destinatari (RFC 5321 ne garantisce almeno 100).
+    """
+    by_domain: dict[str, list[str]] = defaultdict(list)
+    for address in addresses:
+        by_domain[address.rpartition("@")[2].lower()].append(address)
+    size = max(max_per_transaction, 1)
+    return [
+        domain_addresses[start:start + size]
+        for domain_addresses in by_domain.values()
+        for start in range(0, len(domain_addresses), size)
+    ]
@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+import aiosmtplib
+from fastapi_mail.errors import ConnectionErrors
+
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# Risposte SMTP con cui i relay segnalano il superamento dei limiti (servizio non disponibile / riprova più tardi)
+THROTTLING_CODES = frozenset({421, 450, 451, 452})
+
+
+def is_throttling_error(error: BaseException | None) -> bool:
+    """Indica se l'errore (o la sua causa) è una risposta SMTP 4xx di throttling."""
+    while error is not None:
+        if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+            if any(recipient.code in THROTTLING_CODES for recipient in error.recipients):
+                return True
+        elif getattr(error, "code", None) in THROTTLING_CODES:
+            return True
+        error = error.__cause__
+    return False
+
+
+def is_permanent_rejection(error: BaseException | None) -> bool:
+    """Indica se il relay ha rifiutato il messaggio con una risposta 5xx (per tutti i destinatari): inutile riprovare."""
+    while error is not None:
+        if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+            if error.recipients and all(recipient.code >= 500 for recipient in error.recipients):
+                return True
+        elif isinstance(error, aiosmtplib.SMTPResponseException) and error.code >= 500:
+            return True
+        error = error.__cause__
+    return False
+
+
+# Errori che indicano un relay irraggiungibile o saturo (non un problema del singolo messaggio)
+_UNAVAILABLE_ERRORS = (
+    ConnectionErrors,
+    aiosmtplib.SMTPConnectError,
+    aiosmtplib.SMTPServerDisconnected,
+    aiosmtplib.SMTPTimeoutError,
+    ConnectionError,
+    OSError,
+)
+
+
+def is_relay_unavailable(error: BaseException | None) -> bool:
+    """Indica se l'invio è fallito perché il relay SMTP non è disponibile (connessione, timeout o throttling)."""
+    cause = error
+    while cause is not None:
+        if isinstance(cause, _UNAVAILABLE_ERRORS):
+            return True
+        cause = cause.__cause__
+    return is_throttling_error(error)
+
+
+class TokenBucket:
+    """Token bucket asincrono: ``rate`` token al secondo, al massimo ``capacity`` accumulati."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.waits = 0
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens: float = 1.0):
+        """Consuma ``tokens`` token, attendendo che si ricarichino se necessario (i waiter sono serviti in ordine).
+
+        Un costo superiore a ``capacity`` attende il bucket pieno e lo lascia in debito: le richieste successive
+        attendono che il debito sia ripagato, così il ritmo medio resta ``rate`` anche per le transazioni grandi.
+        """
+        async with self._lock:
+            self._refill()
+            needed = min(tokens, self.capacity)
+            while self.tokens < needed:
+                self.waits += 1
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+    def stats(self) -> dict:
+        self._refill()
+        return {"rate": self.rate, "capacity": self.capacity, "tokens": round(self.tokens, 3), "waits": self.waits}
+
+
+class AdaptiveConcurrencyLimiter:
+    """Limite di concorrenza AIMD: cresce di circa 1 per finestra di successi e si dimezza sul throttling.
+
+    Gli invii falliti per altri motivi (o annullati) non lo modificano: non dicono nulla sulla capacità del relay.
+    """
+
+    def __init__(self, initial: float, min_limit: float = 1, max_limit: float = 100, increase: float = 1.0,
+                 decrease: float = 0.5, cooldown: float = 1.0):
+        """Inizializza il limiter.
+
+        Args:
+            initial (float): Limite iniziale.
+            min_limit (float): Limite minimo (default: 1).
+            max_limit (float): Limite massimo (default: 100).
+            increase (float): Incremento additivo per finestra di ``limit`` successi (default: 1.0).
+            decrease (float): Fattore moltiplicativo applicato sul throttling (default: 0.5).
+            cooldown (float): Secondi minimi tra due riduzioni, per non reagire più volte allo stesso burst (default: 1.0).
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = min(max(initial, min_limit), max_limit)
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.throttled = 0
+        self._last_decrease = float("-inf")
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < max(1, int(self.limit)))
+            self.in_flight += 1
+
+    async def release(self, throttled: bool = False, succeeded: bool = True):
+        async with self._condition:
+            self.in_flight -= 1
+            if throttled:
+                self._on_throttle()
+            elif succeeded:
+                self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+            self._condition.notify_all()
+
+    def _on_throttle(self):
+        self.throttled += 1
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self._last_decrease = now
+            self.limit = max(self.min_limit, self.limit * self.decrease)
+            logger.warning(f"SMTP throttling detected: concurrency limit lowered to {self.limit:.1f}")
+
+    def stats(self) -> dict:
+        return {"limit": round(self.limit, 3), "in_flight": self.in_flight, "throttled": self.throttled}
+
+
+def _buckets(per_second: float, per_hour: float) -> list[TokenBucket]:
+    buckets = []
+    if per_second > 0:
+        buckets.append(TokenBucket(per_second, capacity=max(per_second, 1)))
+    if per_hour > 0:
+        # Burst limitato a un minuto di quota: con il bucket pieno all'avvio (o dopo un'ora di inattività) l'intera
+        # quota oraria partirebbe in pochi secondi, e ogni riavvio ne concederebbe un'altra
+        buckets.append(TokenBucket(per_hour / 3600, capacity=max(per_hour / 60, 1)))
+    return buckets
+
+
+class SendRateLimiter:
+    """Limita gli invii per server SMTP e per mittente, con concorrenza adattiva per server."""
+
+    def __init__(self, *, per_second: float = 0, per_hour: float = 0, sender_per_second: float = 0,
+                 sender_per_hour: float = 0, min_concurrency: int = 1, max_concurrency: int = 10):
+        """Inizializza il limiter. I limiti a 0 sono disabilitati.
+
+        Args:
+            per_second (float): Invii al secondo per server.
+            per_hour (float): Invii all'ora per server.
+            sender_per_second (float): Invii al secondo per mittente.
+            sender_per_hour (float): Invii all'ora per mittente.
+            min_concurrency (int): Concorrenza minima per server.
+            max_concurrency (int): Concorrenza massima (e iniziale) per server.
+        """
+        self.per_second = per_second
+        self.per_hour = per_hour
+        self.sender_per_second = sender_per_second
+        self.sender_per_hour = sender_per_hour
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self._server_buckets: dict[str, list[TokenBucket]] = {}
+        self._sender_buckets: dict[str, list[TokenBucket]] = {}
+        self._concurrency: dict[str, AdaptiveConcurrencyLimiter] = {}
+
+    @asynccontextmanager
+    async def limit(self, server: str, sender: str, cost: int = 1) -> AsyncIterator[None]:
+        """Context manager da usare attorno all'invio: attende concorrenza e token, poi registra l'esito.
+
+        Args:
+            server (str): Server SMTP (relay) usato per l'invio.
+            sender (str): Indirizzo del mittente.
+            cost (int): Token consumati, cioè numero di destinatari della transazione (default: 1).
+        """
+        concurrency = self._concurrency.get(server)
+        if concurrency is None:
+            concurrency = self._concurrency[server] = AdaptiveConcurrencyLimiter(
+                self.max_concurrency, self.min_concurrency, self.max_concurrency
+            )
+        buckets = self._buckets_for(self._server_buckets, server, self.per_second, self.per_hour)
+        buckets += self._buckets_for(self._sender_buckets, sender, self.sender_per_second, self.sender_per_hour)
+
+        await concurrency.acquire()
+        throttled = succeeded = False
+        try:
+            for bucket in buckets:
+                await bucket.acquire(cost)
+            yield
+            succeeded = True
+        except Exception as e:
+            throttled = is_throttling_error(e)
+            raise
+        finally:
+            await concurrency.release(throttled, succeeded)
+
+    @staticmethod
+    def _buckets_for(registry: dict, key: str, per_second: float, per_hour: float) -> list[TokenBucket]:
+        buckets = registry.get(key)
+        if buckets is None:
+            buckets = registry[key] = _buckets(per_second, per_hour)
+        return list(buckets)
+
+    def stats(self) -> dict:
+        return {
+            "servers": {
+                server: {
+                    "concurrency": limiter.stats(),
+                    "buckets": [bucket.stats() for bucket in self._server_buckets.get(server, [])],
+                }
+                for server, limiter in self._concurrency.items()
+            },
+            "senders": {
+                sender: [bucket.stats() for bucket in buckets]
+                for sender, buckets in self._sender_buckets.items()
+                if buckets
+            },
+        }
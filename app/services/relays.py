@@ -0,0 +1,225 @@
+from __future__ import annotations
+
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from email.message import EmailMessage, Message
+from typing import Awaitable, Callable, Union
+
+from fastapi_mail.errors import ConnectionErrors
+
+from app.core import metrics
+from app.core.logging import get_logger
+from app.services.rate_limit import SendRateLimiter, is_relay_unavailable
+from app.services.smtp_pool import SMTPConnectionPool
+
+logger = get_logger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class NoRelayAvailableError(ConnectionErrors):
+    """Tutti i relay SMTP hanno il circuit breaker aperto o hanno fallito l'invio."""
+
+
+class CircuitBreaker:
+    """Circuit breaker di un relay.
+
+    Si apre dopo ``failure_threshold`` errori consecutivi o quando la latenza media supera ``latency_threshold``;
+    dopo ``reset_timeout`` secondi passa a half-open e lascia passare un solo invio di prova, che lo richiude
+    se va a buon fine (e sotto soglia di latenza) o lo riapre altrimenti.
+    """
+
+    def __init__(self, failure_threshold: int = 5, latency_threshold: float = 0, reset_timeout: float = 30,
+                 latency_alpha: float = 0.2, min_samples: int = 5):
+        """Inizializza il circuit breaker.
+
+        Args:
+            failure_threshold (int): Errori consecutivi che aprono il circuito (default: 5).
+            latency_threshold (float): Latenza media in secondi che apre il circuito, 0 = disabilitata (default: 0).
+            reset_timeout (float): Secondi in stato open prima dell'invio di prova (default: 30).
+            latency_alpha (float): Peso dell'ultimo campione nella media mobile esponenziale (default: 0.2).
+            min_samples (int): Campioni minimi prima di valutare la soglia di latenza (default: 5).
+        """
+        self.failure_threshold = failure_threshold
+        self.latency_threshold = latency_threshold
+        self.reset_timeout = reset_timeout
+        self.latency_alpha = latency_alpha
+        self.min_samples = min_samples
+        self.state = CLOSED
+        self.failures = 0
+        self.latency = 0.0
+        self.samples = 0
+        self.opened_at = 0.0
+        self.trips = 0
+        self._probing = False
+
+    def allow(self) -> bool:
+        """Indica se un invio può passare (in half-open solo una prova alla volta)."""
+        if self.state == OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = HALF_OPEN
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self, latency: float):
+        self._probing = False
+        self.failures = 0
+        self.samples += 1
+        if self.state == HALF_OPEN:
+            # La prova riuscita riparte dalla sua latenza, non dalla media che aveva aperto il circuito
+            self.latency = latency
+            if self.latency_threshold and latency > self.latency_threshold:
+                self._open(f"probe latency {latency:.2f}s")
+            else:
+                self.state = CLOSED
+            return
+        self.latency = latency if self.samples == 1 else (
+            self.latency_alpha * latency + (1 - self.latency_alpha) * self.latency
+        )
+        if self.latency_threshold and self.samples >= self.min_samples and self.latency > self.latency_threshold:
+            self._open(f"average latency {self.latency:.2f}s")
+
+    def record_failure(self):
+        self._probing = False
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self._open(f"{self.failures} consecutive failures")
+
+    def release(self):
+        """Chiude un invio che non ha dato indicazioni sulla salute del relay (es. messaggio rifiutato)."""
+        self._probing = False
+
+    def _open(self, reason: str):
+        if self.state != OPEN:
+            self.trips += 1
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        logger.warning(f"SMTP relay circuit opened: {reason}")
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "latency": round(self.latency, 4), "trips": self.trips}
+
+
+@dataclass
+class Relay:
+    """Relay SMTP con il suo pool di sessioni, peso e circuit breaker."""
+    name: str
+    pool: SMTPConnectionPool
+    weight: float = 1.0
+    breaker: CircuitBreaker = field(default_factory=CircuitBreaker)
+    outstanding: int = 0
+    sent: int = 0
+    failed: int = 0
+
+    def score(self) -> float:
+        # Richieste in corso (compresa questa) pesate per latenza media e peso: vince il punteggio più basso
+        return (self.outstanding + 1) * max(self.breaker.latency, 0.001) / self.weight
+
+    def stats(self) -> dict:
+        return {
+            "weight": self.weight,
+            "outstanding": self.outstanding,
+            "sent": self.sent,
+            "failed": self.failed,
+            "breaker": self.breaker.stats(),
+            "pool": self.pool.stats(),
+        }
+
+
+class RelayRouter:
+    """Distribuisce gli invii tra più relay SMTP con failover.
+
+    Ogni invio va al relay con il punteggio più basso tra quelli con il circuito chiuso (richieste in corso per
+    latenza media, diviso il peso). Se il relay non è disponibile (connessione, timeout o throttling) l'invio
+    viene ritentato sul relay successivo; un rifiuto del messaggio invece non viene ritentato altrove.
+    Espone la stessa interfaccia di ``SMTPConnectionPool`` usata da ``PooledFastMail``.
+    """
+
+    def __init__(self, relays: list[Relay], rate_limiter: SendRateLimiter | None = None):
+        """Inizializza il router.
+
+        Args:
+            relays (list[Relay]): Relay disponibili (almeno uno).
+            rate_limiter (SendRateLimiter | None): Limiti di invio applicati per relay e mittente.
+        """
+        if not relays:
+            raise ValueError("at least one relay is required")
+        self.relays = relays
+        self.rate_limiter = rate_limiter
+        self.failovers = 0
+
+    def choose(self, exclude: set[str] = frozenset()) -> Relay | None:
+        """Restituisce il relay migliore tra quelli disponibili e non esclusi (None se nessuno)."""
+        candidates = sorted(
+            (relay for relay in self.relays if relay.name not in exclude),
+            key=Relay.score,
+        )
+        for relay in candidates:
+            if relay.breaker.allow():
+                return relay
+        return None
+
+    async def start(self):
+        for relay in self.relays:
+            await relay.pool.start()
+
+    async def close(self):
+        for relay in self.relays:
+            await relay.pool.close()
+
+    async def sendmail(self, sender: str, recipients: list[str], data: bytes):
+        """Invia un messaggio serializzato (vedi ``SMTPConnectionPool.sendmail``)."""
+        return await self._route(lambda pool: pool.sendmail(sender, recipients, data), sender, len(recipients))
+
+    async def send_message(self, message: Union[EmailMessage, Message]):
+        """Invia un messaggio MIME (vedi ``SMTPConnectionPool.send_message``)."""
+        return await self._route(lambda pool: pool.send_message(message), str(message.get("From", "")), 1)
+
+    async def _route(self, send: Callable[[SMTPConnectionPool], Awaitable], sender: str, cost: int):
+        tried: set[str] = set()
+        last_error: Exception | None = None
+        while (relay := self.choose(tried)) is not None:
+            if tried:
+                self.failovers += 1
+                logger.warning(f"Failing over to SMTP relay {relay.name}: {last_error}")
+            tried.add(relay.name)
+            limit = self.rate_limiter.limit(relay.name, sender, cost) if self.rate_limiter else nullcontext()
+            relay.outstanding += 1
+            recorded = False
+            try:
+                async with limit:
+                    # La latenza misura solo l'invio, non l'attesa dei limiti di invio
+                    start = time.monotonic()
+                    result = await send(relay.pool)
+                    latency = time.monotonic() - start
+            except Exception as e:
+                if not is_relay_unavailable(e):
+                    # Il relay ha risposto: il problema è il messaggio, non va ritentato altrove
+                    raise
+                relay.failed += 1
+                relay.breaker.record_failure()
+                recorded = True
+                metrics.record_failure("smtp", e)
+                last_error = e
+                continue
+            else:
+                relay.sent += 1
+                relay.breaker.record_success(latency)
+                recorded = True
+                return result
+            finally:
+                relay.outstanding -= 1
+                if not recorded:
+                    # Messaggio rifiutato o invio annullato: libera l'eventuale prova half-open
+                    relay.breaker.release()
+
+        raise NoRelayAvailableError(f"No SMTP relay available (last error: {last_error})") from last_error
+
+    def stats(self) -> dict:
+        return {"failovers": self.failovers, "relays": {relay.name: relay.stats() for relay in self.relays}}
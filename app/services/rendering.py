@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Mapping
+
+import orjson
+from jinja2 import Template, meta, nodes
+from markupsafe import Markup, escape
+
+from app.core.logging import get_logger
+
+logger = get_logger(__name__)
+
+_SLOT_MARKER = "\x1aslot{}\x1a"
+_SLOT_PATTERN = re.compile("\x1aslot(\\d+)\x1a")
+
+# Nodi che possono trasformare l'output di un segnaposto o ridefinirne il nome
+_UNSAFE_SCOPES = (nodes.FilterBlock, nodes.Macro, nodes.CallBlock, nodes.ScopedEvalContextModifier)
+
+
+def context_hash(context: Mapping[str, Any]) -> int:
+    """Hash stabile di un contesto di rendering (chiavi ordinate)."""
+    return hash(orjson.dumps(context, option=orjson.OPT_SORT_KEYS, default=str))
+
+
+class _SplitTemplate:
+    """Template renderizzato con il contesto condiviso e spezzato sugli slot per-destinatario."""
+    __slots__ = ("segments", "slots", "autoescape")
+
+    def __init__(self, segments: list[str], slots: list[str], autoescape: bool):
+        self.segments = segments  # len(segments) == len(slots) + 1
+        self.slots = slots
+        self.autoescape = autoescape
+
+    def fill(self, recipient_context: Mapping[str, Any]) -> str:
+        parts = [self.segments[0]]
+        for slot, segment in zip(self.slots, self.segments[1:]):
+            value = recipient_context[slot]
+            parts.append(str(escape(value)) if self.autoescape else str(value))
+            parts.append(segment)
+        return "".join(parts)
+
+
+class BulkTemplateRenderer:
+    """Renderizza un template una sola volta per contesto condiviso e sostituisce solo gli slot per-destinatario.
+
+    Un template è divisibile quando le variabili per-destinatario compaiono solo come ``{{ nome }}`` semplice
+    (niente filtri, condizioni, cicli sulla variabile o macro). Altrimenti si ricade sul rendering completo.
+    I risultati sono in una cache LRU con chiave (template, slot, hash del contesto condiviso), condivisa dai thread
+    del pool di rendering.
+    """
+
+    def __init__(self, max_entries: int = 128):
+        """Inizializza il renderer.
+
+        Args:
+            max_entries (int): Numero massimo di template pre-renderizzati in cache (default: 128).
+        """
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[tuple, _SplitTemplate] = OrderedDict()
+        self._splittable: Dict[tuple, bool] = {}
+        self._lock = threading.Lock()
+
+    def render(self, template: Template, shared_context: Mapping[str, Any], recipient_context: Mapping[str, Any]) -> str:
+        """Renderizza il template per un destinatario.
+
+        Args:
+            template (Template): Template Jinja2 da renderizzare.
+            shared_context (Mapping): Contesto comune a tutti i destinatari.
+            recipient_context (Mapping): Contesto del destinatario, che ha la precedenza su quello condiviso.
+        """
+        slots = tuple(sorted(recipient_context))
+        if not self._is_splittable(template, slots):
+            return template.render(**{**shared_context, **recipient_context})
+
+        key = (template.name, slots, context_hash(shared_context))
+        with self._lock:
+            split = self._cache.get(key)
+            if split is not None:
+                self.hits += 1
+                self._cache.move_to_end(key)
+        if split is None:
+            # Il rendering avviene fuori dal lock: due thread possono dividere lo stesso template in parallelo
+            split = self._split(template, shared_context, slots)
+            with self._lock:
+                self.misses += 1
+                self._cache[key] = split
+                if len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        return split.fill(recipient_context)
+
+    def clear(self):
+        self._cache.clear()
+        self._splittable.clear()
+
+    def _split(self, template: Template, shared_context: Mapping[str, Any], slots: tuple) -> _SplitTemplate:
+        markers = {slot: Markup(_SLOT_MARKER.format(i)) for i, slot in enumerate(slots)}
+        rendered = template.render(**{**shared_context, **markers})
+        pieces = _SLOT_PATTERN.split(rendered)
+        # re.split con un gruppo alterna testo statico e indice dello slot
+        segments = pieces[0::2]
+        slot_order = [slots[int(index)] for index in pieces[1::2]]
+        return _SplitTemplate(segments, slot_order, self._autoescape(template))
+
+    def _is_splittable(self, template: Template, slots: tuple) -> bool:
+        key = (template.name, slots)
+        cached = self._splittable.get(key)
+        if cached is None:
+            try:
+                cached = self._check_splittable(template.environment, template.name, set(slots), set())
+            except Exception as e:
+                # Sorgente non disponibile o non analizzabile: rendering completo per ogni destinatario
+                logger.debug(f"Template {template.name} cannot be split: {e}")
+                cached = False
+            self._splittable[key] = cached
+        return cached
+
+    def _check_splittable(self, environment, name: str, slots: set, seen: set) -> bool:
+        if name in seen:
+            return True
+        seen.add(name)
+        source, _, _ = environment.loader.get_source(environment, name)
+        ast = environment.parse(source)
+
+        unsafe = set()
+        for scope in ast.find_all(_UNSAFE_SCOPES):
+            unsafe.update(id(node) for node in scope.find_all(nodes.Name))
+        allowed = {
+            id(child)
+            for output in ast.find_all(nodes.Output)
+            for child in output.nodes
+            if isinstance(child, nodes.Name)
+        }
+        for node in ast.find_all(nodes.Name):
+            if node.name in slots and (node.ctx != "load" or id(node) not in allowed or id(node) in unsafe):
+                return False
+
+        for referenced in meta.find_referenced_templates(ast):
+            if referenced is None or not self._check_splittable(environment, referenced, slots, seen):
+                return False
+        return True
+
+    @staticmethod
+    def _autoescape(template: Template) -> bool:
+        autoescape = template.environment.autoescape
+        return bool(autoescape(template.name) if callable(autoescape) else autoescape)
@@ -0,0 +1,290 @@
+"""Consegna differita delle email con ``send_at``.
+
+Le email programmate sono salvate in una tabella indicizzata per orario di invio, che può contenerne milioni;
+in memoria resta solo un heap con quelle in scadenza entro ``horizon`` secondi (al massimo ``max_in_memory``).
+Le email scadute vengono rilasciate in ordine di orario a ``release_rate`` al secondo, così un picco di invii
+programmati alla stessa ora viene distribuito nel tempo invece di arrivare tutto insieme al relay.
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import time
+from typing import Awaitable, Callable
+
+from sqlalchemy import Column, Float, Integer, LargeBinary, MetaData, String, Table, create_engine, delete, event, \
+    func, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.core.logging import get_logger
+from app.services.rate_limit import TokenBucket, is_relay_unavailable
+from app.services.spool import _enable_sqlite_wal
+
+logger = get_logger(__name__)
+
+_metadata = MetaData()
+
+scheduled_emails = Table(
+    "scheduled_emails",
+    _metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("payload", LargeBinary, nullable=False),  # EmailRequest in JSON, senza send_at
+    Column("idempotency_key", String(255), nullable=True, unique=True),
+    Column("send_at", Float, nullable=False),
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("available_at", Float, nullable=False, index=True),  # send_at, poi scadenza del lease o del retry
+)
+
+# Email che hanno esaurito i tentativi: restano qui per l'analisi o per essere riprogrammate a mano
+failed_scheduled_emails = Table(
+    "failed_scheduled_emails",
+    _metadata,
+    Column("id", Integer, primary_key=True),
+    Column("payload", LargeBinary, nullable=False),
+    Column("idempotency_key", String(255), nullable=True),
+    Column("send_at", Float, nullable=False),
+    Column("attempts", Integer, nullable=False),
+    Column("failed_at", Float, nullable=False),
+    Column("error", String, nullable=False),
+)
+
+
+class SQLScheduleBackend:
+    """Tabella delle email programmate, ad esempio ``sqlite:///./schedule.db``.
+
+    Le righe vengono cancellate solo dopo l'invio: dopo un crash le email prese in carico e non ancora inviate
+    tornano disponibili allo scadere del lease. I metodi sono sincroni: ``DeliveryScheduler`` li esegue in un thread.
+    """
+
+    def __init__(self, url: str):
+        self.engine = create_engine(url)
+        if self.engine.dialect.name == "sqlite":
+            event.listen(self.engine, "connect", _enable_sqlite_wal)
+        _metadata.create_all(self.engine)
+
+    def add(self, payload: bytes, send_at: float, idempotency_key: str | None = None) -> bool:
+        """Salva un'email programmata.
+
+        Returns:
+            bool: False se un'email con la stessa chiave di idempotenza è già programmata.
+        """
+        try:
+            with self.engine.begin() as conn:
+                conn.execute(scheduled_emails.insert().values(
+                    payload=payload, idempotency_key=idempotency_key, send_at=send_at, attempts=0, available_at=send_at,
+                ))
+        except IntegrityError:
+            # Vincolo UNIQUE sulla chiave: vale anche per inserimenti concorrenti da più processi
+            return False
+        return True
+
+    def fetch_due(self, until: float, limit: int, lease: float) -> list[tuple[int, float, int, bytes, str | None]]:
+        """Prende in carico fino a ``limit`` email da inviare entro ``until``, in ordine di orario.
+
+        Le righe restituite restano invisibili agli altri processi per ``lease`` secondi: se il processo termina
+        prima di cancellarle o rinviarle tornano disponibili allo scadere del lease.
+        """
+        with self.engine.begin() as conn:
+            rows = conn.execute(
+                select(scheduled_emails)
+                .where(scheduled_emails.c.available_at <= until)
+                .order_by(scheduled_emails.c.available_at)
+                .limit(limit)
+            ).all()
+            if rows:
+                conn.execute(
+                    update(scheduled_emails)
+                    .where(scheduled_emails.c.id.in_([row.id for row in rows]))
+                    .values(available_at=time.time() + lease)
+                )
+        return [
+            (row.id, max(row.send_at, row.available_at), row.attempts, row.payload, row.idempotency_key)
+            for row in rows
+        ]
+
+    def delete(self, ids: list[int]) -> None:
+        if ids:
+            with self.engine.begin() as conn:
+                conn.execute(delete(scheduled_emails).where(scheduled_emails.c.id.in_(ids)))
+
+    def defer(self, row_id: int, available_at: float, count_attempt: bool = True) -> None:
+        values = {"available_at": available_at}
+        if count_attempt:
+            values["attempts"] = scheduled_emails.c.attempts + 1
+        with self.engine.begin() as conn:
+            conn.execute(update(scheduled_emails).where(scheduled_emails.c.id == row_id).values(**values))
+
+    def fail(self, row_id: int, error: str) -> None:
+        """Sposta un'email che ha esaurito i tentativi in ``failed_scheduled_emails``."""
+        with self.engine.begin() as conn:
+            row = conn.execute(select(scheduled_emails).where(scheduled_emails.c.id == row_id)).first()
+            if row is None:
+                return
+            conn.execute(failed_scheduled_emails.insert().values(
+                id=row.id, payload=row.payload, idempotency_key=row.idempotency_key, send_at=row.send_at,
+                attempts=row.attempts + 1, failed_at=time.time(), error=error,
+            ))
+            conn.execute(delete(scheduled_emails).where(scheduled_emails.c.id == row_id))
+
+    def stats(self) -> tuple[int, float | None, int]:
+        """Restituisce numero di email programmate, orario della prossima e numero di email fallite."""
+        with self.engine.connect() as conn:
+            row = conn.execute(select(func.count(), func.min(scheduled_emails.c.send_at))).one()
+            failed = conn.execute(select(func.count()).select_from(failed_scheduled_emails)).scalar_one()
+        return row[0], row[1], failed
+
+    def close(self) -> None:
+        self.engine.dispose()
+
+
+class DeliveryScheduler:
+    """Rilascia le email programmate all'orario previsto, a velocità limitata (vedi modulo)."""
+
+    def __init__(self, backend: SQLScheduleBackend, deliver: Callable[[bytes, str | None], Awaitable[None]], *,
+                 release_rate: float = 50, horizon: float = 60, max_in_memory: int = 10000, poll_interval: float = 1,
+                 max_attempts: int = 5, base_delay: float = 5, max_delay: float = 300):
+        """Inizializza lo scheduler.
+
+        Args:
+            backend (SQLScheduleBackend): Storage persistente delle email programmate.
+            deliver (callable): Coroutine che invia un'email dato il payload JSON e la chiave di idempotenza.
+            release_rate (float): Email rilasciate al secondo, 0 = nessun limite (default: 50).
+            horizon (float): Secondi di anticipo con cui le email vengono caricate in memoria (default: 60).
+            max_in_memory (int): Email caricate in memoria al massimo (default: 10000).
+            poll_interval (float): Secondi tra due letture dello storage (default: 1).
+            max_attempts (int): Tentativi dopo i quali un'email rifiutata viene spostata tra le fallite (default: 5).
+                Gli invii falliti perché il relay non è disponibile non contano.
+            base_delay (float): Attesa prima del primo nuovo tentativo, raddoppiata a ogni rifiuto (default: 5).
+            max_delay (float): Attesa massima tra due tentativi della stessa email (default: 300).
+        """
+        self.backend = backend
+        self.deliver = deliver
+        self.horizon = horizon
+        self.max_in_memory = max_in_memory
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.bucket = TokenBucket(release_rate, max(release_rate, 1)) if release_rate > 0 else None
+        # Le email restano riservate per il tempo in cui possono stare in memoria: orizzonte più smaltimento
+        # di un heap pieno alla velocità di rilascio
+        self.lease = horizon + (max_in_memory / release_rate if release_rate > 0 else 0) + 60
+        self.heap: list[tuple[float, int, int, bytes, str | None]] = []
+        self.scheduled = 0
+        self.released = 0
+        self.failed = 0
+        self.parked = 0
+        self._wakeup = asyncio.Event()
+        self._tasks: set[asyncio.Task] = set()
+        self._loops: list[asyncio.Task] = []
+
+    async def add(self, payload: bytes, send_at: float, idempotency_key: str | None = None) -> bool:
+        """Programma un'email (ritorna dopo che è stata salvata). False se la chiave è già programmata."""
+        added = await asyncio.to_thread(self.backend.add, payload, send_at, idempotency_key)
+        if added:
+            self.scheduled += 1
+        return added
+
+    async def start(self):
+        depth, _, _ = await asyncio.to_thread(self.backend.stats)
+        if depth:
+            logger.info(f"{depth} scheduled emails pending")
+        if not self._loops:
+            self._loops = [asyncio.create_task(self._load_loop()), asyncio.create_task(self._release_loop())]
+
+    async def close(self):
+        """Ferma i loop e attende gli invii in corso; le email non rilasciate tornano disponibili allo scadere del lease."""
+        for task in self._loops:
+            task.cancel()
+        await asyncio.gather(*self._loops, return_exceptions=True)
+        self._loops = []
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await asyncio.to_thread(self.backend.close)
+
+    async def load(self) -> int:
+        """Carica nell'heap le email in scadenza entro l'orizzonte, nei limiti di ``max_in_memory``.
+
+        Returns:
+            int: Numero di email caricate.
+        """
+        room = self.max_in_memory - len(self.heap)
+        if room <= 0:
+            return 0
+        rows = await asyncio.to_thread(self.backend.fetch_due, time.time() + self.horizon, room, self.lease)
+        for row_id, send_at, attempts, payload, key in rows:
+            heapq.heappush(self.heap, (send_at, row_id, attempts, payload, key))
+        if rows:
+            self._wakeup.set()
+        return len(rows)
+
+    async def _load_loop(self):
+        while True:
+            try:
+                await self.load()
+            except Exception as e:
+                logger.error(f"Loading scheduled emails failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def _release_loop(self):
+        while True:
+            if not self.heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self.heap[0][0] - time.time()
+            if delay > 0:
+                # Attesa interrotta se il caricamento aggiunge un'email più vicina
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            if self.bucket is not None:
+                await self.bucket.acquire()
+            entry = heapq.heappop(self.heap)
+            task = asyncio.create_task(self._release(entry))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _release(self, entry: tuple[float, int, int, bytes, str | None]):
+        _, row_id, attempts, payload, key = entry
+        try:
+            await self.deliver(payload, key)
+        except Exception as e:
+            await self._failed(row_id, attempts, e)
+            return
+        await asyncio.to_thread(self.backend.delete, [row_id])
+        self.released += 1
+
+    async def _failed(self, row_id: int, attempts: int, error: Exception):
+        self.failed += 1
+        if is_relay_unavailable(error):
+            # Il relay non ha ricevuto l'email: si riprova senza consumare tentativi, per quanto duri il disservizio
+            delay = min(self.base_delay * 2 ** attempts, self.max_delay)
+            logger.warning(f"Scheduled email {row_id} not sent, relay unavailable: {error}. Retrying in {delay:.0f}s")
+            await asyncio.to_thread(self.backend.defer, row_id, time.time() + delay, False)
+            return
+        if attempts + 1 >= self.max_attempts:
+            logger.error(f"Scheduled email {row_id} failed after {attempts + 1} attempts: {error}. "
+                         f"Moved to failed_scheduled_emails")
+            await asyncio.to_thread(self.backend.fail, row_id, str(error))
+            self.parked += 1
+            return
+        delay = min(self.base_delay * 2 ** attempts, self.max_delay)
+        logger.warning(f"Scheduled email {row_id} failed (attempt {attempts + 1}): {error}. Retrying in {delay:.0f}s")
+        await asyncio.to_thread(self.backend.defer, row_id, time.time() + delay)
+
+    async def stats(self) -> dict:
+        depth, next_send_at, failed_depth = await asyncio.to_thread(self.backend.stats)
+        return {
+            "depth": depth,
+            "failed_depth": failed_depth,
+            "next_in": round(next_send_at - time.time(), 3) if next_send_at is not None else None,
+            "in_memory": len(self.heap),
+            "scheduled": self.scheduled,
+            "released": self.released,
+            "failed": self.failed,
+            "parked": self.parked,
+        }
@@ -0,0 +1,324 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field, asdict
+from email.message import EmailMessage, Message
+from email.utils import formataddr
+from typing import AsyncIterator, Union
+
+import aiosmtplib
+from fastapi_mail import ConnectionConfig, FastMail, MessageSchema
+from fastapi_mail.errors import ConnectionErrors
+from fastapi_mail.fastmail import email_dispatched
+from fastapi_mail.msg import MailMsg
+
+from app.core import metrics
+from app.core.logging import get_logger
+from app.services.message import PreparedEmail
+
+logger = get_logger(__name__)
+
+# Risposte negative del server: la transazione è conclusa (aiosmtplib invia RSET) e la sessione resta riutilizzabile.
+# Con qualsiasi altra eccezione (connessione, timeout, cancellazione) la sessione può essere a metà di un comando
+# e va scartata
+_SESSION_IN_SYNC_ERRORS = (
+    aiosmtplib.SMTPResponseException,
+    aiosmtplib.SMTPRecipientsRefused,
+)
+
+
+@dataclass
+class PoolMetrics:
+    """Contatori cumulativi del pool SMTP."""
+    hits: int = 0  # sessioni calde riutilizzate
+    misses: int = 0  # acquisizioni che hanno richiesto una nuova connessione
+    opens: int = 0  # connessioni aperte con successo
+    closes: int = 0  # connessioni chiuse (idle, scartate o allo shutdown)
+    failures: int = 0  # aperture fallite o sessioni rotte durante l'uso
+    health_check_failures: int = 0  # sessioni scartate perché il RSET prima del riuso è fallito
+    messages_sent: int = 0  # transazioni SMTP completate
+    recipients_sent: int = 0  # destinatari accettati (una transazione può averne più di uno)
+
+
+@dataclass
+class _PooledConnection:
+    smtp: aiosmtplib.SMTP
+    created_at: float = field(default_factory=time.monotonic)
+    last_used: float = field(default_factory=time.monotonic)
+
+
+class SMTPConnectionPool:
+    """Pool di sessioni SMTP persistenti (TCP + STARTTLS + AUTH già negoziati).
+
+    Le sessioni inattive vengono riutilizzate in ordine LIFO, verificate con RSET prima del riuso
+    e chiuse dopo ``idle_timeout`` secondi di inattività, mantenendone almeno ``min_size`` calde.
+    """
+
+    def __init__(self, config: ConnectionConfig, *, name: str | None = None, min_size: int = 1, max_size: int = 10,
+                 idle_timeout: float = 60):
+        """Inizializza il pool.
+
+        Args:
+            config (ConnectionConfig): Configurazione SMTP di fastapi-mail.
+            name (str | None): Nome del relay nelle metriche (default: ``server:porta`` della configurazione).
+            min_size (int): Numero minimo di sessioni mantenute calde (default: 1).
+            max_size (int): Numero massimo di sessioni aperte contemporaneamente (default: 10).
+            idle_timeout (float): Secondi dopo i quali una sessione inattiva viene chiusa (default: 60).
+        """
+        if max_size < 1:
+            raise ValueError("max_size must be >= 1")
+        self.config = config
+        self.name = name or f"{config.MAIL_SERVER}:{config.MAIL_PORT}"
+        self.min_size = min(max(min_size, 0), max_size)
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.metrics = PoolMetrics()
+        self._idle: deque[_PooledConnection] = deque()
+        self._in_use = 0
+        self._semaphore = asyncio.Semaphore(max_size)
+        self._reaper: asyncio.Task | None = None
+        self._closed = False
+
+    @property
+    def size(self) -> int:
+        """Numero di sessioni attualmente aperte (inattive + in uso)."""
+        return len(self._idle) + self._in_use
+
+    def stats(self) -> dict:
+        """Restituisce metriche e stato corrente del pool."""
+        return {
+            **asdict(self.metrics),
+            "idle": len(self._idle),
+            "in_use": self._in_use,
+            "size": self.size,
+            "max_size": self.max_size,
+        }
+
+    async def start(self):
+        """Apre le ``min_size`` sessioni iniziali e avvia il task che chiude le sessioni inattive."""
+        self._closed = False
+        for _ in range(self.min_size - self.size):
+            try:
+                self._idle.append(await self._open())
+            except ConnectionErrors as e:
+                logger.warning(f"SMTP pool warm-up failed: {e}")
+                break
+        if self._reaper is None or self._reaper.done():
+            self._reaper = asyncio.create_task(self._reap_idle_loop())
+        logger.info(f"SMTP pool started ({len(self._idle)} warm connections, max {self.max_size})")
+
+    async def close(self):
+        """Ferma il reaper e chiude tutte le sessioni inattive."""
+        self._closed = True
+        if self._reaper is not None:
+            self._reaper.cancel()
+            try:
+                await self._reaper
+            except asyncio.CancelledError:
+                pass
+            self._reaper = None
+        while self._idle:
+            await self._discard(self._idle.pop())
+        logger.info(f"SMTP pool closed. Stats: {self.stats()}")
+
+    async def acquire(self) -> _PooledConnection:
+        """Ottiene una sessione dal pool, aprendone una nuova se non ce ne sono di riutilizzabili.
+
+        Returns:
+            _PooledConnection: Sessione pronta all'uso, da restituire con ``release``.
+        """
+        await self._semaphore.acquire()
+        try:
+            conn = await self._pop_healthy()
+            if conn is not None:
+                self.metrics.hits += 1
+            else:
+                self.metrics.misses += 1
+                conn = await self._open()
+        except BaseException:
+            self._semaphore.release()
+            raise
+        self._in_use += 1
+        return conn
+
+    async def release(self, conn: _PooledConnection, *, discard: bool = False):
+        """Restituisce una sessione al pool.
+
+        Args:
+            conn (_PooledConnection): Sessione ottenuta con ``acquire``.
+            discard (bool): Se True la sessione viene chiusa invece di essere riutilizzata.
+        """
+        self._in_use -= 1
+        try:
+            if discard or self._closed or not conn.smtp.is_connected:
+                await self._discard(conn)
+            else:
+                conn.last_used = time.monotonic()
+                self._idle.append(conn)
+        finally:
+            self._semaphore.release()
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[aiosmtplib.SMTP]:
+        """Context manager che presta una sessione SMTP e la restituisce al pool all'uscita."""
+        conn = await self.acquire()
+        discard = False
+        try:
+            yield conn.smtp
+        except _SESSION_IN_SYNC_ERRORS:
+            raise
+        except BaseException as e:
+            if not isinstance(e, asyncio.CancelledError):
+                self.metrics.failures += 1
+            # Niente QUIT: su una sessione a metà DATA verrebbe letto come contenuto del messaggio
+            conn.smtp.close()
+            discard = True
+            raise
+        finally:
+            await self.release(conn, discard=discard)
+
+    async def send_message(self, message: Union[EmailMessage, Message]):
+        """Invia un messaggio MIME già costruito usando una sessione del pool.
+
+        Args:
+            message (EmailMessage | Message): Messaggio da inviare.
+        """
+        async with self.connection() as smtp:
+            with metrics.timed(metrics.SMTP_SEND_DURATION, self.name):
+                result = await smtp.send_message(message)
+        self.metrics.messages_sent += 1
+        self.metrics.recipients_sent += 1
+        return result
+
+    async def sendmail(self, sender: str, recipients: list[str], data: bytes):
+        """Invia un messaggio già serializzato usando una sessione del pool.
+
+        Args:
+            sender (str): Indirizzo MAIL FROM.
+            recipients (list[str]): Indirizzi RCPT TO.
+            data (bytes): Messaggio MIME serializzato.
+
+        Returns:
+            tuple: Destinatari rifiutati (``{indirizzo: SMTPResponse}``) e risposta al DATA, come aiosmtplib.
+        """
+        async with self.connection() as smtp:
+            with metrics.timed(metrics.SMTP_SEND_DURATION, self.name):
+                result = await smtp.sendmail(sender, recipients, data)
+        self.metrics.messages_sent += 1
+        self.metrics.recipients_sent += len(recipients) - len(result[0])
+        return result
+
+    async def _pop_healthy(self) -> _PooledConnection | None:
+        now = time.monotonic()
+        while self._idle:
+            conn = self._idle.pop()
+            if now - conn.last_used > self.idle_timeout or not conn.smtp.is_connected:
+                await self._discard(conn)
+                continue
+            try:
+                # RSET azzera lo stato della transazione e verifica che la sessione sia ancora viva
+                await conn.smtp.rset()
+            except aiosmtplib.SMTPException:
+                self.metrics.health_check_failures += 1
+                await self._discard(conn)
+                continue
+            return conn
+        return None
+
+    async def _open(self) -> _PooledConnection:
+        smtp = aiosmtplib.SMTP(
+            hostname=self.config.MAIL_SERVER,
+            timeout=self.config.TIMEOUT,
+            port=self.config.MAIL_PORT,
+            use_tls=self.config.MAIL_SSL_TLS,
+            start_tls=self.config.MAIL_STARTTLS,
+            validate_certs=self.config.VALIDATE_CERTS,
+            local_hostname=self.config.LOCAL_HOSTNAME,
+            cert_bundle=self.config.CERT_BUNDLE,
+        )
+        try:
+            with metrics.timed(metrics.SMTP_CONNECT_DURATION, self.name):
+                await smtp.connect()
+                if self.config.USE_CREDENTIALS:
+                    await smtp.login(self.config.MAIL_USERNAME, self.config.MAIL_PASSWORD.get_secret_value())
+        except Exception as e:
+            self.metrics.failures += 1
+            smtp.close()
+            raise ConnectionErrors(
+                f"Exception raised {e}, check your credentials or email service configuration"
+            ) from e
+        self.metrics.opens += 1
+        return _PooledConnection(smtp=smtp)
+
+    async def _discard(self, conn: _PooledConnection):
+        self.metrics.closes += 1
+        try:
+            if conn.smtp.is_connected:
+                await conn.smtp.quit()
+        except Exception:
+            conn.smtp.close()
+
+    async def _reap_idle_loop(self):
+        interval = max(self.idle_timeout / 2, 1)
+        while True:
+            await asyncio.sleep(interval)
+            await self.reap_idle()
+
+    async def reap_idle(self):
+        """Chiude le sessioni inattive da più di ``idle_timeout`` secondi, mantenendone ``min_size``."""
+        now = time.monotonic()
+        # Le sessioni più vecchie sono in testa alla deque (riuso LIFO dalla coda)
+        while self._idle and self.size > self.min_size and now - self._idle[0].last_used > self.idle_timeout:
+            await self._discard(self._idle.popleft())
+
+
+class PooledFastMail(FastMail):
+    """FastMail che invia tramite un ``SMTPConnectionPool`` invece di aprire una sessione SMTP per ogni chiamata.
+
+    ``pool`` può essere anche un ``RelayRouter``, che espone la stessa interfaccia su più relay.
+    """
+
+    def __init__(self, config: ConnectionConfig, pool: SMTPConnectionPool) -> None:
+        super().__init__(config)
+        self.pool = pool
+
+    @property
+    def sender(self) -> str:
+        """Header From di default, calcolato come fa FastMail."""
+        if self.config.MAIL_FROM_NAME is not None:
+            return formataddr((self.config.MAIL_FROM_NAME, self.config.MAIL_FROM))
+        return self.config.MAIL_FROM
+
+    async def send_message(self, message: Union[MessageSchema, list[MessageSchema], PreparedEmail], template_name=None,
+                           html_template=None, plain_template=None):
+        if isinstance(message, PreparedEmail):
+            # Messaggio già costruito e serializzato fuori dall'event loop
+            result = None
+            if not self.config.SUPPRESS_SEND:
+                result = await self.pool.sendmail(message.sender, message.recipients, message.data)
+            email_dispatched.send(message)
+            return result
+
+        if template_name or html_template or plain_template:
+            # I template di fastapi-mail non sono usati da questo servizio: fallback al comportamento originale
+            return await super().send_message(message, template_name, html_template, plain_template)
+
+        messages = message if isinstance(message, list) else [message]
+        prepared = [await self.build_message(msg) for msg in messages]
+
+        if not self.config.SUPPRESS_SEND:
+            for mime in prepared:
+                await self.pool.send_message(mime)
+
+        for mime in prepared:
+            email_dispatched.send(mime)
+
+    async def build_message(self, message: MessageSchema) -> Union[EmailMessage, Message]:
+        """Costruisce il messaggio MIME a partire da un ``MessageSchema``."""
+        sender = message.from_email or self.config.MAIL_FROM
+        if (from_name := message.from_name or self.config.MAIL_FROM_NAME) is not None:
+            sender = formataddr((from_name, sender))
+        return await MailMsg(message)._message(sender)
@@ -0,0 +1,263 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Awaitable, Callable
+
+import orjson
+from sqlalchemy import Column, Float, Integer, LargeBinary, MetaData, String, Table, create_engine, delete, event, \
+    func, select, update
+
+from app.core.logging import get_logger
+from app.services.message import PreparedEmail
+from app.services.rate_limit import is_permanent_rejection, is_relay_unavailable
+
+logger = get_logger(__name__)
+
+_metadata = MetaData()
+
+spooled_messages = Table(
+    "spooled_messages",
+    _metadata,
+    Column("id", Integer, primary_key=True, autoincrement=True),
+    Column("sender", String(320), nullable=False),
+    Column("recipients", LargeBinary, nullable=False),  # lista JSON
+    Column("data", LargeBinary, nullable=False),
+    Column("created_at", Float, nullable=False),
+    Column("attempts", Integer, nullable=False, default=0),
+    Column("next_attempt_at", Float, nullable=False, index=True),
+)
+
+
+class SQLSpoolBackend:
+    """Spool append-only dei messaggi pronti per l'invio, ad esempio ``sqlite:///./spool.db``.
+
+    Ogni append è una transazione confermata su disco prima dell'ack del messaggio AMQP; le righe vengono
+    cancellate solo dopo l'invio, quindi dopo un crash i messaggi non inviati sono ancora nello spool.
+    I metodi sono sincroni: ``OutboundSpool`` li esegue in un thread.
+    """
+
+    def __init__(self, url: str):
+        self.engine = create_engine(url)
+        if self.engine.dialect.name == "sqlite":
+            event.listen(self.engine, "connect", _enable_sqlite_wal)
+        _metadata.create_all(self.engine)
+
+    def append(self, message: PreparedEmail, now: float) -> int:
+        with self.engine.begin() as conn:
+            return conn.execute(spooled_messages.insert().values(
+                sender=message.sender,
+                recipients=orjson.dumps(message.recipients),
+                data=message.data,
+                created_at=now,
+                attempts=0,
+                next_attempt_at=now,
+            )).inserted_primary_key[0]
+
+    def fetch_due(self, now: float, limit: int, lease: float = 60) -> list[tuple[int, int, PreparedEmail]]:
+        """Prende in carico fino a ``limit`` messaggi pronti per un nuovo tentativo, dal più vecchio.
+
+        I messaggi restituiti non sono visibili ad altri processi per ``lease`` secondi: se il processo termina
+        prima di cancellarli o rinviarli tornano disponibili allo scadere del lease.
+        """
+        with self.engine.begin() as conn:
+            rows = conn.execute(
+                select(spooled_messages)
+                .where(spooled_messages.c.next_attempt_at <= now)
+                .order_by(spooled_messages.c.id)
+                .limit(limit)
+            ).all()
+            if rows:
+                conn.execute(
+                    update(spooled_messages)
+                    .where(spooled_messages.c.id.in_([row.id for row in rows]))
+                    .values(next_attempt_at=now + lease)
+                )
+        return [
+            (row.id, row.attempts, PreparedEmail(row.sender, orjson.loads(row.recipients), row.data))
+            for row in rows
+        ]
+
+    def delete(self, ids: list[int]) -> None:
+        if ids:
+            with self.engine.begin() as conn:
+                conn.execute(delete(spooled_messages).where(spooled_messages.c.id.in_(ids)))
+
+    def defer(self, ids: list[int], next_attempt_at: float, count_attempt: bool = True) -> None:
+        if ids:
+            values = {"next_attempt_at": next_attempt_at}
+            if count_attempt:
+                values["attempts"] = spooled_messages.c.attempts + 1
+            with self.engine.begin() as conn:
+                conn.execute(update(spooled_messages).where(spooled_messages.c.id.in_(ids)).values(**values))
+
+    def stats(self) -> tuple[int, float | None]:
+        """Restituisce numero di messaggi e timestamp del più vecchio."""
+        with self.engine.connect() as conn:
+            row = conn.execute(select(func.count(), func.min(spooled_messages.c.created_at))).one()
+        return row[0], row[1]
+
+    def close(self) -> None:
+        self.engine.dispose()
+
+
+def _enable_sqlite_wal(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    # FULL: un messaggio confermato (e quindi già tolto da RabbitMQ) sopravvive anche a un crash della macchina
+    cursor.execute("PRAGMA synchronous=FULL")
+    cursor.close()
+
+
+class OutboundSpool:
+    """Spool locale dei messaggi da inviare quando il relay SMTP non è disponibile.
+
+    ``send_email`` accoda qui i messaggi già renderizzati invece di rimandarli su RabbitMQ; un task in background
+    li invia a blocchi tramite le sessioni del pool quando il relay torna disponibile. Finché il relay risulta
+    giù i nuovi messaggi vengono accodati direttamente, senza attendere il timeout di connessione.
+    """
+
+    def __init__(self, backend: SQLSpoolBackend, send: Callable[[PreparedEmail], Awaitable[dict]], *,
+                 flush_interval: float = 5, batch_size: int = 100, max_attempts: int = 20, max_delay: float = 300,
+                 lease: float = 60):
+        """Inizializza lo spool.
+
+        Args:
+            backend (SQLSpoolBackend): Storage persistente dei messaggi.
+            send (callable): Coroutine che invia un ``PreparedEmail`` e restituisce i destinatari rifiutati dal relay.
+            flush_interval (float): Secondi tra due tentativi di svuotamento (default: 5).
+            batch_size (int): Messaggi letti e inviati per blocco (default: 100).
+            max_attempts (int): Tentativi dopo i quali un messaggio rifiutato dal relay viene scartato (default: 20).
+            max_delay (float): Attesa massima tra due tentativi dello stesso messaggio (default: 300).
+            lease (float): Secondi per cui un blocco in invio resta riservato a questo processo (default: 60).
+        """
+        self.backend = backend
+        self.send = send
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.max_delay = max_delay
+        self.lease = lease
+        self.relay_down = False
+        self.spooled = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.refused = 0
+        self._flusher: asyncio.Task | None = None
+
+    async def append(self, message: PreparedEmail):
+        """Salva il messaggio nello spool (ritorna solo dopo che è stato scritto su disco)."""
+        await asyncio.to_thread(self.backend.append, message, time.time())
+        self.spooled += 1
+
+    def mark_unavailable(self):
+        """Segnala che il relay non risponde: i messaggi successivi vengono accodati direttamente."""
+        if not self.relay_down:
+            logger.warning("SMTP relay unavailable: spooling outbound mail locally")
+        self.relay_down = True
+
+    async def start(self):
+        """Avvia il flusher; i messaggi rimasti da un'esecuzione precedente vengono inviati al primo giro."""
+        depth, _ = await asyncio.to_thread(self.backend.stats)
+        if depth:
+            logger.info(f"Recovered {depth} spooled messages from a previous run")
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Ferma il flusher e chiude lo storage (i messaggi non inviati restano su disco)."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await asyncio.to_thread(self.backend.close)
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                while await self.flush() == self.batch_size:
+                    pass
+            except Exception as e:
+                logger.error(f"Spool flush failed: {e}")
+            await asyncio.sleep(self.flush_interval)
+
+    async def flush(self) -> int:
+        """Invia un blocco di messaggi scaduti.
+
+        Returns:
+            int: Numero di messaggi inviati (e rimossi dallo spool).
+        """
+        now = time.time()
+        batch = await asyncio.to_thread(self.backend.fetch_due, now, self.batch_size, self.lease)
+        if not batch:
+            # Nessun invio riuscito: lo stato del relay resta quello noto
+            return 0
+
+        # Il primo messaggio fa da sonda: se il relay è ancora giù il blocco non viene nemmeno tentato
+        probe = await self._try_send(batch[0][2])
+        if is_relay_unavailable(probe):
+            results = [probe] * len(batch)
+        else:
+            results = [probe, *await asyncio.gather(*(self._try_send(message) for _, _, message in batch[1:]))]
+
+        sent, unavailable, rejected, dropped = self._classify(batch, results)
+
+        await asyncio.to_thread(self.backend.delete, sent + dropped)
+        if unavailable:
+            # Il relay non ha ricevuto i messaggi: nessun tentativo consumato, si riprova al prossimo giro
+            await asyncio.to_thread(self.backend.defer, unavailable, now + self.flush_interval, False)
+        for row_id, attempts in rejected:
+            delay = min(self.flush_interval * 2 ** attempts, self.max_delay)
+            await asyncio.to_thread(self.backend.defer, [row_id], now + delay)
+
+        self.flushed += len(sent)
+        self.dropped += len(dropped)
+        if unavailable and not sent:
+            self.mark_unavailable()
+        elif sent:
+            if self.relay_down:
+                logger.info("SMTP relay available again: flushing spooled mail")
+            self.relay_down = False
+        return len(sent)
+
+    def _classify(self, batch: list, results: list) -> tuple[list, list, list, list]:
+        """Divide il blocco in inviati, non tentati (relay giù), rifiutati da ritentare e da scartare."""
+        sent, unavailable, rejected, dropped = [], [], [], []
+        for (row_id, attempts, _), error in zip(batch, results):
+            if error is None:
+                sent.append(row_id)
+            elif is_relay_unavailable(error):
+                unavailable.append(row_id)
+            elif is_permanent_rejection(error) or attempts + 1 >= self.max_attempts:
+                logger.error(f"Dropping spooled message {row_id} after {attempts + 1} attempts: {error}")
+                dropped.append(row_id)
+            else:
+                rejected.append((row_id, attempts))
+        return sent, unavailable, rejected, dropped
+
+    async def _try_send(self, message: PreparedEmail) -> Exception | None:
+        try:
+            refused = await self.send(message)
+        except Exception as e:
+            return e
+        if refused:
+            # Il messaggio è stato consegnato agli altri destinatari: i rifiutati non vengono ritentati
+            self.refused += len(refused)
+            logger.warning(f"Spooled message sent, recipients refused by the relay: "
+                           f"{', '.join(f'{address} ({response})' for address, response in refused.items())}")
+        return None
+
+    async def stats(self) -> dict:
+        depth, oldest = await asyncio.to_thread(self.backend.stats)
+        return {
+            "depth": depth,
+            "oldest_age": round(time.time() - oldest, 3) if oldest is not None else 0,
+            "relay_down": self.relay_down,
+            "spooled": self.spooled,
+            "flushed": self.flushed,
+            "dropped": self.dropped,
+            "refused": self.refused,
+        }
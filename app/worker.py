@@ -0,0 +1,238 @@
+"""Entry point dei consumer RabbitMQ multi-processo, separato dall'app HTTP.
+
+Un supervisore avvia N processi worker (uno per core di default), ognuno con la propria connessione e il proprio
+canale RabbitMQ e una quota del prefetch, e li riavvia se terminano in modo anomalo.
+SIGTERM/SIGINT fermano tutti i worker in modo ordinato entro ``CONSUMER_SHUTDOWN_TIMEOUT`` secondi: ogni worker
+smette di ricevere messaggi e completa quelli in corso per al massimo ``SHUTDOWN_DRAIN_TIMEOUT`` secondi.
+Con ``WORKER_METRICS_PORT`` il supervisore espone su quella porta le metriche Prometheus aggregate di tutti i worker.
+
+Uso: ``python -m app.worker [--workers N]``
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import math
+import multiprocessing
+import os
+import signal
+import sys
+import tempfile
+import time
+
+from app.core.config import settings
+from app.core.executor import available_cpus, signing_share
+from app.core.logging import get_logger, setup_logging
+
+logger = get_logger(__name__)
+
+RESTART_BACKOFF_MAX = 30
+# Un worker che termina prima di questi secondi dall'avvio è considerato in crash loop
+MIN_HEALTHY_UPTIME = 10
+
+
+def worker_share(total: int, workers: int) -> int:
+    """Quota per worker di un limite configurato per l'intera replica (almeno 1, 0 resta illimitato)."""
+    if total <= 0:
+        return total
+    return max(1, math.ceil(total / workers))
+
+
+def share_worker_settings(workers: int) -> None:
+    """Divide tra i worker le risorse per replica che ogni worker crea per conto proprio.
+
+    I worker sono avviati con "spawn" e rileggono la configurazione dall'ambiente, dove viene scritta la loro quota.
+    """
+    if settings.DKIM_POOL_SIZE == 0:
+        # Ogni worker ha il proprio pool di firma
+        os.environ["EMAIL_DKIM_POOL_SIZE"] = str(signing_share(workers))
+    if settings.SCHEDULE_RELEASE_RATE > 0:
+        # Ogni worker rilascia le email programmate con il proprio scheduler
+        os.environ["EMAIL_SCHEDULE_RELEASE_RATE"] = str(settings.SCHEDULE_RELEASE_RATE / workers)
+
+
+async def run_consumer(prefetch_count: int, concurrency: int, bulk_rate: float = 0) -> int:
+    """Esegue un consumer sul loop corrente finché non riceve SIGTERM/SIGINT.
+
+    Returns:
+        int: Exit code del processo.
+    """
+    from app.consumers.registry import subscribe_all
+    from app.core.executor import shutdown_executor
+    from app.services.broker import AsyncBrokerSingleton
+    from app.services.email import dedup_store, scheduler, smtp_relays, spool, warm_templates
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+
+    warm_templates()
+
+    broker_instance = AsyncBrokerSingleton()
+    connected = await broker_instance.connect(
+        retries=settings.RABBITMQ_CONNECTION_RETRIES,
+        delay=settings.RABBITMQ_CONNECTION_RETRY_DELAY
+    )
+    if not connected:
+        logger.error("Could not connect to RabbitMQ after multiple attempts. Exiting...")
+        return 1
+
+    await smtp_relays.start()
+    await dedup_store.purge()
+    if spool is not None:
+        await spool.start()
+    if scheduler is not None:
+        await scheduler.start()
+    await subscribe_all(broker_instance, prefetch_count=prefetch_count, concurrency=concurrency, bulk_rate=bulk_rate)
+    logger.info(f"Consumer worker {os.getpid()} ready (prefetch={prefetch_count}, concurrency={concurrency})")
+
+    await stop.wait()
+
+    logger.info(f"Consumer worker {os.getpid()} shutting down...")
+    await broker_instance.drain(settings.SHUTDOWN_DRAIN_TIMEOUT)
+    await broker_instance.close()
+    if scheduler is not None:
+        await scheduler.close()
+    if spool is not None:
+        await spool.close()
+    await smtp_relays.close()
+    shutdown_executor()
+    return 0
+
+
+def _worker_main(prefetch_count: int, concurrency: int, bulk_rate: float = 0) -> None:
+    from app.core.sentry import init_sentry
+
+    setup_logging()
+    init_sentry()
+    sys.exit(asyncio.run(run_consumer(prefetch_count, concurrency, bulk_rate)))
+
+
+class Supervisor:
+    """Avvia e sorveglia i processi worker, riavviando con backoff quelli terminati in modo anomalo."""
+
+    def __init__(self, workers: int, *, target=_worker_main, args: tuple = (), shutdown_timeout: float = 30,
+                 context=None):
+        """Inizializza il supervisore.
+
+        Args:
+            workers (int): Numero di processi worker.
+            target (callable): Funzione eseguita da ogni worker (default: consumer RabbitMQ).
+            args (tuple): Argomenti passati a ``target``.
+            shutdown_timeout (float): Secondi concessi ai worker per terminare dopo SIGTERM (default: 30).
+            context: Contesto multiprocessing (default: "spawn", per non ereditare loop e thread del padre).
+        """
+        self.workers = workers
+        self.target = target
+        self.args = args
+        self.shutdown_timeout = shutdown_timeout
+        self.context = context or multiprocessing.get_context("spawn")
+        self.processes: list = [None] * workers
+        self.started_at = [0.0] * workers
+        self.backoff = [1.0] * workers
+        self.restart_at: list[float | None] = [None] * workers
+        self.restarts = 0
+        self.stopping = False
+        self.multiprocess_metrics = bool(os.environ.get("PROMETHEUS_MULTIPROC_DIR"))
+
+    def start_worker(self, slot: int):
+        process = self.context.Process(target=self.target, args=self.args, name=f"email-worker-{slot}")
+        process.start()
+        self.processes[slot] = process
+        self.started_at[slot] = time.monotonic()
+        self.restart_at[slot] = None
+        logger.info(f"Started worker {slot} (pid {process.pid})")
+
+    def supervise_once(self):
+        """Controlla i worker: pianifica il riavvio di quelli terminati e avvia quelli il cui backoff è scaduto."""
+        now = time.monotonic()
+        for slot, process in enumerate(self.processes):
+            if self.stopping:
+                return
+            if process is not None and not process.is_alive() and self.restart_at[slot] is None:
+                uptime = now - self.started_at[slot]
+                self.backoff[slot] = (
+                    min(self.backoff[slot] * 2, RESTART_BACKOFF_MAX) if uptime < MIN_HEALTHY_UPTIME else 1.0
+                )
+                self.restart_at[slot] = now + self.backoff[slot]
+                self._process_exited(process)
+                logger.error(
+                    f"Worker {slot} (pid {process.pid}) exited with code {process.exitcode}. "
+                    f"Restarting in {self.backoff[slot]:.0f}s")
+            if self.restart_at[slot] is not None and now >= self.restart_at[slot]:
+                self.restarts += 1
+                self.start_worker(slot)
+
+    def stop(self, *_):
+        self.stopping = True
+
+    def shutdown(self):
+        """Invia SIGTERM a tutti i worker e attende la loro chiusura, forzandola allo scadere del timeout."""
+        alive = [p for p in self.processes if p is not None and p.is_alive()]
+        logger.info(f"Stopping {len(alive)} workers...")
+        for process in alive:
+            process.terminate()
+        deadline = time.monotonic() + self.shutdown_timeout
+        for process in alive:
+            process.join(max(deadline - time.monotonic(), 0))
+            if process.is_alive():
+                logger.warning(f"Worker pid {process.pid} did not stop in time. Killing it")
+                process.kill()
+                process.join()
+            self._process_exited(process)
+
+    def _process_exited(self, process):
+        if self.multiprocess_metrics:
+            # I gauge "live" del processo terminato non devono più contare nell'aggregato
+            from prometheus_client import multiprocess
+            multiprocess.mark_process_dead(process.pid)
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for slot in range(self.workers):
+            self.start_worker(slot)
+        while not self.stopping:
+            time.sleep(0.5)
+            self.supervise_once()
+        self.shutdown()
+
+
+def start_metrics_server(port: int) -> None:
+    """Espone le metriche aggregate dei worker (da chiamare prima di avviarli, che ereditano la directory)."""
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="email-metrics-"))
+    from prometheus_client import start_http_server
+
+    from app.core.metrics import metrics_registry
+
+    start_http_server(port, registry=metrics_registry())
+    logger.info(f"Serving worker metrics on port {port} ({os.environ['PROMETHEUS_MULTIPROC_DIR']})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Multi-process RabbitMQ consumer")
+    parser.add_argument("--workers", type=int, default=settings.CONSUMER_WORKERS,
+                        help="Numero di processi worker (default: EMAIL_CONSUMER_WORKERS, 0 = un worker per core)")
+    args = parser.parse_args()
+
+    setup_logging()
+    workers = args.workers or available_cpus()
+    prefetch_count = worker_share(settings.CONSUMER_PREFETCH, workers)
+    concurrency = worker_share(settings.CONSUMER_CONCURRENCY, workers)
+    bulk_rate = settings.BULK_RATE_LIMIT_PER_SECOND / workers
+    share_worker_settings(workers)
+    logger.info(f"Starting {workers} consumer workers (prefetch={prefetch_count}, concurrency={concurrency} each)")
+
+    if settings.WORKER_METRICS_PORT:
+        start_metrics_server(settings.WORKER_METRICS_PORT)
+
+    Supervisor(
+        workers,
+        args=(prefetch_count, concurrency, bulk_rate),
+        shutdown_timeout=settings.CONSUMER_SHUTDOWN_TIMEOUT,
+    ).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Throughput della firma DKIM: inline sull'event loop e nel pool di processi di firma.
+
+Con la firma inline ogni RSA blocca il loop; il pool deve reggere almeno il throughput atteso del consumer.
+
+Uso: ``python -m tests.benchmarks.bench_dkim [--messages 5000] [--key-size 2048] [--workers 1 2 4]``
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import multiprocessing
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from app.core.executor import available_cpus
+from app.services.dkim import get_signer, load_private_key, sign_message
+from app.services.message import build_html_message
+
+
+def report(label: str, messages: int, elapsed: float) -> None:
+    print(f"{label:<22} {messages / elapsed:>10,.0f} firme/s   {elapsed / messages * 1e6:>8.1f} us/firma")
+
+
+def write_key(directory: str, key_size: int) -> str:
+    key = rsa.generate_private_key(public_exponent=65537, key_size=key_size)
+    path = Path(directory) / "dkim.pem"
+    path.write_bytes(key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ))
+    return str(path)
+
+
+async def sign_in_pool(executor: ProcessPoolExecutor, messages: list, key_path: str) -> None:
+    loop = asyncio.get_running_loop()
+    await asyncio.gather(*(
+        loop.run_in_executor(executor, sign_message, prepared, "example.com", "mail", key_path)
+        for prepared in messages
+    ))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--key-size", type=int, default=2048)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, available_cpus()])
+    args = parser.parse_args()
+
+    html = "<p>Ciao {username}, conferma il tuo indirizzo.</p>" * 20
+    messages = [
+        build_html_message("Conferma email", f"user{i}@example.com", f"user{i}@example.com",
+                           html.format(username=f"user{i}"), "Noreply <noreply@example.com>", "noreply@example.com")
+        for i in range(args.messages)
+    ]
+
+    with tempfile.TemporaryDirectory() as directory:
+        key_path = write_key(directory, args.key_size)
+
+        start = time.perf_counter()
+        for prepared in messages[:200]:
+            load_private_key.cache_clear()
+            get_signer.cache_clear()
+            sign_message(prepared, "example.com", "mail", key_path)
+        report("inline, no key cache", 200, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        for prepared in messages:
+            sign_message(prepared, "example.com", "mail", key_path)
+        report("inline", len(messages), time.perf_counter() - start)
+
+        for workers in sorted(set(args.workers)):
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                asyncio.run(sign_in_pool(executor, messages[:workers], key_path))  # avvio dei processi e chiave
+                start = time.perf_counter()
+                asyncio.run(sign_in_pool(executor, messages, key_path))
+                report(f"pool, {workers} processi", len(messages), time.perf_counter() - start)
+
+
+if __name__ == "__main__":
+    main()
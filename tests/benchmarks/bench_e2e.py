@@ -0,0 +1,280 @@
+"""Benchmark end-to-end: ``send_email`` e ``on_email_message`` reali contro un relay SMTP locale.
+
+Il relay è un sink aiosmtpd con latenza ed errori iniettati; il percorso consumer passa da
+``AsyncBrokerSingleton.subscribe`` (lane, retry, ack) con un canale AMQP in memoria al posto di RabbitMQ.
+Per ogni combinazione di percorso, concorrenza e dimensione del template riporta email/s, latenza p50/p99
+(elaborazione del singolo messaggio) e memoria allocata per messaggio in volo (passata separata con tracemalloc).
+
+Uso: ``python -m tests.benchmarks.bench_e2e [--emails 2000] [--concurrency 1 10 50] [--template-kb 1 32]
+[--latency-ms 5] [--error-rate 0.01] [--save risultati.json] [--compare baseline.json]``
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass
+
+from tests.benchmarks.stubs import InMemoryChannel, SMTPSink, free_port
+
+PATHS = ("send_email", "consumer")
+# Paragrafo ripetuto per portare il template alla dimensione richiesta
+FILLER = "<p>Ciao {{ username }}, questa è una riga di contenuto per il benchmark: {{ link }}</p>\n"
+
+
+@dataclass
+class Result:
+    path: str
+    concurrency: int
+    template_kb: int
+    emails: int
+    emails_per_second: float
+    p50_ms: float
+    p99_ms: float
+    kib_per_in_flight: float
+    smtp_errors: int
+
+    @property
+    def key(self) -> str:
+        return f"{self.path}/c{self.concurrency}/{self.template_kb}kb"
+
+
+def configure_environment(port: int, pool_size: int) -> None:
+    """Punta il servizio al sink locale; va chiamata prima di importare ``app``."""
+    os.environ.update({
+        "EMAIL_MAIL_SERVER": "127.0.0.1",
+        "EMAIL_MAIL_PORT": str(port),
+        "EMAIL_MAIL_FROM": "noreply@example.com",
+        "EMAIL_MAIL_STARTTLS": "False",
+        "EMAIL_MAIL_SSL_TLS": "False",
+        "EMAIL_USE_CREDENTIALS": "False",
+        "EMAIL_VALIDATE_CERTS": "False",
+        "EMAIL_SPOOL_URL": "",
+        "EMAIL_DEDUP_BACKEND_URL": "",
+        "EMAIL_SMTP_POOL_MAX_SIZE": str(pool_size),
+        "EMAIL_SMTP_BREAKER_FAILURE_THRESHOLD": "1000",
+        "EMAIL_RETRY_BASE_DELAY": "0.05",
+        "EMAIL_RETRY_MAX_DELAY": "0.5",
+        "EMAIL_LOG_LEVEL": "WARNING",
+    })
+
+
+def install_templates(sizes: list[int]) -> None:
+    """Aggiunge all'ambiente Jinja2 del servizio i template ``bench_<N>kb`` generati in memoria."""
+    from jinja2 import ChoiceLoader, DictLoader
+
+    from app.services import email
+
+    generated = {
+        f"bench_{kb}kb.html": "<html><body>\n" + FILLER * max(1, kb * 1024 // len(FILLER)) + "</body></html>"
+        for kb in sizes
+    }
+    env = email.templates
+    env.loader = ChoiceLoader([DictLoader(generated), env.loader])
+
+
+def payload(i: int, template_kb: int) -> dict:
+    return {
+        "to": f"user{i}@example.com",
+        "subject": "Benchmark",
+        "template_name": f"bench_{template_kb}kb",
+        "context": {"username": f"user{i}", "link": f"https://example.com/verify/{i}"},
+    }
+
+
+async def run_send_email(emails: int, concurrency: int, template_kb: int, sink: SMTPSink) -> tuple[list[float], int]:
+    """Chiama ``send_email`` per ``emails`` destinatari con al massimo ``concurrency`` invii contemporanei.
+
+    Returns:
+        tuple[list[float], int]: Latenze dei singoli invii riusciti e massimo numero di invii in volo.
+    """
+    from app.schemas.email import EmailRequest
+    from app.services.email import send_email
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    in_flight = peak = 0
+
+    async def one(i: int):
+        nonlocal in_flight, peak
+        request = EmailRequest(**payload(i, template_kb))
+        async with semaphore:
+            in_flight += 1
+            peak = max(peak, in_flight)
+            start = time.perf_counter()
+            try:
+                await send_email(request)
+                latencies.append(time.perf_counter() - start)
+            except Exception:
+                pass  # errori iniettati: contati dal sink
+            finally:
+                in_flight -= 1
+
+    await asyncio.gather(*(one(i) for i in range(emails)))
+    return latencies, peak
+
+
+async def run_consumer(emails: int, concurrency: int, template_kb: int, sink: SMTPSink) -> tuple[list[float], int]:
+    """Pubblica ``emails`` messaggi sul canale in memoria e attende che arrivino tutti al sink o alla DLQ.
+
+    Returns:
+        tuple[list[float], int]: Tempi consegna -> ack dei messaggi e massimo numero di messaggi non confermati.
+    """
+    from app.consumers.registry import lanes, subscribe_all
+    from app.core.config import settings
+    from app.services.broker import AsyncBrokerSingleton
+    from app.services.lanes import TRANSACTIONAL
+
+    AsyncBrokerSingleton._instance = None
+    broker = AsyncBrokerSingleton()
+    broker.channel = InMemoryChannel()
+    await subscribe_all(broker, prefetch_count=concurrency * 2, concurrency=concurrency, bulk_rate=0)
+    queue = broker.channel.queues[f"{broker.service_name}.email.{lanes[TRANSACTIONAL]}"]
+    dead_letters = broker.channel.queues[f"{broker.service_name}.email.dlq"]
+
+    delivered = sink.delivered
+    await broker.publish_many("email", "send_email", (payload(i, template_kb) for i in range(emails)),
+                              routing_key=settings.RABBITMQ_SEND_EMAIL_ROUTING_KEY)
+    # Un messaggio fallito viene confermato e ripubblicato: è concluso quando arriva al sink o alla DLQ
+    while sink.delivered - delivered + len(dead_letters.messages) < emails:
+        await asyncio.sleep(0.01)
+
+    await broker.drain(timeout=5)
+    await broker.channel.close()
+    AsyncBrokerSingleton._instance = None
+    return queue.latencies, queue.max_unacked
+
+
+async def measure(path: str, emails: int, concurrency: int, template_kb: int,
+                  sink: SMTPSink) -> tuple[float, list[float], int]:
+    runner = run_send_email if path == "send_email" else run_consumer
+    start = time.perf_counter()
+    latencies, peak = await runner(emails, concurrency, template_kb, sink)
+    return time.perf_counter() - start, latencies, peak
+
+
+async def run_scenario(path: str, emails: int, concurrency: int, template_kb: int, sink: SMTPSink,
+                       memory_emails: int) -> Result:
+    rejected = sink.rejected
+    elapsed, latencies, _ = await measure(path, emails, concurrency, template_kb, sink)
+    smtp_errors = sink.rejected - rejected
+
+    # Passata separata: tracemalloc rallenta l'esecuzione e non deve falsare throughput e latenze
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    _, _, peak_in_flight = await measure(path, memory_emails, concurrency, template_kb, sink)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else [0.0] * 99
+    return Result(
+        path=path,
+        concurrency=concurrency,
+        template_kb=template_kb,
+        emails=emails,
+        emails_per_second=round(emails / elapsed, 1),
+        p50_ms=round(quantiles[49] * 1000, 2),
+        p99_ms=round(quantiles[98] * 1000, 2),
+        kib_per_in_flight=round((peak_memory - baseline) / max(peak_in_flight, 1) / 1024, 1),
+        smtp_errors=smtp_errors,
+    )
+
+
+def print_results(results: list[Result], baseline: dict[str, dict] | None) -> None:
+    header = f"{'scenario':<26} {'email/s':>10} {'p50 ms':>9} {'p99 ms':>9} {'KiB/msg':>9} {'errori':>7}"
+    if baseline:
+        header += f" {'Δ email/s':>10} {'Δ p99':>8}"
+    print(header)
+    for result in results:
+        line = (f"{result.key:<26} {result.emails_per_second:>10,.0f} {result.p50_ms:>9.2f} {result.p99_ms:>9.2f} "
+                f"{result.kib_per_in_flight:>9.1f} {result.smtp_errors:>7}")
+        if baseline and (previous := baseline.get(result.key)):
+            line += (f" {change(result.emails_per_second, previous['emails_per_second']):>+9.1%}"
+                     f" {change(result.p99_ms, previous['p99_ms']):>+8.1%}")
+        print(line)
+
+
+def change(current: float, previous: float) -> float:
+    return (current - previous) / previous if previous else 0.0
+
+
+def regressions(results: list[Result], baseline: dict[str, dict], tolerance: float) -> list[str]:
+    """Scenari con throughput calato o p99 cresciuto oltre ``tolerance`` rispetto alla baseline."""
+    found = []
+    for result in results:
+        previous = baseline.get(result.key)
+        if previous is None:
+            continue
+        if change(result.emails_per_second, previous["emails_per_second"]) < -tolerance:
+            found.append(f"{result.key}: throughput {previous['emails_per_second']} -> {result.emails_per_second}")
+        if change(result.p99_ms, previous["p99_ms"]) > tolerance:
+            found.append(f"{result.key}: p99 {previous['p99_ms']} ms -> {result.p99_ms} ms")
+    return found
+
+
+async def run(args) -> list[Result]:
+    from app.core.logging import setup_logging
+    from app.services.email import smtp_relays, warm_templates
+
+    setup_logging()
+    install_templates(args.template_kb)
+    warm_templates()
+    await smtp_relays.start()
+    try:
+        return [
+            await run_scenario(path, args.emails, concurrency, template_kb, args.sink, args.memory_emails)
+            for path in args.paths
+            for concurrency in args.concurrency
+            for template_kb in args.template_kb
+        ]
+    finally:
+        await smtp_relays.close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark end-to-end con relay SMTP e broker locali")
+    parser.add_argument("--emails", type=int, default=2000, help="Email per scenario")
+    parser.add_argument("--memory-emails", type=int, default=200, help="Email della passata con tracemalloc")
+    parser.add_argument("--paths", nargs="+", choices=PATHS, default=list(PATHS))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+    parser.add_argument("--template-kb", type=int, nargs="+", default=[1, 32])
+    parser.add_argument("--latency-ms", type=float, default=5, help="Latenza del relay SMTP per transazione")
+    parser.add_argument("--error-rate", type=float, default=0, help="Frazione di transazioni SMTP rifiutate")
+    parser.add_argument("--error-code", type=int, default=451, help="Codice SMTP degli errori iniettati")
+    parser.add_argument("--pool-size", type=int, help="Sessioni SMTP massime (default: concorrenza massima)")
+    parser.add_argument("--save", help="Salva i risultati in questo file JSON (es. come nuova baseline)")
+    parser.add_argument("--compare", help="Confronta con una baseline salvata con --save")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="Peggioramento ammesso rispetto alla baseline")
+    args = parser.parse_args()
+
+    port = free_port()
+    configure_environment(port, args.pool_size or max(args.concurrency))
+    args.sink = SMTPSink(port, latency=args.latency_ms / 1000, error_rate=args.error_rate, error_code=args.error_code)
+    args.sink.start()
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        args.sink.stop()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"options": {key: value for key, value in vars(args).items() if key != "sink"},
+                       "results": {result.key: asdict(result) for result in results}}, f, indent=2)
+    if baseline and (found := regressions(results, baseline, args.tolerance)):
+        print("Regressioni rispetto alla baseline:\n  " + "\n  ".join(found))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""Costo CPU per messaggio del parsing nel consumer: body AMQP (bytes JSON) -> richiesta validata.
+
+Confronta il percorso precedente (``body.decode()``, ``json.loads``, ``EmailRequest(**payload)`` con ``NameEmail``
+senza cache) con ``email_message_adapter.validate_json`` sui bytes, per destinatari tutti diversi (cache degli
+indirizzi inutile), destinatari ricorrenti e batch.
+
+Uso: ``python -m tests.benchmarks.bench_parse [--messages 20000] [--distinct 100] [--batch-size 50]``
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+import uuid
+from typing import Any, Dict, List
+
+import orjson
+from pydantic import BaseModel, NameEmail
+
+from app.schemas.email import email_message_adapter
+
+
+class LegacyEmailRequest(BaseModel):
+    to: NameEmail
+    subject: str
+    template_name: str
+    context: Dict[str, Any]
+
+
+class LegacyBatchRecipient(BaseModel):
+    to: NameEmail
+    context: Dict[str, Any] = {}
+
+
+class LegacyBatchEmailRequest(BaseModel):
+    subject: str
+    template_name: str
+    context: Dict[str, Any] = {}
+    recipients: List[LegacyBatchRecipient]
+
+
+def legacy_parse(body: bytes):
+    data = json.loads(body.decode())
+    payload = data.get("data", data)
+    if "recipients" in payload:
+        return LegacyBatchEmailRequest.model_validate(payload)
+    return LegacyEmailRequest(**payload)
+
+
+def current_parse(body: bytes):
+    return email_message_adapter.validate_json(body)
+
+
+def envelope(data: dict) -> bytes:
+    return orjson.dumps({"id": str(uuid.uuid4()), "type": "send_email", "data": data})
+
+
+def single(i: int, domain: str = "example.com") -> bytes:
+    return envelope({
+        "to": f"Utente {i} <user{i}@{domain}>",
+        "subject": "Conferma il tuo indirizzo",
+        "template_name": "verify_email_v1",
+        "context": {"username": f"user{i}", "link": f"https://example.com/verify/{uuid.uuid4().hex}"},
+    })
+
+
+def batch(i: int, size: int) -> bytes:
+    return envelope({
+        "subject": "Novità della settimana",
+        "template_name": "digest_v1",
+        "recipients": [{"to": f"user{i * size + j}@example.com", "context": {"n": j}} for j in range(size)],
+    })
+
+
+def cpu_per_message(parse, bodies: list[bytes]) -> float:
+    start = time.process_time()
+    for body in bodies:
+        parse(body)
+    return (time.process_time() - start) / len(bodies)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Costo CPU del parsing dei messaggi email")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--distinct", type=int, default=100, help="Destinatari distinti nello scenario ricorrente")
+    parser.add_argument("--batch-size", type=int, default=50)
+    args = parser.parse_args()
+
+    batches = max(1, args.messages // args.batch_size)
+    scenarios = {
+        "singole, destinatari unici": [single(i) for i in range(args.messages)],
+        f"singole, {args.distinct} destinatari": [single(i % args.distinct) for i in range(args.messages)],
+        f"batch da {args.batch_size}, unici": [batch(i, args.batch_size) for i in range(batches)],
+    }
+
+    # Riscaldamento con indirizzi diversi da quelli misurati, per non riempire in anticipo la cache degli indirizzi
+    warmup = [single(i, "warmup.example.com") for i in range(100)]
+    for parse in (legacy_parse, current_parse):
+        cpu_per_message(parse, warmup)
+
+    print(f"{'scenario':<32} {'prima us/msg':>13} {'dopo us/msg':>12} {'Δ':>8}")
+    for name, bodies in scenarios.items():
+        before = cpu_per_message(legacy_parse, bodies)
+        after = cpu_per_message(current_parse, bodies)
+        print(f"{name:<32} {before * 1e6:>13.1f} {after * 1e6:>12.1f} {(after - before) / before:>+8.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+"""Confronta il rendering per-messaggio con il rendering bulk (render-once + sostituzione degli slot).
+
+Uso: ``python -m tests.benchmarks.bench_render [--recipients 10000] [--template verify_email_v1]``
+"""
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+
+from jinja2 import Environment, FileSystemLoader
+
+from app.services.rendering import BulkTemplateRenderer
+
+TEMPLATES_DIR = Path(__file__).resolve().parents[2] / "app" / "templates"
+
+
+def bench(label: str, fn, recipients: list[dict]) -> float:
+    start = time.perf_counter()
+    for recipient in recipients:
+        fn(recipient)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<12} {len(recipients) / elapsed:>12,.0f} renders/s   {elapsed / len(recipients) * 1e6:>8.1f} us/render")
+    return elapsed
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--recipients", type=int, default=10_000)
+    parser.add_argument("--template", default="verify_email_v1")
+    args = parser.parse_args()
+
+    env = Environment(loader=FileSystemLoader(str(TEMPLATES_DIR)), autoescape=True)
+    template = env.get_template(f"{args.template}.html")
+    shared = {"link": "https://orientati.example/verify"}
+    recipients = [{"username": f"user{i}"} for i in range(args.recipients)]
+    renderer = BulkTemplateRenderer()
+
+    full = bench("per-message", lambda r: template.render(**shared, **r), recipients)
+    bulk = bench("bulk", lambda r: renderer.render(template, shared, r), recipients)
+    print(f"speedup: {full / bulk:.1f}x (cache hits={renderer.hits}, misses={renderer.misses})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+"""Tempo di avvio: import dei moduli di ingresso e latenza del primo messaggio di un worker a freddo.
+
+Ogni misura gira in un processo Python nuovo, così nessun modulo è già in ``sys.modules``:
+- ``import:<modulo>``: import di ``app.main`` (API), ``app.worker`` (supervisore) e del percorso consumer;
+- ``first_message``: avvio di un worker come ``app.worker.run_consumer`` (import, warm-up dei template, sessioni
+  SMTP, sottoscrizione su un canale AMQP in memoria) e primo messaggio confermato, inviato a un relay aiosmtpd locale.
+Per ogni misura riporta la mediana di ``--runs`` processi.
+
+Uso: ``python -m tests.benchmarks.bench_startup [--runs 5] [--save risultati.json] [--compare baseline.json]``
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+IMPORT_TARGETS = ("app.main", "app.worker", "app.consumers.registry")
+
+
+def child_import(module: str) -> dict:
+    start = time.perf_counter()
+    __import__(module)
+    return {"import_ms": (time.perf_counter() - start) * 1000}
+
+
+def child_first_message() -> dict:
+    start = time.perf_counter()
+    from app.consumers.registry import lanes, subscribe_all
+    from app.core.config import settings
+    from app.services.broker import AsyncBrokerSingleton
+    from app.services.email import smtp_relays, warm_templates
+    from app.services.lanes import TRANSACTIONAL
+    imported = time.perf_counter()
+
+    from tests.benchmarks.stubs import InMemoryChannel
+
+    async def run() -> tuple[float, float]:
+        warmup_start = time.perf_counter()
+        warm_templates()
+        await smtp_relays.start()
+        broker = AsyncBrokerSingleton()
+        broker.channel = InMemoryChannel()
+        await subscribe_all(broker, prefetch_count=1, concurrency=1, bulk_rate=0)
+        queue = broker.channel.queues[f"{broker.service_name}.email.{lanes[TRANSACTIONAL]}"]
+        ready = time.perf_counter()
+
+        await broker.publish_message("email", "send_email", {
+            "to": "user@example.com",
+            "subject": "Benchmark",
+            "template_name": "verify_email_v1",
+            "context": {"username": "user", "link": "https://example.com/verify/1"},
+        }, routing_key=settings.RABBITMQ_SEND_EMAIL_ROUTING_KEY)
+        while not queue.acked:
+            await asyncio.sleep(0.001)
+        done = time.perf_counter()
+
+        await broker.channel.close()
+        await smtp_relays.close()
+        return ready - warmup_start, done - ready
+
+    warmup, first_message = asyncio.run(run())
+    return {
+        "import_ms": (imported - start) * 1000,
+        "warmup_ms": warmup * 1000,
+        "first_message_ms": first_message * 1000,
+        "total_ms": (time.perf_counter() - start) * 1000,
+    }
+
+
+def spawn(args: list[str]) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-m", "tests.benchmarks.bench_startup", "--child", *args],
+        check=True, capture_output=True, text=True, env=os.environ,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def median_of(runs: int, args: list[str]) -> dict[str, float]:
+    samples = [spawn(args) for _ in range(runs)]
+    return {key: round(statistics.median(sample[key] for sample in samples), 1) for key in samples[0]}
+
+
+def measure(runs: int) -> dict[str, dict[str, float]]:
+    from tests.benchmarks.bench_e2e import configure_environment
+    from tests.benchmarks.stubs import SMTPSink, free_port
+
+    port = free_port()
+    configure_environment(port, pool_size=1)
+    os.environ["EMAIL_SENTRY_DSN"] = ""
+    sink = SMTPSink(port)
+    sink.start()
+    try:
+        results = {f"import:{module}": median_of(runs, ["import", module]) for module in IMPORT_TARGETS}
+        results["first_message"] = median_of(runs, ["first_message"])
+    finally:
+        sink.stop()
+    return results
+
+
+def regressions(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Misure cresciute oltre ``tolerance`` rispetto alla baseline."""
+    found = []
+    for name, phases in results.items():
+        for phase, value in phases.items():
+            previous = baseline.get(name, {}).get(phase)
+            if previous and (value - previous) / previous > tolerance:
+                found.append(f"{name} {phase}: {previous} ms -> {value} ms")
+    return found
+
+
+def print_results(results: dict, baseline: dict | None) -> None:
+    for name, phases in results.items():
+        line = f"{name:<30}"
+        for phase, value in phases.items():
+            line += f" {phase} {value:>7.1f}"
+            if baseline and (previous := baseline.get(name, {}).get(phase)):
+                line += f" ({(value - previous) / previous:+.0%})"
+        print(line)
+
+
+def main() -> None:
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        kind = sys.argv[2]
+        print(json.dumps(child_import(sys.argv[3]) if kind == "import" else child_first_message()))
+        return
+
+    parser = argparse.ArgumentParser(description="Tempo di import e latenza del primo messaggio a freddo")
+    parser.add_argument("--runs", type=int, default=5, help="Processi per misura (si riporta la mediana)")
+    parser.add_argument("--save", help="Salva i risultati in questo file JSON (es. come nuova baseline)")
+    parser.add_argument("--compare", help="Confronta con una baseline salvata con --save")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Peggioramento ammesso rispetto alla baseline")
+    args = parser.parse_args()
+
+    results = measure(args.runs)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["results"]
+    print_results(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"options": vars(args), "results": results}, f, indent=2)
+    if baseline and (found := regressions(results, baseline, args.tolerance)):
+        print("Regressioni rispetto alla baseline:\n  " + "\n  ".join(found))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+"""Sostituti locali di relay SMTP e RabbitMQ per i benchmark end-to-end.
+
+``SMTPSink`` è un server SMTP aiosmtpd (in un thread separato, con il proprio event loop) che scarta i messaggi
+dopo una latenza artificiale e può rispondere con errori a una frazione delle transazioni.
+``InMemoryChannel`` implementa il sottoinsieme del canale aio-pika usato da ``AsyncBrokerSingleton``
+(exchange diretti, code con prefetch, ack/reject, code di ritardo con TTL e dead-letter), così il percorso
+reale ``subscribe`` -> retry -> ``on_email_message`` gira senza un broker.
+"""
+from __future__ import annotations
+
+import asyncio
+import random
+import socket
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class SMTPSink:
+    """Relay SMTP locale con latenza e errori iniettati."""
+
+    def __init__(self, port: int, *, latency: float = 0, error_rate: float = 0, error_code: int = 451, seed: int = 0):
+        """Inizializza il sink.
+
+        Args:
+            port (int): Porta su cui ascoltare (127.0.0.1).
+            latency (float): Secondi di attesa prima di rispondere al DATA (default: 0).
+            error_rate (float): Frazione delle transazioni rifiutate (default: 0).
+            error_code (int): Codice SMTP delle risposte di errore (default: 451, relay non disponibile).
+            seed (int): Seed del generatore degli errori, per esecuzioni ripetibili.
+        """
+        # Import locale: i processi di bench_startup usano solo il canale in memoria e non devono importare aiosmtpd
+        from aiosmtpd.controller import Controller
+
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_code = error_code
+        self.random = random.Random(seed)
+        self.delivered = 0
+        self.rejected = 0
+        self.controller = Controller(self, hostname="127.0.0.1", port=port)
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.rejected += 1
+            return f"{self.error_code} Injected failure"
+        self.delivered += 1
+        return "250 OK"
+
+    def start(self):
+        self.controller.start()
+
+    def stop(self):
+        self.controller.stop()
+
+
+class InMemoryMessage:
+    """Messaggio consegnato da ``InMemoryQueue``, con l'interfaccia di ``aio_pika.IncomingMessage`` usata dal broker."""
+
+    def __init__(self, message, routing_key: str, queue: InMemoryQueue):
+        self.body = message.body
+        self.headers = dict(message.headers or {})
+        self.content_type = message.content_type
+        self.message_id = message.message_id
+        self.type = message.type
+        self.timestamp = message.timestamp
+        self.expiration = message.expiration
+        self.routing_key = routing_key
+        self.queue = queue
+        self.delivered_at = 0.0
+        self.settled = False
+
+    @asynccontextmanager
+    async def process(self, requeue=False, ignore_processed=False):
+        try:
+            yield
+        except BaseException:
+            await self.reject(requeue=requeue)
+            raise
+        self.ack()
+
+    def ack(self):
+        if not self.settled:
+            self.settled = True
+            self.queue.settle(self, acked=True)
+
+    async def reject(self, requeue=False):
+        if not self.settled:
+            self.settled = True
+            self.queue.settle(self, acked=False)
+            if requeue:
+                self.queue.put(self)
+
+
+class InMemoryQueue:
+    """Coda con consegna rispettosa del prefetch e, se dichiarata con TTL, dead-letter verso un'altra coda."""
+
+    def __init__(self, channel: InMemoryChannel, name: str, arguments: dict | None = None):
+        self.channel = channel
+        self.name = name
+        self.arguments = arguments or {}
+        self.messages: deque[InMemoryMessage] = deque()
+        self.callback = None
+        self.prefetch = 0
+        self.unacked = 0
+        self.max_unacked = 0
+        self.acked = 0
+        self.latencies: list[float] = []
+        self._ready = asyncio.Event()
+        self._dispatcher: asyncio.Task | None = None
+
+    async def bind(self, exchange, routing_key=""):
+        exchange.bindings[routing_key].append(self)
+
+    async def unbind(self, *args, **kwargs):
+        pass
+
+    async def consume(self, callback):
+        self.callback = callback
+        self.prefetch = self.channel.prefetch
+        self._dispatcher = asyncio.create_task(self._dispatch())
+        return f"ctag-{self.name}"
+
+    async def cancel(self, consumer_tag):
+        self.callback = None
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            self._dispatcher = None
+
+    def put(self, message: InMemoryMessage):
+        ttl = self.arguments.get("x-message-ttl")
+        if ttl is not None:
+            # Coda di ritardo: il messaggio scade e torna alla coda di dead-letter
+            delay = ttl / 1000
+            if message.expiration is not None:
+                delay = min(delay, float(message.expiration))
+            target = self.channel.queues[self.arguments["x-dead-letter-routing-key"]]
+            asyncio.get_running_loop().call_later(delay, target.put, message)
+            return
+        message.queue = self
+        message.settled = False
+        self.messages.append(message)
+        self._ready.set()
+
+    def settle(self, message: InMemoryMessage, acked: bool):
+        self.unacked -= 1
+        if acked:
+            self.acked += 1
+            self.latencies.append(time.perf_counter() - message.delivered_at)
+        self._ready.set()
+
+    async def _dispatch(self):
+        while True:
+            while not self.messages or (self.prefetch and self.unacked >= self.prefetch):
+                self._ready.clear()
+                await self._ready.wait()
+            message = self.messages.popleft()
+            self.unacked += 1
+            self.max_unacked = max(self.max_unacked, self.unacked)
+            message.delivered_at = time.perf_counter()
+            asyncio.create_task(self.callback(message))
+
+
+class InMemoryExchange:
+    def __init__(self, channel: InMemoryChannel, name: str, direct_to_queues: bool = False):
+        self.channel = channel
+        self.name = name
+        self.direct_to_queues = direct_to_queues
+        self.bindings: dict[str, list[InMemoryQueue]] = defaultdict(list)
+
+    async def publish(self, message, routing_key=""):
+        if self.direct_to_queues:
+            # Default exchange: la routing key è il nome della coda
+            queues = [self.channel.queues[routing_key]]
+        else:
+            queues = self.bindings.get(routing_key, [])
+        for queue in queues:
+            queue.put(InMemoryMessage(message, routing_key, queue))
+
+
+class InMemoryChannel:
+    """Canale aio-pika in memoria (vedi modulo)."""
+
+    def __init__(self):
+        self.prefetch = 0
+        self.queues: dict[str, InMemoryQueue] = {}
+        self.exchanges: dict[str, InMemoryExchange] = {}
+        self.default_exchange = InMemoryExchange(self, "", direct_to_queues=True)
+
+    async def set_qos(self, prefetch_count=0, **kwargs):
+        self.prefetch = prefetch_count
+
+    async def declare_exchange(self, name, ex_type="direct", durable=True, **kwargs):
+        return self.exchanges.setdefault(name, InMemoryExchange(self, name))
+
+    async def declare_queue(self, name, durable=True, arguments=None, **kwargs):
+        return self.queues.setdefault(name, InMemoryQueue(self, name, arguments))
+
+    async def close(self):
+        for queue in self.queues.values():
+            await queue.cancel(None)
@@ -20,6 +20,7 @@ def mock_broker(monkeypatch):
     mock_instance = MagicMock()
     mock_instance.connect = AsyncMock(return_value=True)
     mock_instance.subscribe = AsyncMock()
+    mock_instance.drain = AsyncMock(return_value=True)
     mock_instance.close = AsyncMock()
     
     # Simula il comportamento del singleton: quando viene chiamato AsyncBrokerSingleton(), restituisce mock_instance
@@ -58,3 +59,14 @@ def mock_send_email(monkeypatch):
     mock_send = AsyncMock()
     monkeypatch.setattr(fast_mail, "send_message", mock_send)
     return mock_send
+
+@pytest.fixture(autouse=True)
+def dedup_store(monkeypatch):
+    """
+    Usa un registro delle consegne vuoto per ogni test, così gli id ripetuti tra test non vengono deduplicati.
+    """
+    from app.services import email
+    from app.services.dedup import DeduplicationStore
+    store = DeduplicationStore()
+    monkeypatch.setattr(email, "dedup_store", store)
+    return store
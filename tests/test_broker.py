@@ -0,0 +1,304 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+
+import aio_pika
+import pytest
+from pamqp.commands import Basic
+from unittest.mock import AsyncMock, MagicMock
+
+from prometheus_client import REGISTRY
+
+from app.services.broker import AsyncBrokerSingleton, PUBLISHED_AT_HEADER, RETRY_ATTEMPT_HEADER, RETRY_QUEUE_HEADER, \
+    PublishConfirmError
+
+
+@pytest.fixture
+def real_broker():
+    """
+    Istanza reale di AsyncBrokerSingleton con canale simulato (il fixture mock_broker sostituisce solo il nome nel modulo).
+    """
+    AsyncBrokerSingleton._instance = None
+    instance = AsyncBrokerSingleton()
+    instance.channel = MagicMock()
+    instance.channel.set_qos = AsyncMock()
+    exchange = MagicMock()
+    instance.channel.declare_exchange = AsyncMock(return_value=exchange)
+    queue = MagicMock()
+    queue.bind = AsyncMock()
+    queue.consume = AsyncMock(return_value="ctag-1")
+    queue.cancel = AsyncMock()
+    instance.channel.declare_queue = AsyncMock(return_value=queue)
+    instance.channel.default_exchange.publish = AsyncMock()
+    yield instance
+    AsyncBrokerSingleton._instance = None
+
+
+@pytest.mark.asyncio
+async def test_subscribe_sets_prefetch(real_broker):
+    await real_broker.subscribe("email", AsyncMock(), routing_key="send_email", prefetch_count=7, concurrency=3)
+
+    real_broker.channel.set_qos.assert_awaited_once_with(prefetch_count=7)
+    assert real_broker.consumer_tags["email_service.email.send_email"] == "ctag-1"
+
+
+@pytest.mark.asyncio
+async def test_subscribe_caps_callback_concurrency(real_broker):
+    running = 0
+    peak = 0
+
+    async def callback(message):
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    await real_broker.subscribe("email", callback, routing_key="send_email", prefetch_count=10, concurrency=2)
+    queue = real_broker.channel.declare_queue.return_value
+    handler = queue.consume.await_args.args[0]
+
+    await asyncio.gather(*(FakeMessage().deliver(handler) for _ in range(8)))
+
+    assert peak == 2
+
+
+class FakeMessage:
+    """Messaggio in arrivo simulato con il context manager process() di aio-pika."""
+
+    def __init__(self, headers=None):
+        self.body = b'{"data": {}}'
+        self.headers = headers or {}
+        self.content_type = "application/json"
+        self.message_id = "msg-1"
+        self.type = "send_email"
+        self.acked = False
+        self.requeued = False
+
+    @asynccontextmanager
+    async def process(self, requeue=False, ignore_processed=False):
+        yield
+        self.acked = True
+
+    async def reject(self, requeue=False):
+        self.requeued = requeue
+
+    async def deliver(self, handler):
+        await handler(self)
+        return self
+
+
+async def subscribe_failing(broker, max_retries):
+    await broker.subscribe("email", AsyncMock(side_effect=ConnectionError("smtp down")), routing_key="send_email",
+                           max_retries=max_retries)
+    queue = broker.channel.declare_queue.return_value
+    return queue.consume.await_args.args[0]
+
+
+@pytest.mark.asyncio
+async def test_subscribe_declares_retry_pipeline(real_broker):
+    await real_broker.subscribe("email", AsyncMock(), routing_key="send_email", max_retries=3)
+
+    declared = [c.args[0] for c in real_broker.channel.declare_queue.await_args_list]
+    assert declared == [
+        "email_service.email.send_email",
+        "email_service.email.send_email.retry.5000",
+        "email_service.email.send_email.retry.10000",
+        "email_service.email.send_email.retry.20000",
+        "email_service.email.dlq",
+    ]
+    retry_args = real_broker.channel.declare_queue.await_args_list[1].kwargs["arguments"]
+    assert retry_args["x-dead-letter-routing-key"] == "email_service.email.send_email"
+    assert retry_args["x-message-ttl"] == 5000
+
+
+@pytest.mark.asyncio
+async def test_failed_message_is_delayed_with_attempt_header(real_broker):
+    handler = await subscribe_failing(real_broker, max_retries=3)
+
+    message = await FakeMessage().deliver(handler)
+
+    assert message.acked
+    published = real_broker.channel.default_exchange.publish.await_args
+    assert published.kwargs["routing_key"] == "email_service.email.send_email.retry.5000"
+    outgoing = published.args[0]
+    assert outgoing.headers[RETRY_ATTEMPT_HEADER] == 1
+    assert outgoing.headers[RETRY_QUEUE_HEADER] == "email_service.email.send_email"
+    assert 4000 <= int(outgoing.expiration * 1000) <= 5000
+
+
+@pytest.mark.asyncio
+async def test_exhausted_message_goes_to_dlq(real_broker):
+    handler = await subscribe_failing(real_broker, max_retries=3)
+
+    await FakeMessage(headers={RETRY_ATTEMPT_HEADER: 3}).deliver(handler)
+
+    published = real_broker.channel.default_exchange.publish.await_args
+    assert published.kwargs["routing_key"] == "email_service.email.dlq"
+    assert published.args[0].headers[RETRY_ATTEMPT_HEADER] == 4
+
+
+@pytest.mark.asyncio
+async def test_replay_dead_letters_resets_attempts(real_broker):
+    dead = FakeMessage(headers={RETRY_ATTEMPT_HEADER: 4, RETRY_QUEUE_HEADER: b"email_service.email.send_email"})
+    dead.ack = AsyncMock()
+    dlq = real_broker.channel.declare_queue.return_value
+    dlq.get = AsyncMock(side_effect=[dead, None])
+
+    replayed = await real_broker.replay_dead_letters("email")
+
+    assert replayed == 1
+    published = real_broker.channel.default_exchange.publish.await_args
+    assert published.kwargs["routing_key"] == "email_service.email.send_email"
+    assert published.args[0].headers[RETRY_ATTEMPT_HEADER] == 0
+    assert published.args[0].type == "send_email"
+    dead.ack.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_replay_dead_letters_parks_messages_without_origin(real_broker):
+    orphan = FakeMessage()
+    orphan.ack = AsyncMock()
+    dead = FakeMessage(headers={RETRY_QUEUE_HEADER: b"email_service.email.send_email"})
+    dead.ack = AsyncMock()
+    dlq = real_broker.channel.declare_queue.return_value
+    dlq.get = AsyncMock(side_effect=[orphan, dead, None])
+
+    # Il messaggio senza coda di origine non blocca quelli successivi
+    assert await real_broker.replay_dead_letters("email") == 1
+    routing_keys = [call.kwargs["routing_key"] for call in real_broker.channel.default_exchange.publish.await_args_list]
+    assert routing_keys == ["email_service.email.parking", "email_service.email.send_email"]
+    orphan.ack.assert_awaited_once()
+    dead.ack.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_publish_message_declares_exchange_once(real_broker):
+    exchange = real_broker.channel.declare_exchange.return_value
+    exchange.publish = AsyncMock()
+
+    await real_broker.publish_message("email", "send_email", {"to": "a@kikohar.com"}, routing_key="send_email")
+    await real_broker.publish_message("email", "send_email", {"to": "b@kikohar.com"}, routing_key="send_email")
+
+    real_broker.channel.declare_exchange.assert_awaited_once()
+    message = exchange.publish.await_args.args[0]
+    envelope = json.loads(message.body)
+    assert envelope["type"] == "send_email"
+    assert envelope["data"] == {"to": "b@kikohar.com"}
+    assert envelope["id"] == message.message_id
+
+
+@pytest.mark.asyncio
+async def test_publish_many_pipelines_confirm_windows(real_broker):
+    exchange = real_broker.channel.declare_exchange.return_value
+    in_flight = 0
+    peak = 0
+
+    async def publish(message, routing_key):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0)
+        in_flight -= 1
+
+    exchange.publish = publish
+
+    published = await real_broker.publish_many("email", "send_email", ({"n": i} for i in range(10)), window=4)
+
+    assert published == 10
+    assert peak == 4
+
+
+@pytest.mark.asyncio
+async def test_publish_many_reports_confirmed_count_on_nack(real_broker):
+    exchange = real_broker.channel.declare_exchange.return_value
+    sent = []
+
+    async def publish(message, routing_key):
+        sent.append(message)
+        if len(sent) == 6:
+            raise aio_pika.exceptions.DeliveryError(None, Basic.Nack())
+
+    exchange.publish = publish
+
+    with pytest.raises(PublishConfirmError) as info:
+        await real_broker.publish_many("email", "send_email", ({"n": i} for i in range(10)), window=4)
+
+    # La seconda finestra viene completata, poi la pubblicazione si ferma
+    assert (info.value.published, info.value.failed, info.value.attempted) == (7, [5], 8)
+    assert len(sent) == 8
+
+
+@pytest.mark.asyncio
+async def test_drain_waits_in_flight_and_requeues_buffered(real_broker):
+    release = asyncio.Event()
+    processed = []
+
+    async def callback(message):
+        await release.wait()
+        processed.append(message)
+
+    await real_broker.subscribe("email", callback, routing_key="send_email", prefetch_count=10, concurrency=1)
+    queue = real_broker.channel.declare_queue.return_value
+    handler = queue.consume.await_args.args[0]
+
+    messages = [FakeMessage() for _ in range(3)]
+    deliveries = [asyncio.create_task(message.deliver(handler)) for message in messages]
+    await asyncio.sleep(0)
+    assert (real_broker.in_flight, real_broker.pending) == (1, 3)
+
+    drain = asyncio.create_task(real_broker.drain(timeout=1))
+    await asyncio.sleep(0)
+    queue.cancel.assert_awaited_once_with("ctag-1")
+    assert not drain.done()
+
+    release.set()
+    assert await drain is True
+    await asyncio.gather(*deliveries)
+
+    assert processed == [messages[0]]
+    assert [message.requeued for message in messages] == [False, True, True]
+    assert real_broker.pending == 0
+
+
+@pytest.mark.asyncio
+async def test_drain_times_out(real_broker):
+    async def callback(message):
+        await asyncio.sleep(10)
+
+    await real_broker.subscribe("email", callback, routing_key="send_email", concurrency=1)
+    handler = real_broker.channel.declare_queue.return_value.consume.await_args.args[0]
+    delivery = asyncio.create_task(FakeMessage().deliver(handler))
+    await asyncio.sleep(0)
+
+    assert await real_broker.drain(timeout=0.01) is False
+    assert real_broker.in_flight == 1
+    delivery.cancel()
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.mark.asyncio
+async def test_broker_records_consume_metrics(real_broker):
+    acked = sample("email_messages_consumed_total", queue="email_service.email.send_email", outcome="acked")
+    waits = sample("email_queue_wait_seconds_count", queue="email_service.email.send_email")
+    await real_broker.subscribe("email", AsyncMock(), routing_key="send_email")
+    handler = real_broker.channel.declare_queue.return_value.consume.await_args.args[0]
+
+    await FakeMessage(headers={PUBLISHED_AT_HEADER: 1_000}).deliver(handler)
+
+    assert sample("email_messages_consumed_total", queue="email_service.email.send_email", outcome="acked") == acked + 1
+    assert sample("email_queue_wait_seconds_count", queue="email_service.email.send_email") == waits + 1
+    assert sample("email_messages_in_flight", queue="email_service.email.send_email") == 0
+
+
+@pytest.mark.asyncio
+async def test_broker_records_retries(real_broker):
+    retried = sample("email_messages_consumed_total", queue="email_service.email.send_email", outcome="retried")
+    handler = await subscribe_failing(real_broker, max_retries=3)
+
+    await FakeMessage().deliver(handler)
+
+    assert sample("email_messages_consumed_total", queue="email_service.email.send_email", outcome="retried") == retried + 1
@@ -0,0 +1,148 @@
+import json
+
+import pytest
+import sentry_sdk
+from unittest.mock import MagicMock
+
+from app.consumers.email import on_email_message
+from app.schemas.email import BatchEmailRequest, EmailEnvelope, _validated_addresses, email_message_adapter
+
+
+def make_message(data, headers=None):
+    message = MagicMock()
+    message.body = json.dumps({"id": "msg-1", "type": "send_email", "data": data}).encode()
+    message.headers = headers or {}
+    message.type = "send_email"
+    message.timestamp = None
+    return message
+
+
+@pytest.mark.asyncio
+async def test_on_email_message_sends_single_email(mock_send_email):
+    await on_email_message(make_message({
+        "to": "test@kikohar.com",
+        "subject": "Test Email",
+        "template_name": "welcome",
+        "context": {},
+    }))
+
+    mock_send_email.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_on_email_message_discards_invalid_payload(mock_send_email):
+    await on_email_message(make_message({"to": "invalid-email"}))
+
+    mock_send_email.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_on_email_message_sends_batch(mock_send_email):
+    await on_email_message(make_message({
+        "subject": "Campaign",
+        "template_name": "welcome",
+        "recipients": [{"to": "first@kikohar.com"}, {"to": "second@kikohar.com"}],
+    }))
+
+    assert mock_send_email.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_on_email_message_retries_batch_when_nothing_sent(mock_send_email):
+    mock_send_email.side_effect = ConnectionError("relay down")
+
+    with pytest.raises(RuntimeError):
+        await on_email_message(make_message({
+            "subject": "Campaign",
+            "template_name": "welcome",
+            "recipients": [{"to": "first@kikohar.com"}],
+        }))
+
+
+@pytest.mark.asyncio
+async def test_on_email_message_skips_redelivered_message(mock_send_email):
+    message = make_message({
+        "to": "test@kikohar.com",
+        "subject": "Test Email",
+        "template_name": "welcome",
+        "context": {},
+    })
+
+    await on_email_message(message)
+    await on_email_message(message)
+
+    mock_send_email.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_on_email_message_retries_only_failed_batch_recipients(mock_send_email):
+    async def fail_second(prepared):
+        if prepared.recipients == ["second@kikohar.com"]:
+            raise ConnectionError("relay down")
+
+    mock_send_email.side_effect = fail_second
+    message = make_message({
+        "subject": "Campaign",
+        "template_name": "welcome",
+        "recipients": [{"to": "first@kikohar.com"}, {"to": "second@kikohar.com"}],
+    })
+
+    with pytest.raises(RuntimeError):
+        await on_email_message(message)
+    mock_send_email.side_effect = None
+    await on_email_message(message)
+
+    sent_to = [call.args[0].recipients for call in mock_send_email.call_args_list]
+    assert sent_to.count(["first@kikohar.com"]) == 1
+    assert sent_to.count(["second@kikohar.com"]) == 2
+
+
+@pytest.mark.asyncio
+async def test_on_email_message_continues_producer_trace(mock_send_email, monkeypatch):
+    from app.core import sentry
+
+    monkeypatch.setattr(sentry, "_sdk", sentry_sdk)  # come dopo init_sentry con SENTRY_DSN
+    trace_id = "771a43a4192642f0b136d5159a501700"
+    traceparents = []
+    mock_send_email.side_effect = lambda *args, **kwargs: traceparents.append(sentry_sdk.get_traceparent())
+
+    await on_email_message(make_message(
+        {"to": "test@kikohar.com", "subject": "Test Email", "template_name": "welcome", "context": {}},
+        headers={"sentry-trace": f"{trace_id}-7a1f6b4b5c2d3e4f-1"},
+    ))
+
+    assert traceparents[0].startswith(trace_id)
+
+
+@pytest.mark.asyncio
+async def test_on_email_message_accepts_bare_payload_and_discards_malformed_json(mock_send_email):
+    message = make_message(None)
+    message.body = b'{"to": "test@kikohar.com", "subject": "Hi", "template_name": "welcome", "context": {}}'
+    message.message_id = "amqp-1"
+    await on_email_message(message)
+
+    mock_send_email.assert_awaited_once()
+
+    message.body = b'{"id": "msg-2", "data": {'
+    await on_email_message(message)
+
+    mock_send_email.assert_awaited_once()
+
+
+def test_email_message_adapter_reuses_validated_addresses_and_interns_template_names():
+    body = json.dumps({"id": "msg-1", "data": {
+        "to": "Test <test@kikohar.com>", "subject": "Hi", "template_name": "welcome", "context": {},
+    }}).encode()
+    first, second = email_message_adapter.validate_json(body), email_message_adapter.validate_json(body)
+
+    assert isinstance(first, EmailEnvelope) and first.id == "msg-1"
+    assert first.data.to is second.data.to and first.data.to.email == "test@kikohar.com"
+    assert first.data.template_name is second.data.template_name
+    batch = email_message_adapter.validate_json(
+        b'{"subject": "Hi", "template_name": "welcome", "recipients": [{"to": "batch-only@kikohar.com"}]}'
+    )
+    assert isinstance(batch, BatchEmailRequest)
+    assert "batch-only@kikohar.com" not in _validated_addresses  # i batch non passano dalla cache
+    for _ in range(2):  # gli indirizzi non validi non vengono messi in cache
+        with pytest.raises(ValueError):
+            email_message_adapter.validate_json(b'{"to": "invalid", "subject": "Hi", "template_name": "x", "context": {}}')
@@ -0,0 +1,115 @@
+import json
+import logging
+import os
+import threading
+
+import pytest
+
+from app.core import executor
+from app.core.logging import JsonFormatter, RateLimitFilter
+from app.core.loop_monitor import LoopLagMonitor
+from app.core.sentry import AdaptiveSampler
+
+
+@pytest.mark.asyncio
+async def test_run_blocking_uses_worker_thread(monkeypatch):
+    monkeypatch.setattr(executor.settings, "RENDER_POOL_KIND", "thread")
+    executor.shutdown_executor()
+
+    thread_name = await executor.run_blocking(lambda: threading.current_thread().name)
+
+    assert thread_name.startswith("render")
+    executor.shutdown_executor()
+
+
+@pytest.mark.asyncio
+async def test_render_process_pool_is_spawned(monkeypatch):
+    monkeypatch.setattr(executor.settings, "RENDER_POOL_KIND", "process")
+    monkeypatch.setattr(executor.settings, "RENDER_POOL_SIZE", 1)
+    executor.shutdown_executor()
+
+    # I processi non nascono da un fork del processo con il listener dei log e l'event loop attivi
+    assert await executor.run_blocking(os.getppid) == os.getpid()
+    assert executor.get_executor()._mp_context.get_start_method() == "spawn"
+    executor.shutdown_executor()
+
+
+@pytest.mark.asyncio
+async def test_run_blocking_inline(monkeypatch):
+    monkeypatch.setattr(executor.settings, "RENDER_POOL_KIND", "inline")
+    executor.shutdown_executor()
+
+    assert await executor.run_blocking(lambda: threading.current_thread().name) == threading.current_thread().name
+
+
+def test_loop_monitor_counts_stalls():
+    monitor = LoopLagMonitor(interval=0.5, warn_threshold=0.1)
+
+    monitor.record(0.01)
+    monitor.record(0.25)
+
+    stats = monitor.stats()
+    assert stats["samples"] == 2
+    assert stats["stalls"] == 1
+    assert stats["max_lag_ms"] == 250.0
+
+
+def test_sampler_rates_and_outliers():
+    sampler = AdaptiveSampler(0.05, {"/health": 0, "send_email": 0.5}, slow_threshold=30)
+
+    assert sampler({"asgi_scope": {"path": "/health"}}) == 0
+    assert sampler({"asgi_scope": {"path": "/api/v1/email/"}}) == 0.05
+    assert sampler({"transaction_context": {"name": "send_email"}, "queue_wait": 1}) == 0.5
+    assert sampler({"transaction_context": {"name": "send_email"}, "queue_wait": 45}) == 1.0
+    assert sampler({"transaction_context": {"name": "send_email"}, "retry_attempt": 2}) == 1.0
+    assert sampler.stats()["forced"] == 2
+
+
+def test_sampler_scales_rates_to_budget():
+    now = [0.0]
+    sampler = AdaptiveSampler(0.5, budget_per_second=10, window=1, clock=lambda: now[0])
+
+    for _ in range(100):  # 100 transazioni/s al 50% = 50 campionate/s, budget 10
+        now[0] += 0.01
+        sampler({"transaction_context": {"name": "send_email"}})
+
+    assert sampler.factor == pytest.approx(0.2)
+    assert sampler({"transaction_context": {"name": "send_email"}}) == pytest.approx(0.1)
+
+
+def make_record(msg, *args, level=logging.INFO, **extra):
+    record = logging.LogRecord("app.test", level, __file__, 1, msg, args, None)
+    record.__dict__.update(extra)
+    return record
+
+
+def test_rate_limit_filter_suppresses_repeated_lines():
+    now = [0.0]
+    log_filter = RateLimitFilter(per_second=2, clock=lambda: now[0])
+
+    passed = [log_filter.filter(make_record("Sent to %s", f"user{i}@kikohar.com")) for i in range(5)]
+    assert passed == [True, True, False, False, False]
+    assert log_filter.filter(make_record("Other line"))
+    assert log_filter.filter(make_record("Sent to %s", "x@kikohar.com", level=logging.ERROR))
+
+    now[0] += 1
+    record = make_record("Sent to %s", "later@kikohar.com")
+    assert log_filter.filter(record)
+    assert record.getMessage() == "Sent to later@kikohar.com (3 similar messages suppressed)"
+
+
+def test_rate_limit_filter_is_bounded_and_accepts_any_msg():
+    log_filter = RateLimitFilter(per_second=1, max_keys=3)
+
+    for i in range(10):
+        assert log_filter.filter(make_record(f"Sent to user{i}@kikohar.com"))
+    assert len(log_filter.buckets) == 3
+    assert log_filter.filter(make_record({"event": "sent"}))  # msg non hashable
+
+
+def test_json_formatter_includes_extra_fields():
+    line = JsonFormatter().format(make_record("Sent to %s", "a@kikohar.com", message_id="msg-1"))
+
+    entry = json.loads(line)
+    assert entry["message"] == "Sent to a@kikohar.com"
+    assert entry["level"] == "INFO" and entry["logger"] == "app.test" and entry["message_id"] == "msg-1"
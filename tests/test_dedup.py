@@ -0,0 +1,51 @@
+import pytest
+
+from app.services.dedup import DeduplicationStore, DeliveryInProgressError
+from app.services.dedup_backend import SQLDeduplicationBackend
+
+
+@pytest.mark.asyncio
+async def test_claim_complete_and_release():
+    store = DeduplicationStore()
+
+    assert await store.claim("msg-1")
+    with pytest.raises(DeliveryInProgressError):
+        await store.claim("msg-1")
+    await store.complete("msg-1")
+    assert not await store.claim("msg-1")
+
+    assert await store.claim("msg-2")
+    store.release("msg-2")
+    assert await store.claim("msg-2")
+    assert store.stats()["duplicates"] == 1
+
+
+@pytest.mark.asyncio
+async def test_memory_entries_are_bounded_and_expire():
+    store = DeduplicationStore(ttl=60, max_entries=2)
+    for key in ("a", "b", "c"):
+        await store.claim(key)
+        await store.complete(key)
+
+    assert await store.claim("a")  # evitto dall'LRU
+    assert not await store.claim("c")
+
+    expired = DeduplicationStore(ttl=-1)
+    await expired.claim("a")
+    await expired.complete("a")
+    assert await expired.claim("a")
+
+
+@pytest.mark.asyncio
+async def test_sqlite_backend_survives_restart(tmp_path):
+    url = f"sqlite:///{tmp_path / 'dedup.db'}"
+    store = DeduplicationStore(backend=SQLDeduplicationBackend(url))
+    await store.claim("msg-1")
+    await store.complete("msg-1")
+    store.backend.close()
+
+    restarted = DeduplicationStore(backend=SQLDeduplicationBackend(url))
+
+    assert not await restarted.claim("msg-1")
+    assert await restarted.claim("msg-2")
+    restarted.backend.close()
@@ -0,0 +1,91 @@
+import base64
+
+import dkim
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from app.services.dkim import get_signer, relaxed_body, relaxed_header, sign_message
+from app.services.message import build_html_message
+
+
+@pytest.fixture(scope="module")
+def key_pair(tmp_path_factory):
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    path = tmp_path_factory.mktemp("dkim") / "mail.pem"
+    path.write_bytes(private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ))
+    public = private_key.public_key().public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return str(path), b"v=DKIM1; k=rsa; p=" + base64.b64encode(public)
+
+
+def verify(data, dns_record, domain="kikohar.com"):
+    record_name = f"mail._domainkey.{domain}.".encode()
+    return dkim.verify(data, dnsfunc=lambda name, timeout=5: dns_record if name == record_name else None)
+
+
+def test_relaxed_canonicalization():
+    assert relaxed_header(b"Subject:  Hello \r\n\t  World ") == b"subject:Hello World\r\n"
+    assert relaxed_body(b"a  b \r\nc\t\r\n\r\n\r\n") == b"a b\r\nc\r\n"
+    assert relaxed_body(b"\r\n\r\n") == b""
+
+
+def test_signed_message_verifies(key_pair):
+    key_path, dns_record = key_pair
+    prepared = build_html_message(
+        "Un oggetto abbastanza lungo da essere ripiegato su più righe dall'header encoder " * 2,
+        "User <user@kikohar.com>", "user@kikohar.com", "<p>Ciao  </p>\n\n", "Noreply <noreply@kikohar.com>",
+        "noreply@kikohar.com",
+    )
+
+    signed = sign_message(prepared, "kikohar.com", "mail", key_path)
+
+    assert signed.data.startswith(b"DKIM-Signature: v=1; a=rsa-sha256; c=relaxed/relaxed; d=kikohar.com; s=mail;")
+    assert signed.recipients == prepared.recipients
+    assert verify(signed.data, dns_record)
+    assert not verify(signed.data.replace(b"Subject: Un", b"Subject: Il"), dns_record)
+    assert not verify(signed.data.replace(b"PHA+", b"PHB+"), dns_record)
+    # Chiave letta e signer creati una sola volta per dominio/selettore
+    assert get_signer.cache_info().currsize == 1
+
+
+@pytest.mark.asyncio
+async def test_send_email_signs_messages(client, mock_send_email, monkeypatch, key_pair):
+    from app.core.config import DKIMKeySettings
+    from app.services import email
+
+    key_path, dns_record = key_pair
+    sender_domain = str(email.conf.MAIL_FROM).rpartition("@")[2]
+    monkeypatch.setattr(email.settings, "DKIM_POOL_SIZE", -1)
+    monkeypatch.setattr(email, "dkim_keys", {
+        sender_domain: DKIMKeySettings(domain=sender_domain, selector="mail", private_key_path=key_path),
+    })
+
+    response = await client.post("/api/v1/email/", json={
+        "to": "test@kikohar.com", "subject": "Hi", "template_name": "welcome", "context": {},
+    })
+
+    assert response.json()["code"] == 200
+    prepared = mock_send_email.await_args.args[0]
+    assert verify(prepared.data, dns_record, sender_domain)
+
+
+@pytest.mark.asyncio
+async def test_send_email_without_key_for_sender_domain_is_unsigned(client, mock_send_email, monkeypatch, key_pair):
+    from app.core.config import DKIMKeySettings
+    from app.services import email
+
+    key_path, _ = key_pair
+    monkeypatch.setattr(email, "dkim_keys", {
+        "other.example": DKIMKeySettings(domain="other.example", selector="mail", private_key_path=key_path),
+    })
+
+    response = await client.post("/api/v1/email/", json={
+        "to": "test@kikohar.com", "subject": "Hi", "template_name": "welcome", "context": {},
+    })
+
+    assert response.json()["code"] == 200
+    assert b"DKIM-Signature" not in mock_send_email.await_args.args[0].data
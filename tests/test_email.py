@@ -65,3 +65,151 @@ async def test_send_email_missing_template(client):
     # Se voglio davvero testare il fallimento, dovrei usare side_effect sul mock.
     
     assert data["message"] == "Email sent successfully"
+
+@pytest.mark.asyncio
+async def test_send_email_batch_success(client, mock_send_email):
+    payload = {
+        "subject": "Campaign",
+        "template_name": "welcome",
+        "context": {"campaign": "autumn"},
+        "recipients": [
+            {"to": "First <first@kikohar.com>", "context": {"username": "first"}},
+            {"to": "second@kikohar.com"},
+        ]
+    }
+    response = await client.post("/api/v1/email/batch", json=payload)
+
+    assert response.status_code == 200, f"Response: {response.json()}"
+    data = response.json()
+    assert data["code"] == 200
+    assert data["sent"] == 2
+    assert data["failed"] == 0
+    assert [r["to"] for r in data["results"]] == ["First <first@kikohar.com>", "second <second@kikohar.com>"]
+    assert mock_send_email.call_count == 2
+
+@pytest.mark.asyncio
+async def test_send_email_batch_reports_per_recipient_failures(client, mock_send_email):
+    async def fail_second(prepared):
+        if prepared.recipients == ["second@kikohar.com"]:
+            raise ConnectionError("relay down")
+
+    mock_send_email.side_effect = fail_second
+    payload = {
+        "subject": "Campaign",
+        "template_name": "welcome",
+        "recipients": [{"to": "first@kikohar.com"}, {"to": "second@kikohar.com"}]
+    }
+    response = await client.post("/api/v1/email/batch", json=payload)
+
+    data = response.json()
+    assert data["code"] == 207
+    assert data["sent"] == 1
+    assert data["failed"] == 1
+    assert data["results"][1]["detail"] == "relay down"
+
+@pytest.mark.asyncio
+async def test_send_email_batch_validation_error(client):
+    payload = {
+        "subject": "Campaign",
+        "template_name": "welcome",
+        "recipients": [{"to": "first@kikohar.com"}, {"to": "invalid-email"}]
+    }
+    response = await client.post("/api/v1/email/batch", json=payload)
+    assert response.status_code == 422
+
+@pytest.mark.asyncio
+async def test_send_email_builds_mime_off_loop(client, mock_send_email):
+    from email import message_from_bytes
+    payload = {
+        "to": "Test User <test@kikohar.com>",
+        "subject": "Test Email",
+        "template_name": "welcome",
+        "context": {"username": "testuser"}
+    }
+    await client.post("/api/v1/email/", json=payload)
+
+    prepared = mock_send_email.call_args.args[0]
+    assert prepared.recipients == ["test@kikohar.com"]
+    parsed = message_from_bytes(prepared.data)
+    assert parsed["To"] == "Test User <test@kikohar.com>"
+    assert parsed["Subject"] == "Test Email"
+    assert b"Mocked Email Content" in parsed.get_payload()[0].get_payload(decode=True)
+
+@pytest.mark.asyncio
+async def test_send_email_batch_renders_off_loop(client, mock_send_email, monkeypatch):
+    import threading
+    from app.services import email
+
+    render_threads = []
+    original_render = email.bulk_renderer.render
+
+    def render(*args):
+        render_threads.append(threading.current_thread())
+        return original_render(*args)
+
+    monkeypatch.setattr(email.bulk_renderer, "render", render)
+    payload = {
+        "subject": "Campaign",
+        "template_name": "welcome",
+        "recipients": [{"to": "a@kikohar.com", "context": {"n": 1}}, {"to": "b@kikohar.com"}],
+        "merge_recipients": True,
+    }
+    response = await client.post("/api/v1/email/batch", json=payload)
+
+    assert response.json()["sent"] == 2
+    assert len(render_threads) == 2 and threading.main_thread() not in render_threads
+
+@pytest.mark.asyncio
+async def test_send_email_idempotency_key(client, mock_send_email):
+    payload = {
+        "to": "test@kikohar.com",
+        "subject": "Test Email",
+        "template_name": "welcome",
+        "context": {}
+    }
+    headers = {"Idempotency-Key": "order-42"}
+    first = await client.post("/api/v1/email/", json=payload, headers=headers)
+    second = await client.post("/api/v1/email/", json=payload, headers=headers)
+
+    assert first.json()["message"] == "Email sent successfully"
+    assert second.json()["message"] == "Email already sent"
+    mock_send_email.assert_called_once()
+
+@pytest.mark.asyncio
+async def test_send_email_batch_merges_recipients_by_domain(client, mock_send_email, monkeypatch):
+    import aiosmtplib
+    from app.core.config import settings
+
+    monkeypatch.setattr(settings, "SMTP_MAX_RECIPIENTS_PER_TRANSACTION", 2)
+
+    async def sendmail(prepared):
+        refused = {"b@kikohar.com": aiosmtplib.SMTPResponse(550, "no such user")}
+        return {address: refused[address] for address in prepared.recipients if address in refused}, "250 OK"
+
+    mock_send_email.side_effect = sendmail
+    payload = {
+        "subject": "Campaign",
+        "template_name": "welcome",
+        "merge_recipients": True,
+        "recipients": [
+            {"to": "a@kikohar.com"}, {"to": "b@kikohar.com"}, {"to": "c@kikohar.com"},
+            {"to": "d@example.org"}, {"to": "e@kikohar.com", "context": {"username": "e"}},
+        ]
+    }
+    response = await client.post("/api/v1/email/batch", json=payload, headers={"Idempotency-Key": "campaign-1"})
+
+    data = response.json()
+    assert data["code"] == 207
+    assert [r["code"] for r in data["results"]] == [200, 500, 200, 200, 200]
+    assert "550" in data["results"][1]["detail"]
+
+    transactions = sorted(call.args[0].recipients for call in mock_send_email.await_args_list)
+    assert transactions == [["a@kikohar.com", "b@kikohar.com"], ["c@kikohar.com"], ["d@example.org"],
+                            ["e@kikohar.com"]]
+    merged = next(call.args[0] for call in mock_send_email.await_args_list if len(call.args[0].recipients) == 2)
+    assert b"To: undisclosed-recipients:;" in merged.data
+
+    # Ripetendo il batch viene ritentato solo il destinatario rifiutato
+    mock_send_email.reset_mock()
+    await client.post("/api/v1/email/batch", json=payload, headers={"Idempotency-Key": "campaign-1"})
+    assert [call.args[0].recipients for call in mock_send_email.await_args_list] == [["b@kikohar.com"]]
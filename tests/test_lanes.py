@@ -0,0 +1,107 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.broker import published_at
+from app.services.lanes import BULK, TRANSACTIONAL, LaneScheduler
+
+
+async def run_lanes(scheduler, lanes, order):
+    release = asyncio.Event()
+
+    async def job(lane, index):
+        async with scheduler.slot(lane):
+            order.append((lane, index))
+            await release.wait()
+
+    tasks = [asyncio.create_task(job(lane, index)) for index, lane in enumerate(lanes)]
+    await asyncio.sleep(0)
+    return tasks, release
+
+
+@pytest.mark.asyncio
+async def test_transactional_is_served_first_and_bulk_keeps_progressing():
+    scheduler = LaneScheduler(4, bulk_max_share=0.5, bulk_min=1)
+    order = []
+
+    # Una campagna occupa la quota bulk, poi arrivano altri bulk e alcune email transazionali
+    tasks, release = await run_lanes(scheduler, [BULK, BULK, BULK, BULK, TRANSACTIONAL, TRANSACTIONAL], order)
+
+    assert scheduler.running == {TRANSACTIONAL: 2, BULK: 2}
+    assert scheduler.stats()[BULK]["waiting"] == 2
+
+    release.set()
+    await asyncio.gather(*tasks)
+    assert sorted(order) == sorted((lane, index) for index, lane in enumerate(
+        [BULK, BULK, BULK, BULK, TRANSACTIONAL, TRANSACTIONAL]))
+
+
+@pytest.mark.asyncio
+async def test_freed_slots_go_to_transactional_but_bulk_is_not_starved():
+    scheduler = LaneScheduler(3, bulk_max_share=1, bulk_min=1)
+    order = []
+
+    busy, release_busy = await run_lanes(scheduler, [TRANSACTIONAL] * 3, order)
+    waiting, release_waiting = await run_lanes(scheduler, [BULK, BULK, TRANSACTIONAL, TRANSACTIONAL], order)
+    assert order == [(TRANSACTIONAL, 0), (TRANSACTIONAL, 1), (TRANSACTIONAL, 2)]
+
+    # Tre slot liberi: uno riservato al bulk, gli altri alle email transazionali in attesa
+    release_busy.set()
+    await asyncio.gather(*busy)
+    assert sorted(order[3:]) == [(BULK, 0), (TRANSACTIONAL, 2), (TRANSACTIONAL, 3)]
+    assert scheduler.stats()[BULK]["waiting"] == 1
+
+    release_waiting.set()
+    await asyncio.gather(*waiting)
+    assert (BULK, 1) in order
+
+
+@pytest.mark.asyncio
+async def test_cancelled_transactional_waiter_does_not_hold_back_bulk():
+    scheduler = LaneScheduler(2, bulk_max_share=1, bulk_min=1)
+    order = []
+
+    busy, release_busy = await run_lanes(scheduler, [TRANSACTIONAL, TRANSACTIONAL], order)
+    abandoned, _ = await run_lanes(scheduler, [TRANSACTIONAL], order)
+    abandoned[0].cancel()
+    await asyncio.gather(*abandoned, return_exceptions=True)
+    assert not scheduler._waiters[TRANSACTIONAL]
+
+    # Liberati gli slot, il bulk può superare bulk_min perché nessuna email transazionale è davvero in attesa
+    release_busy.set()
+    await asyncio.gather(*busy)
+    assert scheduler._can_start(BULK)
+    scheduler.running[BULK] = 1
+    assert scheduler._can_start(BULK)
+
+
+@pytest.mark.asyncio
+async def test_queue_latency_is_recorded_per_lane():
+    scheduler = LaneScheduler(2)
+
+    class Message:
+        headers = {"x-published-at": time.time() - 2}
+        timestamp = None
+
+    async with scheduler.limiter(TRANSACTIONAL)(Message()):
+        pass
+
+    latency = scheduler.stats()[TRANSACTIONAL]["queue_latency"]
+    assert latency["count"] == 1 and latency["max"] >= 2
+    assert scheduler.stats()[BULK]["queue_latency"]["count"] == 0
+
+    Message.headers = {"x-published-at": time.time(), "x-retry-attempt": 1}
+    assert published_at(Message()) is None
+
+
+@pytest.mark.asyncio
+async def test_subscribe_all_declares_one_queue_per_lane(mock_broker):
+    from app.consumers import registry
+
+    scheduler = await registry.subscribe_all(mock_broker, prefetch_count=5, concurrency=4)
+
+    routing_keys = [call.kwargs["routing_key"] for call in mock_broker.subscribe.await_args_list]
+    assert routing_keys == [registry.lanes[TRANSACTIONAL], registry.lanes[BULK]]
+    assert all(call.kwargs["limiter"] is not None for call in mock_broker.subscribe.await_args_list)
+    assert scheduler.concurrency == 4 and registry.lane_scheduler is scheduler
@@ -0,0 +1,104 @@
+import asyncio
+
+import aiosmtplib
+import pytest
+
+from app.services.rate_limit import (
+    AdaptiveConcurrencyLimiter,
+    SendRateLimiter,
+    TokenBucket,
+    is_throttling_error,
+)
+
+
+def test_is_throttling_error_detects_4xx_replies():
+    assert is_throttling_error(aiosmtplib.SMTPResponseException(421, "Too many connections"))
+    assert is_throttling_error(aiosmtplib.SMTPRecipientsRefused([
+        aiosmtplib.SMTPRecipientRefused(451, "Rate limited", "a@kikohar.com"),
+    ]))
+    wrapped = RuntimeError("connect failed")
+    wrapped.__cause__ = aiosmtplib.SMTPConnectResponseError(421, "busy")
+    assert is_throttling_error(wrapped)
+    assert not is_throttling_error(aiosmtplib.SMTPResponseException(550, "No such user"))
+    assert not is_throttling_error(ConnectionError("down"))
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(rate=100, capacity=1)
+    loop = asyncio.get_running_loop()
+
+    start = loop.time()
+    for _ in range(3):
+        await bucket.acquire()
+
+    assert loop.time() - start >= 0.015
+    assert bucket.waits == 2
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_charges_full_cost_above_capacity():
+    bucket = TokenBucket(rate=100, capacity=5)
+    loop = asyncio.get_running_loop()
+
+    start = loop.time()
+    await bucket.acquire(20)  # bucket pieno: passa subito ma lascia un debito di 15 token
+    assert loop.time() - start < 0.01
+    await bucket.acquire()
+
+    assert loop.time() - start >= 0.15
+    assert bucket.waits == 1
+
+
+@pytest.mark.asyncio
+async def test_adaptive_concurrency_decreases_on_throttle_and_recovers():
+    limiter = AdaptiveConcurrencyLimiter(initial=8, min_limit=1, max_limit=8, cooldown=60)
+
+    await limiter.acquire()
+    await limiter.release(throttled=True)
+    assert limiter.limit == 4
+
+    await limiter.acquire()
+    await limiter.release(throttled=True)
+    assert limiter.limit == 4  # stesso burst: nessuna seconda riduzione durante il cooldown
+
+    for _ in range(4):
+        await limiter.acquire()
+        await limiter.release()
+    assert 4.9 < limiter.limit < 5
+
+
+@pytest.mark.asyncio
+async def test_send_rate_limiter_feeds_throttling_back():
+    limiter = SendRateLimiter(max_concurrency=4)
+
+    with pytest.raises(aiosmtplib.SMTPResponseException):
+        async with limiter.limit("smtp.kikohar.com", "noreply@kikohar.com"):
+            raise aiosmtplib.SMTPResponseException(421, "slow down")
+
+    stats = limiter.stats()["servers"]["smtp.kikohar.com"]["concurrency"]
+    assert stats == {"limit": 2.0, "in_flight": 0, "throttled": 1}
+
+
+@pytest.mark.asyncio
+async def test_send_rate_limiter_grows_only_on_success():
+    limiter = SendRateLimiter(min_concurrency=1, max_concurrency=8)
+    limiter._concurrency["smtp.kikohar.com"] = AdaptiveConcurrencyLimiter(2, 1, 8)
+
+    for _ in range(4):
+        with pytest.raises(aiosmtplib.SMTPResponseException):
+            async with limiter.limit("smtp.kikohar.com", "noreply@kikohar.com"):
+                raise aiosmtplib.SMTPResponseException(550, "No such user")
+    assert limiter.stats()["servers"]["smtp.kikohar.com"]["concurrency"]["limit"] == 2
+
+    async with limiter.limit("smtp.kikohar.com", "noreply@kikohar.com"):
+        pass
+    assert limiter.stats()["servers"]["smtp.kikohar.com"]["concurrency"]["limit"] == 2.5
+
+
+def test_hourly_bucket_caps_burst_to_a_minute_of_quota():
+    limiter = SendRateLimiter(per_hour=6000)
+    hourly = limiter._buckets_for(limiter._server_buckets, "smtp.kikohar.com", 0, limiter.per_hour)[0]
+
+    assert hourly.capacity == 100
+    assert hourly.tokens <= 100
@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+import aiosmtplib
+from fastapi_mail.errors import ConnectionErrors
+
+from app.services.relays import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, NoRelayAvailableError, Relay, RelayRouter
+
+
+class FakePool:
+    """Pool SMTP finto: registra gli invii o solleva l'errore configurato."""
+
+    def __init__(self, error=None):
+        self.error = error
+        self.sent = []
+
+    async def sendmail(self, sender, recipients, data):
+        if self.error:
+            raise self.error
+        self.sent.append(recipients)
+        return {}, "250 OK"
+
+    def stats(self):
+        return {}
+
+
+def relay(name, error=None, weight=1, **breaker):
+    return Relay(name=name, pool=FakePool(error), weight=weight, breaker=CircuitBreaker(**breaker))
+
+
+@pytest.mark.asyncio
+async def test_weighted_least_outstanding_balancing():
+    heavy, light = relay("heavy", weight=3), relay("light")
+    router = RelayRouter([heavy, light])
+
+    heavy.outstanding = 2
+    assert router.choose() is heavy  # (2 + 1) / 3 < (0 + 1) / 1
+    heavy.outstanding = 3
+    assert router.choose() is light
+
+
+@pytest.mark.asyncio
+async def test_failover_and_circuit_breaker():
+    broken = relay("broken", error=ConnectionErrors("connection refused"), weight=10, failure_threshold=2,
+                   reset_timeout=60)
+    healthy = relay("healthy")
+    router = RelayRouter([broken, healthy])
+
+    for _ in range(3):
+        await router.sendmail("noreply@kikohar.com", ["a@kikohar.com"], b"data")
+
+    assert len(healthy.pool.sent) == 3
+    assert broken.failed == 2  # dopo due errori il circuito è aperto e il relay non viene più tentato
+    assert broken.breaker.state == OPEN
+    assert router.stats()["failovers"] == 2
+
+
+@pytest.mark.asyncio
+async def test_rejected_message_is_not_failed_over():
+    rejecting = relay("rejecting", error=aiosmtplib.SMTPResponseException(554, "rejected"), weight=10)
+    other = relay("other")
+    router = RelayRouter([rejecting, other])
+
+    with pytest.raises(aiosmtplib.SMTPResponseException):
+        await router.sendmail("noreply@kikohar.com", ["a@kikohar.com"], b"data")
+    assert other.pool.sent == [] and rejecting.breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_no_relay_available_and_half_open_probe():
+    only = relay("only", error=ConnectionErrors("down"), failure_threshold=1, reset_timeout=0)
+    router = RelayRouter([only])
+
+    with pytest.raises(NoRelayAvailableError):
+        await router.sendmail("noreply@kikohar.com", ["a@kikohar.com"], b"data")
+    assert only.breaker.state == OPEN
+
+    # Scaduto il reset timeout passa una sola prova, che richiude il circuito
+    assert only.breaker.allow() and only.breaker.state == HALF_OPEN
+    assert not only.breaker.allow()
+    only.breaker.record_success(0.05)
+    assert only.breaker.state == CLOSED
+
+
+@pytest.mark.asyncio
+async def test_cancelled_half_open_probe_releases_breaker():
+    class HangingPool(FakePool):
+        async def sendmail(self, sender, recipients, data):
+            await asyncio.Event().wait()
+
+    only = Relay(name="only", pool=HangingPool(), breaker=CircuitBreaker(failure_threshold=1, reset_timeout=0))
+    only.breaker.record_failure()
+    router = RelayRouter([only])
+
+    task = asyncio.create_task(router.sendmail("noreply@kikohar.com", ["a@kikohar.com"], b"data"))
+    await asyncio.sleep(0)
+    assert only.breaker.state == HALF_OPEN and not only.breaker.allow()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    # La prova annullata non lascia il relay bloccato in half-open
+    assert only.outstanding == 0 and only.breaker.allow()
+
+
+def test_breaker_opens_on_latency():
+    breaker = CircuitBreaker(latency_threshold=1, min_samples=3, latency_alpha=1)
+    for latency in (0.1, 0.2, 1.5):
+        breaker.record_success(latency)
+    assert breaker.state == OPEN and breaker.trips == 1
@@ -0,0 +1,58 @@
+import pytest
+from jinja2 import DictLoader, Environment
+
+from app.services.rendering import BulkTemplateRenderer
+
+
+@pytest.fixture
+def env():
+    return Environment(autoescape=True, loader=DictLoader({
+        "simple.html": "<p>Ciao {{ username }}</p><a href=\"{{ link }}\">{{ campaign }}</a>{{ username }}",
+        "filtered.html": "<p>Ciao {{ username|upper }}</p>",
+        "conditional.html": "{% if username %}<p>{{ username }}</p>{% endif %}",
+        "layout.html": "<body>{% block content %}{% endblock %}</body>",
+        "child.html": "{% extends 'layout.html' %}{% block content %}{{ username }}{% endblock %}",
+    }))
+
+
+def test_bulk_render_matches_full_render(env):
+    renderer = BulkTemplateRenderer()
+    template = env.get_template("simple.html")
+    shared = {"campaign": "Autunno & Inverno"}
+
+    for recipient in ({"username": "anna", "link": "https://x.test/?a=1&b=2"}, {"username": "<b>", "link": "l"}):
+        assert renderer.render(template, shared, recipient) == template.render(**shared, **recipient)
+
+    assert renderer.misses == 1
+    assert renderer.hits == 1
+
+
+def test_bulk_render_falls_back_when_slot_is_not_plain_output(env):
+    renderer = BulkTemplateRenderer()
+
+    for name in ("filtered.html", "conditional.html"):
+        template = env.get_template(name)
+        assert renderer.render(template, {}, {"username": "anna"}) == template.render(username="anna")
+        assert renderer.render(template, {}, {"username": ""}) == template.render(username="")
+
+    assert renderer.misses == 0
+
+
+def test_bulk_render_follows_inherited_templates(env):
+    renderer = BulkTemplateRenderer()
+    template = env.get_template("child.html")
+
+    assert renderer.render(template, {}, {"username": "anna"}) == "<body>anna</body>"
+    assert renderer.misses == 1
+
+
+def test_bulk_render_cache_is_lru_bounded(env):
+    renderer = BulkTemplateRenderer(max_entries=2)
+    template = env.get_template("simple.html")
+
+    for campaign in ("a", "b", "c"):
+        renderer.render(template, {"campaign": campaign}, {"username": "u", "link": "l"})
+
+    assert len(renderer._cache) == 2
+    renderer.render(template, {"campaign": "a"}, {"username": "u", "link": "l"})
+    assert renderer.misses == 4
@@ -0,0 +1,153 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+
+import aiosmtplib
+import pytest
+from unittest.mock import AsyncMock
+
+from app.schemas.email import EmailRequest
+from app.services.scheduled import DeliveryScheduler, SQLScheduleBackend
+
+
+@pytest.fixture
+def schedule_url(tmp_path):
+    return f"sqlite:///{tmp_path / 'schedule.db'}"
+
+
+def test_send_at_without_timezone_is_utc():
+    request = EmailRequest(to="a@kikohar.com", subject="Hi", template_name="welcome", context={},
+                           send_at="2030-01-01T08:00:00")
+    assert request.send_at == datetime(2030, 1, 1, 8, tzinfo=timezone.utc)
+
+
+def test_same_key_from_two_processes_is_scheduled_once(schedule_url):
+    # Due repliche con lo stesso database: il duplicato è deciso dal vincolo UNIQUE, non da una select preventiva
+    first, second = SQLScheduleBackend(schedule_url), SQLScheduleBackend(schedule_url)
+    assert first.add(b"{}", time.time() + 60, "key")
+    assert not second.add(b"{}", time.time() + 60, "key")
+    assert second.add(b"{}", time.time() + 60) and second.add(b"{}", time.time() + 60)  # senza chiave nessun limite
+    assert first.stats()[0] == 3
+
+
+@pytest.mark.asyncio
+async def test_load_keeps_only_due_emails_in_memory_and_releases_in_order(schedule_url):
+    deliver = AsyncMock()
+    scheduler = DeliveryScheduler(SQLScheduleBackend(schedule_url), deliver, release_rate=0, max_in_memory=2)
+    now = time.time()
+    for i, offset in enumerate((-1, -3, -2, 3600)):
+        await scheduler.add(f"email-{i}".encode(), now + offset, f"key-{i}")
+    assert not await scheduler.add(b"again", now, "key-0")  # chiave già programmata
+
+    # Al massimo max_in_memory email in memoria, le più vicine; quella tra un'ora resta su disco
+    assert await scheduler.load() == 2
+    assert [entry[3] for entry in sorted(scheduler.heap)] == [b"email-1", b"email-2"]
+
+    await scheduler.start()
+    for _ in range(100):
+        if deliver.await_count == 3:
+            break
+        await asyncio.sleep(0.02)
+    await scheduler.close()
+
+    assert [call.args for call in deliver.await_args_list] == [
+        (b"email-1", "key-1"), (b"email-2", "key-2"), (b"email-0", "key-0")
+    ]
+    stats = await DeliveryScheduler(SQLScheduleBackend(schedule_url), deliver).stats()
+    assert stats["depth"] == 1 and stats["next_in"] > 3500
+
+
+@pytest.mark.asyncio
+async def test_release_rate_spreads_due_emails(schedule_url):
+    deliver = AsyncMock()
+    scheduler = DeliveryScheduler(SQLScheduleBackend(schedule_url), deliver, release_rate=20)
+    for i in range(30):
+        await scheduler.add(b"{}", time.time() - 1)
+
+    start = time.monotonic()
+    await scheduler.start()
+    while deliver.await_count < 30:
+        await asyncio.sleep(0.01)
+    await scheduler.close()
+
+    # 20 subito (burst), le altre 10 a 20 al secondo
+    assert time.monotonic() - start >= 0.4
+
+
+@pytest.mark.asyncio
+async def test_rejected_release_is_retried_then_moved_to_failed(schedule_url):
+    deliver = AsyncMock(side_effect=aiosmtplib.SMTPResponseException(554, "rejected"))
+    scheduler = DeliveryScheduler(SQLScheduleBackend(schedule_url), deliver, release_rate=0, poll_interval=0,
+                                  max_attempts=2, max_delay=0)
+    await scheduler.add(b"{}", time.time() - 1)
+
+    for _ in range(2):
+        await scheduler.load()
+        await scheduler._release(scheduler.heap.pop())
+
+    stats = await scheduler.stats()
+    assert deliver.await_count == 2
+    assert stats["depth"] == 0 and stats["failed_depth"] == 1 and stats["parked"] == 1
+
+
+@pytest.mark.asyncio
+async def test_relay_outage_does_not_consume_attempts(schedule_url):
+    deliver = AsyncMock(side_effect=ConnectionError("relay down"))
+    scheduler = DeliveryScheduler(SQLScheduleBackend(schedule_url), deliver, release_rate=0, poll_interval=0,
+                                  max_attempts=2, max_delay=0)
+    await scheduler.add(b"{}", time.time() - 1)
+
+    for _ in range(5):
+        await scheduler.load()
+        await scheduler._release(scheduler.heap.pop())
+
+    stats = await scheduler.stats()
+    assert stats["depth"] == 1 and stats["failed_depth"] == 0 and stats["failed"] == 5
+
+
+@pytest.mark.asyncio
+async def test_send_email_with_future_send_at_is_scheduled(client, mock_send_email, monkeypatch, schedule_url):
+    from app.services import email
+
+    scheduler = DeliveryScheduler(SQLScheduleBackend(schedule_url), email._send_scheduled, release_rate=0)
+    monkeypatch.setattr(email, "scheduler", scheduler)
+    send_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    payload = {"to": "test@kikohar.com", "subject": "Hi", "template_name": "welcome", "context": {},
+               "send_at": send_at.isoformat()}
+
+    response = await client.post("/api/v1/email/", json=payload)
+    assert response.json()["code"] == 202 and response.json()["message"] == "Email scheduled"
+    mock_send_email.assert_not_awaited()
+
+    # All'orario previsto l'email passa da send_email senza essere programmata di nuovo
+    _, _, _, stored, key = scheduler.backend.fetch_due(send_at.timestamp(), 10, 60)[0]
+    await email._send_scheduled(stored, key)
+    mock_send_email.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_future_send_at_fails_when_scheduling_is_disabled(client, mock_send_email, monkeypatch):
+    from app.services import email
+
+    monkeypatch.setattr(email, "scheduler", None)
+    payload = {"to": "test@kikohar.com", "subject": "Hi", "template_name": "welcome", "context": {},
+               "send_at": (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()}
+
+    response = await client.post("/api/v1/email/", json=payload)
+    assert response.json()["code"] == 501
+    mock_send_email.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_consumer_discards_future_send_at_when_scheduling_is_disabled(mock_send_email, monkeypatch):
+    from app.consumers.email import on_email_message
+    from app.services import email
+    from tests.test_consumer import make_message
+
+    monkeypatch.setattr(email, "scheduler", None)
+    send_at = (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()
+
+    # Nessuna eccezione: il messaggio viene confermato e scartato invece di essere riprovato
+    await on_email_message(make_message({"to": "test@kikohar.com", "subject": "Hi", "template_name": "welcome",
+                                         "context": {}, "send_at": send_at}))
+    mock_send_email.assert_not_awaited()
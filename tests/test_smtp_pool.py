@@ -0,0 +1,136 @@
+import asyncio
+
+import pytest
+import aiosmtplib
+
+from app.services import smtp_pool
+from app.services.email import conf
+from app.services.smtp_pool import SMTPConnectionPool
+
+
+class FakeSMTP:
+    """Sessione SMTP finta che registra le chiamate invece di aprire connessioni."""
+    instances = []
+
+    def __init__(self, **kwargs):
+        self.kwargs = kwargs
+        self.is_connected = False
+        self.sent = []
+        self.rset_error = None
+        FakeSMTP.instances.append(self)
+
+    async def connect(self):
+        self.is_connected = True
+
+    async def login(self, username, password):
+        pass
+
+    async def rset(self):
+        if self.rset_error:
+            raise self.rset_error
+
+    async def send_message(self, message):
+        self.sent.append(message)
+        return {}, "OK"
+
+    async def quit(self):
+        self.is_connected = False
+
+    def close(self):
+        self.is_connected = False
+
+
+@pytest.fixture
+def fake_smtp(monkeypatch):
+    FakeSMTP.instances = []
+    monkeypatch.setattr(smtp_pool.aiosmtplib, "SMTP", FakeSMTP)
+    return FakeSMTP
+
+
+@pytest.mark.asyncio
+async def test_pool_metrics_are_labelled_with_relay_name(fake_smtp):
+    from prometheus_client import REGISTRY
+
+    pool = SMTPConnectionPool(conf, name="relay-a:2525", min_size=0, max_size=1)
+    await pool.send_message("msg")
+
+    assert REGISTRY.get_sample_value("email_smtp_send_seconds_count", {"relay": "relay-a:2525"}) == 1
+    assert REGISTRY.get_sample_value("email_smtp_connect_seconds_count", {"relay": "relay-a:2525"}) == 1
+    assert SMTPConnectionPool(conf).name == f"{conf.MAIL_SERVER}:{conf.MAIL_PORT}"
+
+
+@pytest.mark.asyncio
+async def test_pool_reuses_warm_connection(fake_smtp):
+    pool = SMTPConnectionPool(conf, min_size=0, max_size=2)
+
+    await pool.send_message("msg-1")
+    await pool.send_message("msg-2")
+
+    assert len(fake_smtp.instances) == 1
+    assert fake_smtp.instances[0].sent == ["msg-1", "msg-2"]
+    stats = pool.stats()
+    assert stats["opens"] == 1
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+    assert stats["messages_sent"] == 2
+    assert stats["idle"] == 1
+
+
+@pytest.mark.asyncio
+async def test_pool_discards_connection_failing_health_check(fake_smtp):
+    pool = SMTPConnectionPool(conf, min_size=0, max_size=2)
+    await pool.send_message("msg-1")
+    fake_smtp.instances[0].rset_error = aiosmtplib.SMTPServerDisconnected("gone")
+
+    await pool.send_message("msg-2")
+
+    assert len(fake_smtp.instances) == 2
+    assert fake_smtp.instances[1].sent == ["msg-2"]
+    assert pool.metrics.health_check_failures == 1
+    assert pool.metrics.opens == 2
+
+
+@pytest.mark.asyncio
+async def test_pool_drops_broken_connection(fake_smtp):
+    pool = SMTPConnectionPool(conf, min_size=0, max_size=2)
+
+    with pytest.raises(aiosmtplib.SMTPServerDisconnected):
+        async with pool.connection():
+            raise aiosmtplib.SMTPServerDisconnected("lost")
+
+    assert pool.stats()["idle"] == 0
+    assert pool.metrics.failures == 1
+
+
+@pytest.mark.asyncio
+async def test_pool_drops_cancelled_session_but_keeps_rejected_one(fake_smtp):
+    pool = SMTPConnectionPool(conf, min_size=0, max_size=2)
+
+    # Invio annullato a metà: la sessione non torna nel pool
+    with pytest.raises(asyncio.CancelledError):
+        async with pool.connection():
+            raise asyncio.CancelledError()
+    assert pool.stats()["idle"] == 0 and pool.metrics.failures == 0
+    assert not fake_smtp.instances[0].is_connected
+
+    # Messaggio rifiutato: la sessione è sincronizzata e resta riutilizzabile
+    with pytest.raises(aiosmtplib.SMTPResponseException):
+        async with pool.connection():
+            raise aiosmtplib.SMTPResponseException(550, "rejected")
+    assert pool.stats()["idle"] == 1
+
+
+@pytest.mark.asyncio
+async def test_pool_reaps_idle_connections_above_min_size(fake_smtp):
+    pool = SMTPConnectionPool(conf, min_size=1, max_size=3, idle_timeout=60)
+    first = await pool.acquire()
+    second = await pool.acquire()
+    await pool.release(first)
+    await pool.release(second)
+    first.last_used -= 120
+    second.last_used -= 120
+
+    await pool.reap_idle()
+
+    assert pool.size == 1
+    assert pool.metrics.closes == 1
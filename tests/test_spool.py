@@ -0,0 +1,112 @@
+import pytest
+from unittest.mock import AsyncMock
+
+import aiosmtplib
+from fastapi_mail.errors import ConnectionErrors
+
+from app.services.message import PreparedEmail
+from app.services.rate_limit import is_permanent_rejection, is_relay_unavailable
+from app.services.spool import OutboundSpool, SQLSpoolBackend
+
+
+def prepared(address):
+    return PreparedEmail(sender="noreply@kikohar.com", recipients=[address], data=f"To: {address}\r\n\r\nbody".encode())
+
+
+@pytest.fixture
+def spool_url(tmp_path):
+    return f"sqlite:///{tmp_path / 'spool.db'}"
+
+
+def test_is_relay_unavailable():
+    assert is_relay_unavailable(ConnectionErrors("connection refused"))
+    assert is_relay_unavailable(aiosmtplib.SMTPResponseException(421, "try later"))
+    assert not is_relay_unavailable(aiosmtplib.SMTPResponseException(550, "no such user"))
+    assert is_permanent_rejection(aiosmtplib.SMTPResponseException(550, "no such user"))
+    assert not is_permanent_rejection(aiosmtplib.SMTPResponseException(451, "try later"))
+
+
+@pytest.mark.asyncio
+async def test_flush_sends_and_removes_spooled_messages(spool_url):
+    send = AsyncMock(return_value={})
+    spool = OutboundSpool(SQLSpoolBackend(spool_url), send, batch_size=10)
+    for address in ("a@kikohar.com", "b@kikohar.com"):
+        await spool.append(prepared(address))
+
+    stats = await spool.stats()
+    assert stats["depth"] == 2 and stats["oldest_age"] >= 0
+
+    assert await spool.flush() == 2
+    assert [call.args[0].recipients for call in send.await_args_list] == [["a@kikohar.com"], ["b@kikohar.com"]]
+    assert (await spool.stats())["depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_flush_keeps_messages_while_relay_is_down_and_survives_restart(spool_url):
+    send = AsyncMock(side_effect=ConnectionErrors("connection refused"))
+    spool = OutboundSpool(SQLSpoolBackend(spool_url), send, flush_interval=0)
+    for address in ("a@kikohar.com", "b@kikohar.com", "c@kikohar.com"):
+        await spool.append(prepared(address))
+
+    assert await spool.flush() == 0
+    send.assert_awaited_once()  # solo il messaggio sonda
+    assert spool.relay_down
+    spool.backend.close()
+
+    # Riavvio: i messaggi sono ancora su disco e vengono inviati quando il relay torna disponibile
+    recovered = OutboundSpool(SQLSpoolBackend(spool_url), AsyncMock(return_value={}), flush_interval=0)
+    assert await recovered.flush() == 3
+    assert (await recovered.stats())["depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_rejected_message_is_dropped_after_max_attempts(spool_url):
+    send = AsyncMock(side_effect=aiosmtplib.SMTPResponseException(454, "try again"))
+    spool = OutboundSpool(SQLSpoolBackend(spool_url), send, flush_interval=0, max_attempts=2)
+    await spool.append(prepared("a@kikohar.com"))
+
+    await spool.flush()
+    assert (await spool.stats())["depth"] == 1
+    await spool.flush()
+    stats = await spool.stats()
+    assert stats["depth"] == 0 and stats["dropped"] == 1
+
+
+@pytest.mark.asyncio
+async def test_permanent_rejection_is_dropped_and_refused_recipients_are_counted(spool_url):
+    refused = {"c@kikohar.com": aiosmtplib.SMTPResponse(550, "no such user")}
+    send = AsyncMock(side_effect=[aiosmtplib.SMTPResponseException(554, "rejected"), refused])
+    spool = OutboundSpool(SQLSpoolBackend(spool_url), send, flush_interval=0)
+    await spool.append(prepared("a@kikohar.com"))
+    await spool.append(prepared("c@kikohar.com"))
+
+    assert await spool.flush() == 1
+    stats = await spool.stats()
+    assert stats["depth"] == 0 and stats["dropped"] == 1 and stats["refused"] == 1
+
+
+@pytest.mark.asyncio
+async def test_empty_flush_keeps_relay_down(spool_url):
+    spool = OutboundSpool(SQLSpoolBackend(spool_url), AsyncMock(return_value={}))
+    spool.mark_unavailable()
+
+    # Senza messaggi da inviare non c'è prova che il relay sia tornato disponibile
+    assert await spool.flush() == 0
+    assert spool.relay_down
+
+
+@pytest.mark.asyncio
+async def test_send_email_spools_when_relay_is_unavailable(client, mock_send_email, monkeypatch, spool_url):
+    from app.services import email
+
+    spool = OutboundSpool(SQLSpoolBackend(spool_url), AsyncMock(return_value={}))
+    monkeypatch.setattr(email, "spool", spool)
+    mock_send_email.side_effect = ConnectionErrors("connection refused")
+    payload = {"to": "test@kikohar.com", "subject": "Hi", "template_name": "welcome", "context": {}}
+
+    first = await client.post("/api/v1/email/", json=payload)
+    second = await client.post("/api/v1/email/", json=payload)
+
+    assert first.json()["code"] == 202 and second.json()["code"] == 202
+    mock_send_email.assert_awaited_once()  # il secondo invio va direttamente nello spool
+    assert (await spool.stats())["depth"] == 2
@@ -0,0 +1,22 @@
+import json
+import subprocess
+import sys
+
+# Moduli pesanti che il percorso consumer deve importare solo se configurati (o mai, come FastAPI)
+LAZY_MODULES = ("fastapi", "sentry_sdk", "sqlalchemy")
+
+
+def imported_modules(module: str) -> list[str]:
+    code = f"import json, sys, {module}; print(json.dumps(sorted(sys.modules)))"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return json.loads(output)
+
+
+def test_consumer_path_does_not_import_heavy_subsystems(monkeypatch):
+    for name in ("EMAIL_SENTRY_DSN", "EMAIL_DEDUP_BACKEND_URL", "EMAIL_SPOOL_URL", "EMAIL_SCHEDULE_URL"):
+        monkeypatch.delenv(name, raising=False)
+
+    modules = imported_modules("app.consumers.registry")
+
+    assert "app.services.email" in modules
+    assert [name for name in LAZY_MODULES if name in modules] == []
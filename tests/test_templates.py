@@ -0,0 +1,23 @@
+
+from app.services import email
+
+
+def test_warm_templates_fills_bytecode_cache(monkeypatch, tmp_path):
+    monkeypatch.setattr(email.settings, "TEMPLATE_BYTECODE_CACHE_DIR", str(tmp_path / "jinja"))
+    monkeypatch.setattr(email, "templates", email.create_template_environment())
+
+    warmed = email.warm_templates()
+
+    assert warmed == len(email.templates.list_templates(extensions=["html"])) > 0
+    assert len(list((tmp_path / "jinja").iterdir())) == warmed
+
+
+def test_production_templates_skip_filesystem_checks(monkeypatch):
+    monkeypatch.setattr(email.settings, "ENVIRONMENT", "production")
+    monkeypatch.setattr(email.settings, "TEMPLATE_BYTECODE_CACHE_DIR", None)
+
+    env = email.create_template_environment()
+
+    assert env.auto_reload is False
+    assert env.bytecode_cache is None
+    assert env.autoescape is True
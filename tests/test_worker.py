@@ -0,0 +1,69 @@
+import multiprocessing
+import os
+import sys
+import time
+
+from app.worker import Supervisor, share_worker_settings, worker_share
+
+
+def test_worker_share_splits_replica_limits():
+    assert worker_share(20, 4) == 5
+    assert worker_share(10, 4) == 3
+    assert worker_share(2, 4) == 1
+    assert worker_share(0, 4) == 0
+
+
+def test_signing_share_splits_cores_between_workers(monkeypatch):
+    from app.core import executor
+
+    monkeypatch.setattr(executor, "available_cpus", lambda: 8)
+    assert executor.signing_share(4) == 2
+    assert executor.signing_share(8) == 1
+    assert executor.signing_share(16) == 1
+
+
+def test_cgroup_cpu_limit(monkeypatch, tmp_path):
+    from app.core import executor
+
+    cpu_max = tmp_path / "cpu.max"
+    monkeypatch.setattr(executor, "CGROUP_CPU_MAX", str(cpu_max))
+    cpu_max.write_text("150000 100000\n")
+    assert executor.cgroup_cpu_limit() == 2
+    assert executor.available_cpus() <= 2
+    cpu_max.write_text("max 100000\n")
+    assert executor.cgroup_cpu_limit() is None
+
+
+def test_share_worker_settings_splits_per_replica_settings(monkeypatch):
+    from app.core import executor
+    from app.worker import settings
+
+    monkeypatch.setattr(executor, "available_cpus", lambda: 8)
+    monkeypatch.setattr(settings, "DKIM_POOL_SIZE", 0)
+    monkeypatch.setattr(settings, "SCHEDULE_RELEASE_RATE", 50)
+    # setenv fa ripristinare l'ambiente a fine test
+    monkeypatch.setenv("EMAIL_DKIM_POOL_SIZE", "0")
+    monkeypatch.setenv("EMAIL_SCHEDULE_RELEASE_RATE", "50")
+
+    share_worker_settings(4)
+
+    assert os.environ["EMAIL_DKIM_POOL_SIZE"] == "2"
+    assert float(os.environ["EMAIL_SCHEDULE_RELEASE_RATE"]) == 12.5
+
+
+def test_supervisor_restarts_crashed_worker():
+    supervisor = Supervisor(1, target=sys.exit, args=(1,), shutdown_timeout=1,
+                            context=multiprocessing.get_context("fork"))
+    supervisor.start_worker(0)
+    supervisor.processes[0].join()
+
+    supervisor.supervise_once()
+    assert supervisor.restart_at[0] is not None
+    assert supervisor.backoff[0] == 2
+
+    supervisor.restart_at[0] = time.monotonic()
+    supervisor.supervise_once()
+    assert supervisor.restarts == 1
+    supervisor.processes[0].join()
+    assert supervisor.processes[0].exitcode == 1
+    supervisor.shutdown()